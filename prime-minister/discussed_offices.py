@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""Extract the offices discussed in every followup topic.
+
+Topics list the audited offices in a discussed offices line,
+which can continue over multiple lines
+(see tokenize.tokenize_chapter_topic_discussed_offices):
+
+    הגופים המבוקרים: רשות המסים, החשב הכללי - משרד האוצר, המוסד לביטוח
+    לאומי, בנק ישראל.
+
+The lines are joined, split on commas, and every fragment is resolved
+against the combined office names (alternative office names and preface offices)
+using a word trie of their normalized names:
+
+    - a fragment which is an office name as a whole resolves to that office
+    - otherwise it is scanned for the longest office names it contains,
+      so conjunctions e.g. "ורשות החברות הממשלתיות" and names joined without
+      a comma e.g. "משרד הבריאות ומשרד האוצר" are resolved as well
+
+Every name resolves to the id of its canonical name, so each topic
+gets a list of canonical office ids, at a cost linear in the line lengths.
+Fragments which don't contain any known office are kept as unresolved,
+and so are the (normalized) parts of a fragment between the offices it contains
+e.g. "וחברת החשמל" of "משרד האוצר וחברת החשמל", if it isn't a known office.
+
+    python discussed_offices.py followup.txt alternative-office-names.yml preface.json
+"""
+
+import argparse
+import json
+import re
+import sys
+
+import regex
+import tokenize
+import tokens
+from normalize import normalize
+
+
+CONJUNCTION = 'ו'
+
+# separators between discussed offices, other than conjunctions
+SEPARATORS_RE = re.compile(r'[,;،]')
+
+
+class OfficeTrie(object):
+    """Word trie of normalized office names, resolving them to canonical office ids."""
+
+    def __init__(self, alternative_office_names, offices=()):
+        """alternative_office_names: canonical name --> alternative names
+        offices: additional names, which are their own canonical name
+        unless they're an alternative name
+        """
+        canonical_names = {}
+        for name, alternative_names in alternative_office_names.items():
+            canonical_names.setdefault(normalize(name), name)
+            for alternative_name in alternative_names or []:
+                canonical_names.setdefault(normalize(alternative_name), name)
+        for office in offices:
+            canonical_names.setdefault(normalize(office), office.strip())
+
+        self.names = sorted(set(canonical_names.values()))
+        ids = {name: num for (num, name) in enumerate(self.names)}
+
+        self.root = {}
+        for key, name in canonical_names.items():
+            if not key:
+                continue
+            node = self.root
+            for word in key.split():
+                node = node.setdefault(word, {})
+            node[None] = ids[name]
+
+    def match(self, words, start, first=None):
+        """Return (office id, end) of longest office name starting at words[start], or (None, start).
+
+        first: word to match instead of words[start]
+        """
+        best, best_end = None, start
+        node = self.root
+        for i in range(start, len(words)):
+            node = node.get(first if i == start and first is not None else words[i])
+            if node is None:
+                break
+            if None in node:
+                best, best_end = node[None], i + 1
+        return best, best_end
+
+    def resolve(self, fragment):
+        """Return (ids of offices mentioned in fragment in order, unmatched parts of fragment).
+
+        Unmatched parts are runs of normalized words between (or around) office names,
+        as they are i.e. a leading conjunction is only dropped from words starting an office name.
+        """
+        words = normalize(fragment).split()
+
+        ids = []
+        unmatched = []
+        run = []
+        i = 0
+        while i < len(words):
+            office_id, end = self.match(words, i)
+            if office_id is None and len(words[i]) > 1 and words[i].startswith(CONJUNCTION):
+                # only if the rest is an office, otherwise the word is kept as is e.g. ועדת הכספים
+                office_id, end = self.match(words, i, first=words[i][1:])
+
+            if office_id is None:
+                if words[i] != CONJUNCTION:
+                    run.append(words[i])
+                i += 1
+                continue
+
+            if run:
+                unmatched.append(' '.join(run))
+                run = []
+            if office_id not in ids:
+                ids.append(office_id)
+            i = end
+
+        if run:
+            unmatched.append(' '.join(run))
+        return ids, unmatched
+
+
+def extract(text, trie):
+    """Return (office ids, unresolved fragments) of discussed offices text."""
+    match = regex.CHAPTER_TOPIC_DISCUSSED_OFFICES_RE.search(text)
+    if match is not None:
+        text = match.group(2)
+
+    ids = []
+    unresolved = []
+    for fragment in SEPARATORS_RE.split(text):
+        fragment = fragment.strip(' .\n')
+        if not fragment:
+            continue
+
+        fragment_ids, unmatched = trie.resolve(fragment)
+        if not fragment_ids:
+            unresolved.append(fragment)
+        else:
+            unresolved += unmatched
+        ids += [i for i in fragment_ids if i not in ids]
+    return ids, unresolved
+
+
+def topic_discussed_offices(tokenized_lines, trie):
+    """Generate discussed offices of every followup topic in tokenized lines.
+
+    Each topic is a dict with the line number its title started at, its title,
+    canonical ids and names of its discussed offices, and unresolved fragments.
+    """
+    topic = None
+    discussed = None
+
+    def finish():
+        if discussed is not None and topic is not None:
+            ids, unresolved = extract(' '.join(discussed), trie)
+            topic['office_ids'] += [i for i in ids if i not in topic['office_ids']]
+            topic['unresolved'] += unresolved
+
+    for i, line in enumerate(tokenized_lines):
+        typ = line['type']
+        txt = line['text'].strip()
+
+        if typ == tokens.TOKEN_CHAPTER_TOPIC_DISCUSSED_OFFICES_CONTINUE and discussed is not None:
+            discussed.append(txt)
+            continue
+
+        finish()
+        discussed = None
+
+        if typ == tokens.TOKEN_CHAPTER_TOPIC_TITLE_START:
+            if topic is not None:
+                yield dict(topic, offices=[trie.names[i] for i in topic['office_ids']])
+            topic = {'line': i, 'title': txt, 'office_ids': [], 'unresolved': []}
+        elif typ == tokens.TOKEN_CHAPTER_TOPIC_TITLE_CONTINUE and topic is not None:
+            topic['title'] += ' ' + txt
+        elif typ == tokens.TOKEN_CHAPTER_TOPIC_DISCUSSED_OFFICES_START:
+            discussed = [txt]
+
+    finish()
+    if topic is not None:
+        yield dict(topic, offices=[trie.names[i] for i in topic['office_ids']])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract discussed offices of every followup topic.')
+    parser.add_argument('followup', help='followup report text file')
+    parser.add_argument('alternative_office_names', help='alternative office names YAML file')
+    parser.add_argument('preface', help='state-comptroller preface of the report being followed up')
+    parser.add_argument('--dictionary', help='dump canonical office names to this file, where an id is a list index')
+    args = parser.parse_args()
+
+    with open(args.followup, 'r') as f:
+        LINES = [l for l in f.readlines() if l.strip() != '']  # filter empty lines
+
+    TOKENIZED_LINES = tokenize.tokenize(LINES, args.alternative_office_names, args.preface)
+
+    OFFICES, _ = tokenize.get_state_comptroller_offices_and_defects(args.preface)
+    TRIE = OfficeTrie(tokenize.get_alternative_office_names(args.alternative_office_names), OFFICES)
+
+    if args.dictionary:
+        with open(args.dictionary, 'w') as f:
+            json.dump(TRIE.names, f, ensure_ascii=False)
+
+    for TOPIC in topic_discussed_offices(TOKENIZED_LINES, TRIE):
+        print(json.dumps(TOPIC, ensure_ascii=False))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""Link tokenized followup topics back to the state-comptroller topics they answer.
+
+Every followup topic is introduced by an office name and a topic title
+(see tokenize.tokenize_chapter_office_names, tokenize_chapter_topics),
+followed by defect replies from one or more replying offices.
+
+We match each followup topic to a comptroller topic from topics.json
+by title similarity, without comparing every pair:
+
+    1. blocking: only comptroller topics of the same report and of the same
+       (canonical) office or one of the replying offices are compared.
+       topics whose office is unknown fall back to the whole report.
+    2. candidates inside a block are fetched from an inverted index of
+       title character trigrams, so only titles sharing trigrams are scored.
+    3. candidates are scored using the dice coefficient of their trigram sets.
+
+The result is a join table in JSON Lines format, one line per followup topic.
+"""
+
+import argparse
+import json
+import os.path
+import sys
+from collections import Counter
+
+import tokenize
+import tokens
+from normalize import ngrams, normalize
+
+
+def get_office_canonical_names(path):
+    """Return alternative office name --> canonical name mapping."""
+    canonical_names = {}
+    for name, alternative_names in tokenize.get_alternative_office_names(path).items():
+        canonical_names[normalize(name)] = name
+        for alternative_name in alternative_names or []:
+            canonical_names[normalize(alternative_name)] = name
+    return canonical_names
+
+
+def followup_topics(tokenized_lines):
+    """Generate followup topics from tokenized lines.
+
+    Each topic is a dict with the line number its title started at,
+    the office discussed in the current chapter, its title,
+    and the offices replying to its defects.
+    """
+    office = None
+    topic = None
+    for i, line in enumerate(tokenized_lines):
+        typ = line['type']
+        txt = line['text'].strip()
+
+        if typ == tokens.TOKEN_CHAPTER_OFFICE_NAME:
+            office = txt
+        elif typ == tokens.TOKEN_CHAPTER_TOPIC_TITLE_START:
+            if topic is not None:
+                yield topic
+            topic = {'line': i, 'office': office, 'title': txt, 'reply_offices': []}
+        elif typ == tokens.TOKEN_CHAPTER_TOPIC_TITLE_CONTINUE and topic is not None:
+            topic['title'] += ' ' + txt
+        elif typ == tokens.TOKEN_DEFECT_REPLY_OFFICE_NAME and topic is not None:
+            if txt not in topic['reply_offices']:
+                topic['reply_offices'].append(txt)
+
+    if topic is not None:
+        yield topic
+
+
+class TopicLinker(object):
+    """Block and index comptroller topics for matching followup topics against them."""
+
+    def __init__(self, topics, chapters, canonical_names, min_score=0.3):
+        self.topics = topics
+        self.canonical_names = canonical_names
+        self.min_score = min_score
+
+        self.grams = []
+        self.index = {}  # trigram --> topic numbers
+        self.blocks = {}  # (report id, canonical office) --> topic numbers
+        self.reports = {}  # report id --> topic numbers
+
+        for num, topic in enumerate(topics):
+            grams = ngrams(topic['title'] or '')
+            self.grams.append(grams)
+            for gram in grams:
+                self.index.setdefault(gram, []).append(num)
+
+            offices = [topic['office']] + chapters.get((topic['id'], topic['chapter_num']), [])
+            for office in offices:
+                if office:
+                    self.blocks.setdefault((topic['id'], self.canonical(office)), set()).add(num)
+            self.reports.setdefault(topic['id'], set()).add(num)
+
+    def canonical(self, office):
+        return self.canonical_names.get(normalize(office), normalize(office))
+
+    def block(self, report_ids, offices):
+        """Return topic numbers to compare with, for given reports and offices."""
+        block = set()
+        for report_id in report_ids:
+            for office in offices:
+                block |= self.blocks.get((report_id, self.canonical(office)), set())
+
+        # unknown office, compare with every topic of the report
+        if not block:
+            for report_id in report_ids:
+                block |= self.reports.get(report_id, set())
+
+        return block
+
+    def link(self, title, report_ids, offices):
+        """Return best matching (topic number, score) for title, or (None, 0)."""
+        block = self.block(report_ids, offices)
+        grams = ngrams(title)
+
+        shared = Counter()
+        for gram in grams:
+            for num in self.index.get(gram, []):
+                if num in block:
+                    shared[num] += 1
+
+        best, best_score = None, 0.0
+        for num, count in shared.items():
+            score = 2.0 * count / (len(grams) + len(self.grams[num]))
+            if score > best_score:
+                best, best_score = num, score
+
+        if best_score < self.min_score:
+            return None, 0.0
+        return best, best_score
+
+
+def load_comptroller_output(dirname):
+    """Load topics (with their ordinal in their chapter) and chapter offices from state-comptroller output."""
+    topics = []
+    ordinals = Counter()
+    with open(os.path.join(dirname, 'topics.json'), 'r') as f:
+        for line in f:
+            topic = json.loads(line)
+            ordinals[(topic['id'], topic['chapter_num'])] += 1
+            topic['ordinal'] = ordinals[(topic['id'], topic['chapter_num'])]
+            topics.append(topic)
+
+    chapters = {}
+    chapters_path = os.path.join(dirname, 'chapters.json')
+    if os.path.exists(chapters_path):
+        with open(chapters_path, 'r') as f:
+            for line in f:
+                chapter = json.loads(line)
+                chapters[(chapter['id'], chapter['chapter_num'])] = chapter['offices']
+
+    return topics, chapters
+
+
+def link(tokenized_lines, linker, report_ids):
+    """Generate join table rows for all followup topics in tokenized lines."""
+    for topic in followup_topics(tokenized_lines):
+        offices = [o for o in [topic['office']] + topic['reply_offices'] if o]
+        num, score = linker.link(topic['title'], report_ids, offices)
+        match = linker.topics[num] if num is not None else {}
+
+        yield {
+            'followup_line': topic['line'],
+            'followup_office': topic['office'],
+            'followup_title': topic['title'],
+            'reply_offices': topic['reply_offices'],
+
+            'report_id': match.get('id'),
+            'chapter_num': match.get('chapter_num'),
+            'ordinal': match.get('ordinal'),
+            'topic_title': match.get('title'),
+            'score': round(score, 3),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Link followup topics to state-comptroller topics.')
+    parser.add_argument('followup', help='followup report text file')
+    parser.add_argument('alternative_office_names', help='alternative office names YAML file')
+    parser.add_argument('preface', help='state-comptroller preface of the report being followed up')
+    parser.add_argument('comptroller_output', help='state-comptroller scraper output directory')
+    parser.add_argument('--any-report', action='store_true',
+                        help='match against topics of all reports, not just the preface report')
+    parser.add_argument('--min-score', type=float, default=0.3)
+    args = parser.parse_args()
+
+    with open(args.followup, 'r') as f:
+        LINES = [l for l in f.readlines() if l.strip() != '']  # filter empty lines
+
+    TOKENIZED_LINES = tokenize.tokenize(LINES, args.alternative_office_names, args.preface)
+
+    TOPICS, CHAPTERS = load_comptroller_output(args.comptroller_output)
+    LINKER = TopicLinker(TOPICS, CHAPTERS,
+                         get_office_canonical_names(args.alternative_office_names),
+                         min_score=args.min_score)
+
+    if args.any_report:
+        REPORT_IDS = list(LINKER.reports)
+    else:
+        with open(args.preface, 'r') as f:
+            REPORT_IDS = [json.load(f)['id']]
+
+    for row in link(TOKENIZED_LINES, LINKER, REPORT_IDS):
+        print(json.dumps(row, ensure_ascii=False))
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""Mine alternative office names from the whole corpus.
+
+Collects every office name mentioned in state-comptroller output
+(preface offices, chapter offices, topic office)
+and in tokenized followup reports (TOKEN_CHAPTER_OFFICE_NAME lines),
+clusters spelling variants of the same office, and dumps the clusters
+as an alternative office names YAML file (see tokenize.get_alternative_office_names).
+
+Names are clustered without comparing every pair:
+
+    1. names with the same skeleton are merged.
+       the skeleton is the normalized name (see normalize.normalize),
+       without the definite article ה at the beginning of words,
+       and without the vowel letters ו and י inside words
+       e.g. ביטחון הפנים, בטחון פנים --> בטחן פנם
+    2. skeletons within edit distance of each other are merged.
+       candidates are only skeletons sharing a single-deletion variant
+       (e.g. abc --> bc, ac, ab), and are verified using the actual edit distance.
+       short skeletons (acronyms, single words) are only merged by step 1,
+       and so are skeletons differing in a short word (see fuzzy_match).
+
+Existing (hand curated) alternative office names files can be given as seeds:
+their names are merged as they are, and their canonical names are kept.
+Otherwise the most frequent name in a cluster becomes its canonical name.
+
+    python mine_aliases.py ../state-comptroller/scraper/output \\
+        --seed alternative-office-names.67a.yml --seed alternative-office-names.67b.yml \\
+        --followup followup.67a.txt preface.67a.json > alternative-office-names.yml
+"""
+
+import argparse
+import json
+import os.path
+import sys
+from collections import Counter
+
+import yaml
+
+import tokenize
+import tokens
+from normalize import normalize
+
+
+# typographic quotes used instead of gershayim/geresh e.g. בע“מ
+QUOTES = str.maketrans('\u201c\u201d\u201e\u2018\u2019`', '\"\"\"\'\'\'')
+
+
+def skeleton(name):
+    """Return blocking key of office name, ignoring common spelling variations."""
+    words = []
+    for word in normalize(name.translate(QUOTES)).split():
+        if len(word) > 2 and word[0] == 'ה':
+            word = word[1:]
+        words.append(word[0] + word[1:].replace('ו', '').replace('י', ''))
+    return ' '.join(words)
+
+
+def deletions(text):
+    """Return all variants of text with a single character deleted, and text itself."""
+    return {text} | {text[:i] + text[i+1:] for i in range(len(text))}
+
+
+def edit_distance(first, second, limit):
+    """Return levenshtein distance of strings, or limit + 1 if it's larger than limit."""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+
+    previous = list(range(len(second) + 1))
+    for i, a in enumerate(first, start=1):
+        current = [i]
+        for j, b in enumerate(second, start=1):
+            current.append(min(previous[j] + 1, current[j-1] + 1, previous[j-1] + (a != b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def fuzzy_match(first, second, max_distance, min_word_length=4):
+    """Return whether skeletons are within edit distance, differing only in long enough words.
+
+    Short words are usually names e.g. בית דגן and בית ג'ן,
+    where a single letter is the difference between two distinct offices.
+    """
+    if edit_distance(first, second, max_distance) > max_distance:
+        return False
+
+    first_words, second_words = first.split(), second.split()
+    if len(first_words) != len(second_words):
+        return False
+    return all(a == b or min(len(a), len(b)) >= min_word_length for (a, b) in zip(first_words, second_words))
+
+
+def comptroller_office_names(dirname):
+    """Count office names mentioned in state-comptroller output directory."""
+    names = Counter()
+    with open(os.path.join(dirname, 'prefaces.json'), 'r') as f:
+        for line in f:
+            names.update(json.loads(line)['offices_to_defects'].keys())
+    with open(os.path.join(dirname, 'chapters.json'), 'r') as f:
+        for line in f:
+            names.update(json.loads(line)['offices'])
+    with open(os.path.join(dirname, 'topics.json'), 'r') as f:
+        for line in f:
+            office = json.loads(line)['office']
+            if office:
+                names[office] += 1
+    return names
+
+
+def followup_office_names(path, alternative_office_names_path, preface_path):
+    """Count chapter office names in tokenized followup report."""
+    with open(path, 'r') as f:
+        lines = [l for l in f.readlines() if l.strip() != '']  # filter empty lines
+
+    return Counter(line['text'].strip() for line in tokenize.tokenize(lines, alternative_office_names_path, preface_path)
+                   if line['type'] == tokens.TOKEN_CHAPTER_OFFICE_NAME)
+
+
+def cluster(names, groups=(), min_fuzzy_length=8, max_distance=1):
+    """Cluster office names.
+
+    names: name --> count
+    groups: lists of names known to be the same office
+    max_distance: at most 1, since candidates only share single-deletion variants
+    Returns list of clusters, each a list of names.
+    """
+    parents = {}
+
+    def find(name):
+        parents.setdefault(name, name)
+        while parents[name] != name:
+            parents[name] = parents[parents[name]]
+            name = parents[name]
+        return name
+
+    def union(first, second):
+        parents[find(first)] = find(second)
+
+    for group in groups:
+        for name in group[1:]:
+            union(name, group[0])
+
+    # merge names sharing a skeleton
+    skeletons = {}
+    for name in list(names) + [name for group in groups for name in group]:
+        key = skeleton(name)
+        if key:
+            union(name, skeletons.setdefault(key, name))
+
+    # merge skeletons within edit distance, sharing a deletion variant
+    variants = {}
+    for key in skeletons:
+        if len(key) < min_fuzzy_length:
+            continue
+        for variant in deletions(key):
+            variants.setdefault(variant, []).append(key)
+
+    for candidates in variants.values():
+        for i, first in enumerate(candidates):
+            for second in candidates[i+1:]:
+                if fuzzy_match(first, second, max_distance):
+                    union(skeletons[first], skeletons[second])
+
+    clusters = {}
+    for name in parents:
+        clusters.setdefault(find(name), []).append(name)
+    return list(clusters.values())
+
+
+def alternative_office_names(clusters, names, canonical_names=()):
+    """Return canonical name --> alternative names mapping, for clusters with more than one name.
+
+    Canonical names are taken from canonical_names if a cluster contains one,
+    otherwise it's the most frequent name of the cluster
+    not wrapped in stray quotes or dashes.
+    """
+    canonical_names = set(canonical_names)
+    alternatives = {}
+    for names_cluster in clusters:
+        names_cluster = sorted(set(n.strip() for n in names_cluster))
+        if len(names_cluster) < 2:
+            continue
+
+        canonical = max(names_cluster, key=lambda n: (n in canonical_names,
+                                                      n == n.strip('"\'\u201c\u201d-'),
+                                                      names.get(n, 0),
+                                                      -len(n)))
+        alternatives[canonical] = [n for n in names_cluster if n != canonical]
+    return alternatives
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mine alternative office names, and dump them as YAML.')
+    parser.add_argument('comptroller_output', help='state-comptroller scraper output directory')
+    parser.add_argument('--seed', action='append', default=[],
+                        help='existing alternative office names YAML file (can be repeated)')
+    parser.add_argument('--followup', nargs=2, action='append', default=[], metavar=('TEXT', 'PREFACE'),
+                        help='followup report text file, and the state-comptroller preface it follows up. '
+                             'tokenized using the first seed file (can be repeated)')
+    parser.add_argument('--max-distance', type=int, default=1, choices=[0, 1],
+                        help='edit distance of merged skeletons. '
+                             'candidates only share single-deletion variants, so larger distances are never found')
+    parser.add_argument('--min-fuzzy-length', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.followup and not args.seed:
+        parser.error('--followup requires a --seed alternative office names file for tokenizing')
+
+    NAMES = comptroller_office_names(args.comptroller_output)
+    for followup_path, preface_path in args.followup:
+        NAMES.update(followup_office_names(followup_path, args.seed[0], preface_path))
+
+    GROUPS = []
+    for seed_path in args.seed:
+        for name, alternative_names in tokenize.get_alternative_office_names(seed_path).items():
+            GROUPS.append([name] + list(alternative_names or []))
+
+    CLUSTERS = cluster(NAMES, GROUPS, args.min_fuzzy_length, args.max_distance)
+    ALTERNATIVES = alternative_office_names(CLUSTERS, NAMES, [group[0] for group in GROUPS])
+
+    yaml.dump(ALTERNATIVES, sys.stdout, allow_unicode=True, default_flow_style=False, explicit_start=True)
+    print('{} names, {} clusters with alternative names'.format(len(NAMES), len(ALTERNATIVES)), file=sys.stderr)
@@ -0,0 +1,23 @@
+"""Text normalization for matching names and titles across sources."""
+import re
+
+# hebrew cantillation marks and niqqud
+NIQQUD_RE = re.compile('[\u0591-\u05c7]')
+
+# quotes inside a word are gershayim/geresh used in acronyms e.g. צה"ל
+INNER_QUOTES_RE = re.compile('(?<=\\w)["\'\u05f3\u05f4](?=\\w)')
+
+# everything which isn't a letter or a digit
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """Strip niqqud, acronym quotes and punctuation, and collapse whitespace."""
+    text = INNER_QUOTES_RE.sub('', NIQQUD_RE.sub('', text.lower()))
+    return ' '.join(NON_WORD_RE.sub(' ', text).split())
+
+
+def ngrams(text, n=3):
+    """Return set of character n-grams of normalized text, padded with spaces."""
+    text = ' {} '.format(normalize(text))
+    return {text[i:i+n] for i in range(len(text) - n + 1)}
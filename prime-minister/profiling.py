@@ -0,0 +1,116 @@
+"""Opt-in profiling of tokenizer passes.
+
+Records for every tokenize_* pass (including the toc.py passes):
+
+    - wall time spent in the pass
+    - lines examined: lines not yet tokenized when the pass started,
+      since all passes skip already tokenized lines
+    - lines tokenized by the pass
+    - regex evaluations, by regex name
+
+and a histogram of the final token types.
+
+Profiling is enabled by passing a Profiler to tokenize.tokenize(),
+or running tokenize.py with --profile.
+Passes aren't instrumented at all when no profiler is given.
+"""
+
+import json
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+import regex
+
+
+class CountingPattern(object):
+    """Compiled regex proxy counting search() calls for the profiler."""
+
+    def __init__(self, name, pattern, profiler):
+        self.name = name
+        self.pattern = pattern
+        self.profiler = profiler
+
+    def search(self, *args, **kwargs):
+        self.profiler.regex_evaluated(self.name)
+        return self.pattern.search(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.pattern, attr)
+
+
+class Profiler(object):
+    """Collect per-pass timings and counters of a single tokenize() run."""
+
+    def __init__(self):
+        self.passes = OrderedDict()
+        self.current = None
+        self.token_types = Counter()
+
+    @contextmanager
+    def rule(self, name, tokenized_lines):
+        """Profile a single tokenizer pass over tokenized_lines."""
+        stats = self.passes.setdefault(name, {
+            'calls': 0,
+            'wall': 0.0,
+            'lines_examined': 0,
+            'lines_tokenized': 0,
+            'regex_evaluations': Counter(),
+        })
+        untyped = sum(1 for line in tokenized_lines if line['type'] is None)
+
+        parent, self.current = self.current, stats
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats['wall'] += time.perf_counter() - start
+            self.current = parent
+
+            stats['calls'] += 1
+            stats['lines_examined'] += untyped
+            stats['lines_tokenized'] += untyped - sum(1 for line in tokenized_lines if line['type'] is None)
+
+    def regex_evaluated(self, name):
+        if self.current is not None:
+            self.current['regex_evaluations'][name] += 1
+
+    @contextmanager
+    def count_regexes(self):
+        """Replace compiled regexes in the regex module with counting proxies."""
+        originals = {name: value for (name, value) in vars(regex).items() if name.endswith('_RE') or '_RE_' in name}
+        for name, value in originals.items():
+            setattr(regex, name, CountingPattern(name, value, self))
+        try:
+            yield
+        finally:
+            for name, value in originals.items():
+                setattr(regex, name, value)
+
+    def finish(self, tokenized_lines):
+        """Record histogram of final token types."""
+        self.token_types.update(str(line['type']) for line in tokenized_lines)
+
+    def report(self):
+        passes = OrderedDict()
+        for name, stats in self.passes.items():
+            passes[name] = dict(stats, regex_evaluations=dict(stats['regex_evaluations']))
+
+        return {
+            'passes': passes,
+            'regex_evaluations': sum(sum(s['regex_evaluations'].values()) for s in self.passes.values()),
+            'token_types': dict(self.token_types.most_common()),
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+
+
+def run(profiler, name, func, tokenized_lines, *args):
+    """Run tokenizer pass func, profiling it if profiler isn't None."""
+    if profiler is None:
+        return func(tokenized_lines, *args)
+
+    with profiler.rule(name, tokenized_lines):
+        return func(tokenized_lines, *args)
@@ -1,9 +1,10 @@
 """Tokenize table of contents (TOC)."""
 import regex
 import tokens
+from profiling import run
 
 
-def tokenize(tokenized_lines, office_names):
+def tokenize(tokenized_lines, office_names, profiler=None):
     """Iterate lines and mark ones which are part of the table of contents.
 
     Return TOC item list, which are used as ending separators for defect sections.
@@ -11,10 +12,10 @@ def tokenize(tokenized_lines, office_names):
     # we are iterating the TOC section multiple times here
     # and tokenizing different categories in a specific order.
     # see regex comments at the top of this file for more information
-    tokenized_lines = find_borders_without_summary(tokenized_lines)
-    tokenize_office_names(tokenized_lines, office_names)
-    tokenize_chapter_titles(tokenized_lines)
-    tokenize_chapter_items(tokenized_lines)
+    tokenized_lines = run(profiler, 'toc.find_borders_without_summary', find_borders_without_summary, tokenized_lines)
+    run(profiler, 'toc.tokenize_office_names', tokenize_office_names, tokenized_lines, office_names)
+    run(profiler, 'toc.tokenize_chapter_titles', tokenize_chapter_titles, tokenized_lines)
+    run(profiler, 'toc.tokenize_chapter_items', tokenize_chapter_items, tokenized_lines)
 
     return tokenized_lines
 
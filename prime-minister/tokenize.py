@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 """Tokenize prime minister followup reports."""
 
+import argparse
 import json
 import itertools
 import re
@@ -11,6 +12,7 @@ import yaml
 import regex
 import toc
 import tokens
+from profiling import Profiler, run
 
 
 def get_alternative_office_names(path):
@@ -286,7 +288,7 @@ def tokenize_defect_reply_bodies(tokenized_lines):
             line['type'] = tokens.TOKEN_DEFECT_REPLY_BODY_CONTINUE
 
 
-def tokenize(lines, alternative_office_names_path, state_comptroller_preface_path):
+def tokenize(lines, alternative_office_names_path, state_comptroller_preface_path, profiler=None):
     r"""Tokenize all lines (by line, not word) according to type.
 
     The general structure of the document is as follows:
@@ -296,6 +298,8 @@ def tokenize(lines, alternative_office_names_path, state_comptroller_preface_pat
     תגובה
     <Replying entity name>
     <Reply descriptiption>
+
+    If a profiling.Profiler is given, every pass is profiled using it.
     """
     tokenized_lines = []
     for line in lines:
@@ -310,15 +314,21 @@ def tokenize(lines, alternative_office_names_path, state_comptroller_preface_pat
     state_comptroller_offices, state_comptroller_defects = get_state_comptroller_offices_and_defects(state_comptroller_preface_path)
     combined_office_names = set(alternative_office_names) | set(state_comptroller_offices)
 
-    toc.tokenize(tokenized_lines, combined_office_names)
-    tokenize_chapter_numbers(tokenized_lines)
-    tokenize_defect_headers(tokenized_lines)
-    tokenize_reply_headers(tokenized_lines)
-    tokenize_chapter_office_names(tokenized_lines, combined_office_names)
-    tokenize_chapter_topic_discussed_offices(tokenized_lines)
-    tokenize_chapter_topics(tokenized_lines, state_comptroller_offices, state_comptroller_defects)
-    tokenize_defect_bodies(tokenized_lines)
-    tokenize_defect_reply_bodies(tokenized_lines)
+    toc.tokenize(tokenized_lines, combined_office_names, profiler)
+    run(profiler, 'tokenize_chapter_numbers', tokenize_chapter_numbers, tokenized_lines)
+    run(profiler, 'tokenize_defect_headers', tokenize_defect_headers, tokenized_lines)
+    run(profiler, 'tokenize_reply_headers', tokenize_reply_headers, tokenized_lines)
+    run(profiler, 'tokenize_chapter_office_names', tokenize_chapter_office_names,
+        tokenized_lines, combined_office_names)
+    run(profiler, 'tokenize_chapter_topic_discussed_offices', tokenize_chapter_topic_discussed_offices,
+        tokenized_lines)
+    run(profiler, 'tokenize_chapter_topics', tokenize_chapter_topics,
+        tokenized_lines, state_comptroller_offices, state_comptroller_defects)
+    run(profiler, 'tokenize_defect_bodies', tokenize_defect_bodies, tokenized_lines)
+    run(profiler, 'tokenize_defect_reply_bodies', tokenize_defect_reply_bodies, tokenized_lines)
+
+    if profiler is not None:
+        profiler.finish(tokenized_lines)
 
     return tokenized_lines
 
@@ -373,12 +383,26 @@ def tokenize(lines, alternative_office_names_path, state_comptroller_preface_pat
 
 
 if __name__ == '__main__':
-    with open(sys.argv[1], 'r') as f:
+    PARSER = argparse.ArgumentParser(description='Tokenize prime minister followup report.')
+    PARSER.add_argument('followup', help='followup report text file')
+    PARSER.add_argument('alternative_office_names', help='alternative office names YAML file')
+    PARSER.add_argument('preface', help='state-comptroller preface of the report being followed up')
+    PARSER.add_argument('--profile', action='store_true',
+                        help='write per-pass timings and counters to <followup>.profile.json')
+    ARGS = PARSER.parse_args()
+
+    with open(ARGS.followup, 'r') as f:
         LINES = [l for l
                  in f.readlines()
                  if l.strip() != '']  # filter empty lines
 
-    TOKENIZED_LINES = tokenize(LINES, sys.argv[2], sys.argv[3])
+    if ARGS.profile:
+        PROFILER = Profiler()
+        with PROFILER.count_regexes():
+            TOKENIZED_LINES = tokenize(LINES, ARGS.alternative_office_names, ARGS.preface, PROFILER)
+        PROFILER.dump(ARGS.followup + '.profile.json')
+    else:
+        TOKENIZED_LINES = tokenize(LINES, ARGS.alternative_office_names, ARGS.preface)
 
     for l in TOKENIZED_LINES:
         print(l['type'], l['text'][:30])
@@ -0,0 +1,117 @@
+"""Bulk load documents into Elasticsearch.
+
+Documents are streamed from action generators,
+split into chunks and sent by a pool of parallel bulk workers.
+Rejected actions (e.g. HTTP 429 when the bulk queue is full)
+are retried with exponential backoff.
+"""
+
+import time
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from threading import BoundedSemaphore
+
+from elasticsearch.exceptions import ConnectionError, TransportError
+from elasticsearch.helpers import expand_action
+
+
+# statuses worth retrying: the cluster is overloaded or temporarily unavailable
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def chunks(actions, chunk_size):
+    """Split action generator into lists of chunk_size actions, without consuming it all."""
+    actions = iter(actions)
+    while True:
+        chunk = list(islice(actions, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def send_chunk(es, chunk, max_retries=3, initial_backoff=2, max_backoff=60):
+    """Send a single chunk of actions using the bulk API.
+
+    Actions rejected with a retryable status are resent,
+    waiting initial_backoff * 2**(attempt-1) seconds (up to max_backoff)
+    before every retry.
+
+    Returns number of successful actions and a list of failed items.
+    """
+    serialize = es.transport.serializer.dumps
+    pending = [expand_action(action) for action in chunk]
+    succeeded = 0
+    errors = []
+
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            time.sleep(min(max_backoff, initial_backoff * 2 ** (attempt - 1)))
+
+        body = []
+        for action, data in pending:
+            body.append(serialize(action))
+            if data is not None:
+                body.append(serialize(data))
+
+        try:
+            response = es.bulk('\n'.join(body) + '\n')
+        except TransportError as e:
+            # retry entire chunk on connection errors and overloaded cluster
+            retryable = isinstance(e, ConnectionError) or e.status_code in RETRY_STATUSES
+            if not retryable or attempt == max_retries:
+                raise
+            continue
+
+        # response items are ordered the same as the sent actions
+        retry = []
+        for (action, data), item in zip(pending, response['items']):
+            op_type, result = next(iter(item.items()))
+            status = result.get('status', 500)
+            # deleting an already missing document is still a success
+            if 200 <= status < 300 or (op_type == 'delete' and status == 404):
+                succeeded += 1
+            elif status in RETRY_STATUSES and attempt < max_retries:
+                retry.append((action, data))
+            else:
+                errors.append(item)
+
+        pending = retry
+        if not pending:
+            break
+
+    return succeeded, errors
+
+
+def bulk_load(es, actions, chunk_size=500, thread_count=4, max_retries=3, initial_backoff=2, max_backoff=60):
+    """Stream actions into Elasticsearch using parallel bulk workers.
+
+    At most thread_count * 2 chunks are held in memory at any time,
+    so the action generator is never consumed much ahead of the workers.
+
+    Returns number of successful actions and a list of failed items.
+    """
+    pool = ThreadPool(thread_count)
+    slots = BoundedSemaphore(thread_count * 2)
+
+    def release(_):
+        slots.release()
+
+    results = []
+    try:
+        for chunk in chunks(actions, chunk_size):
+            slots.acquire()
+            results.append(pool.apply_async(
+                send_chunk, (es, chunk, max_retries, initial_backoff, max_backoff),
+                callback=release, error_callback=release))
+
+        succeeded = 0
+        errors = []
+        for result in results:
+            chunk_succeeded, chunk_errors = result.get()
+            succeeded += chunk_succeeded
+            errors += chunk_errors
+    finally:
+        pool.close()
+        pool.join()
+
+    return succeeded, errors
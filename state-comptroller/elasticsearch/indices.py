@@ -0,0 +1,94 @@
+"""Versioned indices behind an alias, for zero-downtime reloads.
+
+Every full load builds a new index named <alias>-YYYYMMDDHHMMSS,
+suffixed with a counter (e.g. <alias>-YYYYMMDDHHMMSS-1) if that name is already taken.
+Searches always go through the alias, which is flipped atomically
+to the new index only after it was completely loaded.
+Old versions are pruned afterwards.
+"""
+
+import json
+import os.path
+from datetime import datetime
+
+from elasticsearch.exceptions import NotFoundError, RequestError
+
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template.json')
+
+# settings applied to the index while it is being built,
+# restored once the load is done
+BUILD_SETTINGS = {
+    'refresh_interval': '-1',
+    'number_of_replicas': 0,
+}
+
+
+def create_versioned_index(es, alias, template_path=TEMPLATE_PATH):
+    """Create a new index version with template settings, mappings and bulk load settings.
+
+    Returns the new index name.
+    """
+    with open(template_path, 'r') as f:
+        template = json.load(f)
+
+    settings = dict(template.get('settings', {}))
+    settings.update(BUILD_SETTINGS)
+
+    version = '{}-{}'.format(alias, datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+    attempt = 0
+    while True:
+        index_name = version if attempt == 0 else '{}-{}'.format(version, attempt)
+        try:
+            es.indices.create(index_name, body={
+                'settings': settings,
+                'mappings': template.get('mappings', {}),
+            })
+            return index_name
+        except RequestError as e:
+            if 'already_exists' not in str(e.error):
+                raise
+            attempt += 1
+
+
+def finish_versioned_index(es, index_name, replicas=1):
+    """Restore search settings on a completely loaded index and refresh it."""
+    es.indices.put_settings(index=index_name, body={'index': {
+        'refresh_interval': '1s',
+        'number_of_replicas': replicas,
+    }})
+    es.indices.refresh(index=index_name)
+
+
+def alias_indices(es, alias):
+    """Return names of indices currently behind alias."""
+    try:
+        return sorted(es.indices.get_alias(name=alias).keys())
+    except NotFoundError:
+        return []
+
+
+def swap_alias(es, alias, index_name):
+    """Point alias at index_name, removing it from all other indices in a single atomic request."""
+    actions = [{'remove': {'index': old, 'alias': alias}}
+               for old in alias_indices(es, alias) if old != index_name]
+    actions.append({'add': {'index': index_name, 'alias': alias}})
+    es.indices.update_aliases(body={'actions': actions})
+
+
+def prune_versions(es, alias, keep=2):
+    """Delete all but the newest `keep` index versions, never touching the aliased ones.
+
+    Returns names of deleted indices.
+    """
+    try:
+        versions = sorted(es.indices.get(index='{}-*'.format(alias)).keys(), reverse=True)
+    except NotFoundError:
+        return []
+
+    aliased = set(alias_indices(es, alias))
+    pruned = [v for v in versions[keep:] if v not in aliased]
+    for index_name in pruned:
+        es.indices.delete(index=index_name)
+
+    return pruned
@@ -1,79 +1,175 @@
 #!/usr/bin/env python
+"""Load scraper output into Elasticsearch.
 
+Output is loaded as denormalized report and topic documents (see transform.py).
+Every document gets a deterministic id derived from the report it belongs to,
+so reloading the same output overwrites documents instead of duplicating them:
+
+    report      <report id>
+    topic       <report id>:<chapter num>:<topic ordinal in chapter>
+
+A full load builds a new index version behind the "open-audit" alias
+(see indices.py).
+
+A manifest of every loaded document's content hash is saved after each load.
+In delta mode the index behind the alias is updated in place instead:
+only documents whose hash changed since the last load are sent,
+and documents which disappeared from the output are deleted.
+"""
+
+import argparse
+import hashlib
 import json
-import sys
+import os
 import os.path
+import sys
 
 from elasticsearch import Elasticsearch
 
-
-INDEX_NAME = 'default'
-
-
-def prefaces(es, index_name, dir_path):
-    with open(os.path.join(dir_path, 'prefaces.json'), 'r') as f:
-        for line in f:
-            preface = json.loads(line)
-
-            offices_to_defects = preface['offices_to_defects'].items()
-            del preface['offices_to_defects']
-            for office, defects in offices_to_defects:
-                es.create(index_name, doc_type='preface_office',
-                         body={
-                             'report_id': preface['id'],
-                             'office': office,
-                             'defects': defects,
-                         })
-
-            keywords_to_defects = preface['keywords_to_defects'].items()
-            del preface['keywords_to_defects']
-            for keyword, defects in keywords_to_defects:
-                es.create(index_name, doc_type='preface_keyword',
-                         body={
-                             'report_id': preface['id'],
-                             'keyword': keyword,
-                             'defects': defects,
-                         })
-
-            es.create(index_name, doc_type='preface', body=preface)
-
-def chapters(es, index_name, dir_path):
-    with open(os.path.join(dir_path, 'chapters.json'), 'r') as f:
-        for line in f:
-            chapter = json.loads(line)
-
-            offices = chapter['offices']
-            del chapter['offices']
-            for office in offices:
-                es.create(index_name, doc_type='chapter_office',
-                         body={
-                             'report_id': chapter['id'],
-                             'office': office,
-                         })
-
-            keywords = chapter['keywords']
-            del chapter['keywords']
-            for keyword in keywords:
-                es.create(index_name, doc_type='chapter_keyword',
-                         body={
-                             'report_id': chapter['id'],
-                             'keyword': keyword,
-                         })
-
-            es.create(index_name, doc_type='chapter', body=chapter)
-
-def topics(es, index_name, dir_path):
-    with open(os.path.join(dir_path, 'topics.json'), 'r') as f:
-        for line in f:
-            topic = json.loads(line)
-
-            es.create(index_name, doc_type='topic', body=topic)
+from bulk import bulk_load
+from indices import (
+    alias_indices,
+    create_versioned_index,
+    finish_versioned_index,
+    prune_versions,
+    swap_alias,
+)
+from transform import load_chapters, load_reports, report_documents, topic_documents
+
+
+# searches should always go through this alias,
+# which points to the latest completely loaded index version
+ALIAS_NAME = 'open-audit'
+
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manifest.json')
+
+
+def reports(index_name, report_data, chapter_data):
+    for report_id, document in report_documents(report_data, chapter_data):
+        yield {'_index': index_name, '_type': 'report', '_id': report_id, '_source': document}
+
+def topics(index_name, dir_path, report_data, chapter_data):
+    for topic_id, document in topic_documents(dir_path, report_data, chapter_data):
+        yield {'_index': index_name, '_type': 'topic', '_id': topic_id, '_source': document}
+
+def document_hash(source):
+    return hashlib.sha1(json.dumps(source, sort_keys=True).encode('utf-8')).hexdigest()
+
+def changed(actions, previous, current):
+    """Record content hash of every action in current manifest,
+    and skip actions whose document didn't change since previous manifest.
+    """
+    for action in actions:
+        key = '{}/{}'.format(action['_type'], action['_id'])
+        current[key] = document_hash(action['_source'])
+        if previous.get(key) != current[key]:
+            yield action
+
+def deleted(index_name, previous, current):
+    """Generate delete actions for documents in previous manifest missing from current one."""
+    for key in previous.keys() - current.keys():
+        doc_type, doc_id = key.split('/', 1)
+        yield {'_op_type': 'delete', '_index': index_name, '_type': doc_type, '_id': doc_id}
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(path, manifest):
+    # write to a temporary file first so a crash never leaves a truncated manifest
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
 
 if __name__ == '__main__':
-    es = Elasticsearch()
-    print('loading prefaces...')
-    prefaces(es, INDEX_NAME, sys.argv[1])
-    print('loading chapters...')
-    chapters(es, INDEX_NAME, sys.argv[1])
-    print('loading topics...')
-    topics(es, INDEX_NAME, sys.argv[1])
+    parser = argparse.ArgumentParser(description='Load scraper output into Elasticsearch.')
+    parser.add_argument('dir_path', help='scraper output directory')
+    parser.add_argument('--host', default='localhost:9200')
+    parser.add_argument('--chunk-size', type=int, default=500, help='actions per bulk request')
+    parser.add_argument('--threads', type=int, default=4, help='parallel bulk workers')
+    parser.add_argument('--max-retries', type=int, default=3, help='retries for rejected actions')
+    parser.add_argument('--initial-backoff', type=float, default=2, help='seconds to wait before first retry')
+    parser.add_argument('--delta', action='store_true',
+                        help='only send documents changed since last load, into the current index in place')
+    parser.add_argument('--manifest', default=MANIFEST_PATH, help='manifest of last load')
+    parser.add_argument('--replicas', type=int, default=1, help='replicas of a newly built index')
+    parser.add_argument('--keep', type=int, default=2, help='index versions to keep when pruning')
+    parser.add_argument('--allow-errors', action='store_true',
+                        help='point the alias at a newly built index even if some documents failed to load')
+    args = parser.parse_args()
+
+    es = Elasticsearch([args.host])
+
+    # a delta load updates the index currently behind the alias in place.
+    # a full load builds a new index version, and flips the alias to it when done,
+    # so searches never see a half-loaded index.
+    current_indices = alias_indices(es, ALIAS_NAME)
+    delta = args.delta and len(current_indices) == 1
+    if args.delta and not delta:
+        print('no single index behind alias "{}", building a new one instead'.format(ALIAS_NAME))
+
+    # the index behind the alias keeps serving searches during a delta load,
+    # so its refresh and replica settings are left alone.
+    # a new index is created with bulk load settings instead (see indices.py)
+    if delta:
+        index_name = current_indices[0]
+        previous = load_manifest(args.manifest)
+    else:
+        index_name = create_versioned_index(es, ALIAS_NAME)
+        # the new index is empty, so there's nothing to compare with or delete
+        previous = {}
+    print('loading into index "{}"'.format(index_name))
+
+    current = {}
+    failed = {}
+
+    # prefaces and chapters are small enough to join in memory,
+    # topics are streamed
+    report_data = load_reports(args.dir_path)
+    chapter_data = load_chapters(args.dir_path)
+
+    for name, actions in [('reports', reports(index_name, report_data, chapter_data)),
+                          ('topics', topics(index_name, args.dir_path, report_data, chapter_data)),
+                          ('deletions', deleted(index_name, previous, current))]:
+        if name != 'deletions':
+            actions = changed(actions, previous, current)
+
+        print('loading {}...'.format(name))
+        succeeded, errors = bulk_load(es, actions,
+                                      chunk_size=args.chunk_size,
+                                      thread_count=args.threads,
+                                      max_retries=args.max_retries,
+                                      initial_backoff=args.initial_backoff)
+        print('loaded {} documents, {} errors'.format(succeeded, len(errors)))
+        for error in errors:
+            print(error)
+
+            op_type, result = next(iter(error.items()))
+            failed['{}/{}'.format(result['_type'], result['_id'])] = op_type
+
+    if not delta:
+        # searches keep using the previous index, and the manifest keeps describing it.
+        # the partial index is deleted, so it isn't mistaken for the newest version when pruning
+        if failed and not args.allow_errors:
+            es.indices.delete(index=index_name)
+            print('{} documents failed to load into "{}", which was deleted, alias "{}" was left unchanged '
+                  '(rerun with --allow-errors to swap it anyway)'.format(len(failed), index_name, ALIAS_NAME))
+            sys.exit(1)
+
+        finish_versioned_index(es, index_name, replicas=args.replicas)
+        swap_alias(es, ALIAS_NAME, index_name)
+        print('alias "{}" now points to "{}"'.format(ALIAS_NAME, index_name))
+        for pruned in prune_versions(es, ALIAS_NAME, keep=args.keep):
+            print('deleted old index "{}"'.format(pruned))
+
+    # forget failed documents so they are resent on the next delta load,
+    # and keep documents whose deletion failed so it is retried
+    for key, op_type in failed.items():
+        if op_type == 'delete':
+            current[key] = previous[key]
+        else:
+            current.pop(key, None)
+
+    save_manifest(args.manifest, current)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Minimal stub of the Elasticsearch HTTP API, for testing the loader locally.
+
+Implements just enough of the API for insert.py:
+index creation and deletion, get/put settings, aliases, refresh and bulk.
+Bulk documents are counted per index and type but not stored.
+
+Some bulk actions can be randomly rejected with HTTP 429,
+to exercise the loader's retry logic:
+
+    ./stub.py --port 9201 --reject-rate 0.1
+    ./insert.py ../scraper/output --host localhost:9201
+"""
+
+import argparse
+import fnmatch
+import json
+import random
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, reject_rate):
+        super().__init__(address, StubHandler)
+        self.reject_rate = reject_rate
+        self.lock = Lock()
+        self.indices = {}
+        self.aliases = {}
+        self.docs = Counter()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length).decode('utf-8')
+
+    def path_parts(self):
+        return [p for p in self.path.split('?')[0].split('/') if p]
+
+    def aliased(self, alias):
+        return {index: {'aliases': {alias: {}}}
+                for (index, aliases) in self.server.aliases.items() if alias in aliases}
+
+    def do_HEAD(self):
+        parts = self.path_parts()
+        if len(parts) == 2 and parts[0] == '_alias':
+            return self.reply(200 if self.aliased(parts[1]) else 404, {})
+
+        self.reply(200 if not parts or parts[0] in self.server.indices else 404, {})
+
+    def do_GET(self):
+        parts = self.path_parts()
+        if not parts:
+            return self.reply(200, {'version': {'number': 'stub'}, 'docs': self.server.docs})
+
+        if len(parts) == 2 and parts[0] == '_alias':
+            aliased = self.aliased(parts[1])
+            return self.reply(200 if aliased else 404, aliased)
+
+        if len(parts) == 2 and parts[1] == '_settings' and parts[0] in self.server.indices:
+            return self.reply(200, {parts[0]: {'settings': {'index': self.server.indices[parts[0]]}}})
+
+        if len(parts) == 1:
+            matches = {index: {'settings': {'index': settings}}
+                       for (index, settings) in self.server.indices.items()
+                       if fnmatch.fnmatch(index, parts[0])}
+            if matches or '*' in parts[0]:
+                return self.reply(200, matches)
+
+        self.reply(404, {'error': 'not found', 'status': 404})
+
+    def do_DELETE(self):
+        parts = self.path_parts()
+        with self.server.lock:
+            if len(parts) == 1 and parts[0] in self.server.indices:
+                del self.server.indices[parts[0]]
+                self.server.aliases.pop(parts[0], None)
+                return self.reply(200, {'acknowledged': True})
+
+        self.reply(404, {'error': 'not found', 'status': 404})
+
+    def do_PUT(self):
+        parts = self.path_parts()
+        body = self.read_body()
+        body = json.loads(body) if body else {}
+
+        with self.server.lock:
+            if len(parts) == 1:
+                if parts[0] in self.server.indices:
+                    return self.reply(400, {'error': 'index_already_exists_exception', 'status': 400})
+                settings = {'refresh_interval': '1s', 'number_of_replicas': '1'}
+                settings.update(body.get('settings', {}))
+                self.server.indices[parts[0]] = settings
+                self.server.aliases[parts[0]] = set()
+                return self.reply(200, {'acknowledged': True})
+
+            if len(parts) == 2 and parts[1] == '_settings' and parts[0] in self.server.indices:
+                self.server.indices[parts[0]].update(body.get('index', body))
+                return self.reply(200, {'acknowledged': True})
+
+        self.reply(404, {'error': 'not found', 'status': 404})
+
+    def do_POST(self):
+        parts = self.path_parts()
+
+        if parts and parts[-1] == '_refresh':
+            return self.reply(200, {'_shards': {}})
+
+        if parts and parts[-1] == '_bulk':
+            return self.bulk(self.read_body())
+
+        if parts == ['_aliases']:
+            with self.server.lock:
+                for action in json.loads(self.read_body())['actions']:
+                    op, target = next(iter(action.items()))
+                    aliases = self.server.aliases[target['index']]
+                    if op == 'add':
+                        aliases.add(target['alias'])
+                    else:
+                        aliases.discard(target['alias'])
+            return self.reply(200, {'acknowledged': True})
+
+        self.reply(404, {'error': 'not found', 'status': 404})
+
+    def bulk(self, body):
+        lines = iter(l for l in body.split('\n') if l)
+        items = []
+        for line in lines:
+            op_type, meta = next(iter(json.loads(line).items()))
+            if op_type != 'delete':
+                next(lines)  # document source
+
+            if random.random() < self.server.reject_rate:
+                status = 429
+            else:
+                status = 200 if op_type == 'delete' else 201
+                with self.server.lock:
+                    self.server.docs['{}/{}'.format(meta.get('_index'), meta.get('_type'))] += 1
+
+            items.append({op_type: dict(meta, status=status)})
+
+        self.reply(200, {'took': 1, 'errors': any(i[next(iter(i))]['status'] >= 300 for i in items),
+                         'items': items})
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a stub Elasticsearch HTTP server.')
+    parser.add_argument('--port', type=int, default=9201)
+    parser.add_argument('--reject-rate', type=float, default=0.0,
+                        help='fraction of bulk actions to reject with 429')
+    args = parser.parse_args()
+
+    server = StubServer(('localhost', args.port), args.reject_rate)
+    print('stub elasticsearch listening on port {}'.format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.docs, indent=2))
@@ -0,0 +1,98 @@
+"""Transform scraper output into denormalized search documents.
+
+The scraper dumps prefaces, chapters and topics separately,
+linked together by report id and chapter number.
+Searching them as-is means multiple queries and client side joins,
+e.g. for "topics of office X in reports of type Y since 2015".
+
+Instead we index two document types:
+
+    report  the preface metadata, along with all offices and keywords
+            mentioned in the report, and the defect titles they're mapped to
+    topic   a topic, embedding its report's metadata, chapter title,
+            offices and keywords
+
+so common queries are a single filtered search over topics.
+"""
+
+import json
+import os.path
+
+
+def load_reports(dir_path):
+    """Load all prefaces by report id."""
+    with open(os.path.join(dir_path, 'prefaces.json'), 'r') as f:
+        return {p['id']: p for p in (json.loads(line) for line in f)}
+
+
+def load_chapters(dir_path):
+    """Load all chapters by (report id, chapter num)."""
+    with open(os.path.join(dir_path, 'chapters.json'), 'r') as f:
+        return {(c['id'], c['chapter_num']): c for c in (json.loads(line) for line in f)}
+
+
+def unique(values):
+    """Remove duplicates and None values from list, keeping order."""
+    seen = set()
+    return [v for v in values if v is not None and not (v in seen or seen.add(v))]
+
+
+def report_documents(reports, chapters):
+    """Generate (id, report document) pairs."""
+    chapters_by_report = {}
+    for chapter in chapters.values():
+        chapters_by_report.setdefault(chapter['id'], []).append(chapter)
+
+    for report_id, preface in reports.items():
+        report_chapters = sorted(chapters_by_report.get(report_id, []), key=lambda c: c['chapter_num'])
+
+        document = {k: v for (k, v) in preface.items()
+                    if k not in ('id', 'offices_to_defects', 'keywords_to_defects')}
+        document['report_id'] = report_id
+        document['offices'] = unique(list(preface['offices_to_defects']) +
+                                     [o for c in report_chapters for o in c['offices']])
+        document['keywords'] = unique(list(preface['keywords_to_defects']) +
+                                      [k for c in report_chapters for k in c['keywords']])
+        document['defects'] = unique([d for defects in preface['offices_to_defects'].values() for d in defects] +
+                                     [d for defects in preface['keywords_to_defects'].values() for d in defects])
+        document['chapter_titles'] = [c['title'] for c in report_chapters]
+
+        yield report_id, document
+
+
+def topic_documents(dir_path, reports, chapters):
+    """Generate (id, topic document) pairs, streaming topics from output file.
+
+    Topics have no id of their own, so we use their ordinal inside their chapter.
+    """
+    ordinals = {}
+    with open(os.path.join(dir_path, 'topics.json'), 'r') as f:
+        for line in f:
+            topic = json.loads(line)
+            key = (topic['id'], topic['chapter_num'])
+            ordinals[key] = ordinals.get(key, 0) + 1
+
+            preface = reports.get(topic['id'], {})
+            chapter = chapters.get(key, {})
+
+            yield '{}:{}:{}'.format(topic['id'], topic['chapter_num'], ordinals[key]), {
+                'report_id': topic['id'],
+                'chapter_num': topic['chapter_num'],
+                'ordinal': ordinals[key],
+                'source_url': topic['source_url'],
+
+                'report_name': preface.get('report_name'),
+                'report_type': preface.get('report_type'),
+                'publish_date': preface.get('publish_date'),
+                'catalog_number': preface.get('catalog_number'),
+
+                'chapter_title': chapter.get('title'),
+
+                'title': topic['title'],
+                'office': topic['office'],
+                'offices': unique([topic['office']] + chapter.get('offices', [])),
+                'keywords': unique(chapter.get('keywords', [])),
+                'body': topic['body'],
+                'pdf_url': topic['pdf_url'],
+                'docx_url': topic['docx_url'],
+            }
@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+"""Read-only HTTP API over an output directory.
+
+A single process asyncio server (no dependencies besides the standard library),
+serving JSON for single records and JSON Lines for listings:
+
+    GET /reports                                report summaries, newest first
+    GET /reports/{id}                           preface
+    GET /reports/{id}/chapters                  chapters of report
+    GET /reports/{id}/chapters/{num}            chapter
+    GET /reports/{id}/topics                    topics of report
+    GET /reports/{id}/chapters/{num}/topics     topics of chapter
+    GET /offices, /keywords                     names and the number of reports they appear in
+    GET /offices/{name}, /keywords/{name}       summaries of reports an office or keyword appears in
+
+Records are read using the output files' offset indexes (see report.reader),
+and kept in an LRU cache along with their encoded (and gzipped) bodies.
+
+Listings are paginated using ?offset=&limit=, and streamed as chunks of lines,
+with a Link header pointing at the next page.
+
+Every response has a weak ETag of the output files version and request target,
+so If-None-Match requests are answered with 304 Not Modified without reading any record.
+Output files are checked for changes every second (e.g. while a crawl appends to them).
+Changed files are reloaded in a background thread, and requests are served
+from the previous version until the reload succeeded, which resets the cache.
+
+    python -m report.api output --port 8080
+
+See report.loadtest for benchmarking the server.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from os import stat
+from os.path import join
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from report.reader import OutputReader
+
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ['id', 'report_name', 'report_type', 'publish_date', 'catalog_number', 'source_url']
+
+# responses smaller than this aren't worth compressing
+MIN_GZIP_SIZE = 512
+
+REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or REASONS[status])
+        self.status = status
+
+
+class LRUCache(object):
+    """Least recently used cache of loaded values."""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key, load):
+        """Return cached value of key, calling load() if it isn't cached."""
+        try:
+            value = self.items[key]
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+        except KeyError:
+            self.misses += 1
+
+        value = self.items[key] = load()
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.items.clear()
+
+
+def encode_line(record):
+    return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class Entity(object):
+    """Encoded response body of a single record, gzipped on first request."""
+
+    def __init__(self, record):
+        self.body = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+
+class Corpus(object):
+    """Output directory records, with summaries and office/keyword lookups held in memory."""
+
+    names = ['prefaces', 'chapters', 'topics']
+
+    def __init__(self, dirname, cache_size=10000, check_interval=1):
+        self.dirname = dirname
+        self.cache = LRUCache(cache_size)
+        self.check_interval = check_interval
+        self.reader = None
+        self.reloading = None
+        self.swap(self.load())
+        self.checked_at = time.time()
+
+    def version(self):
+        return [(st.st_size, st.st_mtime_ns) for st in (stat(join(self.dirname, '{}.json'.format(name)))
+                                                        for name in self.names)]
+
+    def load(self):
+        """Read output directory, and return its version, reader, summaries and office/keyword lookups.
+
+        Nothing is changed, so a failing load leaves the current state as is.
+        """
+        # files changing while they are read only have a newer version
+        version = self.version()
+        reader = OutputReader(self.dirname)
+        try:
+            summaries = {}  # report id --> encoded summary line
+            dates = {}
+            entities = {'offices': {}, 'keywords': {}}
+            for id in reader.reports():
+                preface = reader.preface(id)
+                summaries[id] = encode_line({field: preface.get(field) for field in SUMMARY_FIELDS})
+                dates[id] = preface['publish_date'] or ''
+                for kind, field in [('offices', 'offices_to_defects'), ('keywords', 'keywords_to_defects')]:
+                    for name in preface[field]:
+                        entities[kind].setdefault(name.strip(), set()).add(id)
+
+                for chapter in reader.chapters(id):
+                    for kind in ['offices', 'keywords']:
+                        for name in chapter[kind]:
+                            entities[kind].setdefault(name.strip(), set()).add(id)
+        except Exception:
+            reader.close()
+            raise
+
+        # newest first
+        report_ids = sorted(summaries, key=lambda id: (dates[id], id), reverse=True)
+        order = {id: num for (num, id) in enumerate(report_ids)}
+        entities = {kind: {name: sorted(ids, key=order.get) for (name, ids) in names.items()}
+                    for (kind, names) in entities.items()}
+        entity_names = {kind: sorted(names, key=lambda name: (-len(names[name]), name))
+                        for (kind, names) in entities.items()}
+        return version, reader, summaries, report_ids, entities, entity_names
+
+    def swap(self, loaded):
+        """Serve loaded state (see load) from now on."""
+        if self.reader is not None:
+            self.reader.close()
+
+        self.current_version, self.reader, self.summaries, self.report_ids, self.entities, self.entity_names = loaded
+        self.tag = '{:08x}'.format(zlib.crc32(json.dumps(self.current_version).encode('ascii')))
+        self.cache.clear()
+
+    def refresh(self):
+        """Start reloading if output files changed, checking at most every check_interval seconds.
+
+        Must be called from the event loop. Returns immediately, and the current state
+        is served until the reload succeeded.
+        """
+        now = time.time()
+        if self.reloading is not None or now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        if self.version() != self.current_version:
+            self.reloading = asyncio.ensure_future(self.reload())
+
+    async def reload(self):
+        try:
+            loaded = await asyncio.get_event_loop().run_in_executor(None, self.load)
+        except Exception:
+            # e.g. a file was replaced while it was read. retried on the next check
+            logger.exception('failed reloading %s', self.dirname)
+        else:
+            self.swap(loaded)
+        finally:
+            self.reloading = None
+
+    def entity(self, key, load):
+        """Return cached Entity of record, or None if it doesn't exist."""
+        def load_entity():
+            record = load()
+            return Entity(record) if record is not None else None
+        return self.cache.get(key, load_entity)
+
+    def lines(self, key, load):
+        """Return cached list of encoded JSON Lines of records."""
+        return self.cache.get(key, lambda: [encode_line(record) for record in load()])
+
+
+def parse_page(query, page_size, max_page_size):
+    try:
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', [str(page_size)])[0])
+    except ValueError:
+        raise HTTPError(400, 'offset and limit must be integers')
+    if offset < 0 or limit < 1:
+        raise HTTPError(400, 'offset must be non-negative, and limit positive')
+    return offset, min(limit, max_page_size)
+
+
+class APIServer(object):
+    """HTTP/1.1 server of corpus resources, with keep-alive connections."""
+
+    def __init__(self, corpus, page_size=100, max_page_size=1000):
+        self.corpus = corpus
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.LimitOverrunError:
+                    await self.send_error(writer, HTTPError(431), False, 'HTTP/1.1')
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ')
+                except ValueError:
+                    await self.send_error(writer, HTTPError(400), False, 'HTTP/1.1')
+                    break
+
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                # requests aren't expected to have a body, discard it anyway
+                if headers.get('content-length', '0').isdigit() and int(headers.get('content-length', '0')):
+                    await reader.readexactly(int(headers['content-length']))
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+                try:
+                    keep_alive = await self.respond(writer, method, target, version, headers, keep_alive)
+                except HTTPError as e:
+                    await self.send_error(writer, e, keep_alive, version)
+                except ConnectionError:
+                    raise
+                except Exception:
+                    logger.exception('failed responding to %s %s', method, target)
+                    keep_alive = False
+                    await self.send_error(writer, HTTPError(500), keep_alive, version)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def resource(self, path, query):
+        """Route request to resource.
+
+        Returns ('entity', Entity) for single records,
+        or ('lines', encoded lines, next offset or None) for listings.
+        """
+        corpus = self.corpus
+        parts = [unquote(p) for p in path.strip('/').split('/')]
+
+        if parts[0] == 'reports':
+            if len(parts) == 1:
+                offset, limit = parse_page(query, self.page_size, self.max_page_size)
+                ids = corpus.report_ids[offset:offset + limit]
+                return 'lines', [corpus.summaries[id] for id in ids], self.next_offset(offset, limit,
+                                                                                       len(corpus.report_ids))
+
+            id = parts[1]
+            if id not in corpus.summaries:
+                raise HTTPError(404)
+
+            if len(parts) == 2:
+                return 'entity', corpus.entity(('preface', id), lambda: corpus.reader.preface(id))
+            if len(parts) == 3 and parts[2] == 'chapters':
+                return 'lines', corpus.lines(('chapters', id), lambda: corpus.reader.chapters(id)), None
+            if len(parts) == 3 and parts[2] == 'topics':
+                return 'lines', corpus.lines(('topics', id, None), lambda: corpus.reader.topics(id)), None
+
+            if len(parts) in [4, 5] and parts[2] == 'chapters':
+                try:
+                    chapter_num = int(parts[3])
+                except ValueError:
+                    raise HTTPError(404)
+
+                if len(parts) == 4:
+                    entity = corpus.entity(('chapter', id, chapter_num), lambda: corpus.reader.chapter(id, chapter_num))
+                    if entity is None:
+                        raise HTTPError(404)
+                    return 'entity', entity
+                if parts[4] == 'topics':
+                    return 'lines', corpus.lines(('topics', id, chapter_num),
+                                                   lambda: corpus.reader.topics(id, chapter_num)), None
+
+        elif parts[0] in ['offices', 'keywords'] and len(parts) <= 2:
+            kind = parts[0]
+            offset, limit = parse_page(query, self.page_size, self.max_page_size)
+
+            if len(parts) == 1:
+                names = corpus.entity_names[kind][offset:offset + limit]
+                lines = [encode_line({kind[:-1]: name, 'reports': len(corpus.entities[kind][name])}) for name in names]
+                return 'lines', lines, self.next_offset(offset, limit, len(corpus.entity_names[kind]))
+
+            ids = corpus.entities[kind].get(parts[1])
+            if ids is None:
+                raise HTTPError(404)
+            return 'lines', [corpus.summaries[id] for id in ids[offset:offset + limit]], self.next_offset(
+                offset, limit, len(ids))
+
+        raise HTTPError(404)
+
+    def next_offset(self, offset, limit, count):
+        return offset + limit if offset + limit < count else None
+
+    async def respond(self, writer, method, target, version, headers, keep_alive):
+        """Write response to request. Returns whether the connection can be kept alive."""
+        if method not in ['GET', 'HEAD']:
+            raise HTTPError(405)
+
+        self.corpus.refresh()
+        etag = 'W/"{}-{:08x}"'.format(self.corpus.tag, zlib.crc32(target.encode('latin-1')))
+        response_headers = [
+            ('ETag', etag),
+            ('Cache-Control', 'no-cache'),
+            ('Vary', 'Accept-Encoding'),
+        ]
+
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            if '*' in tags or etag in tags or etag[2:] in tags:
+                self.write_head(writer, version, 304, response_headers, keep_alive)
+                await writer.drain()
+                return keep_alive
+
+        url = urlsplit(target)
+        resource = self.resource(url.path, parse_qs(url.query))
+        use_gzip = 'gzip' in headers.get('accept-encoding', '')
+
+        if resource[0] == 'entity':
+            entity = resource[1]
+            if entity is None:
+                raise HTTPError(404)
+
+            body = entity.body
+            if use_gzip and len(body) >= MIN_GZIP_SIZE:
+                body = entity.gzipped()
+                response_headers.append(('Content-Encoding', 'gzip'))
+            response_headers += [('Content-Type', 'application/json; charset=utf-8'),
+                                 ('Content-Length', str(len(body)))]
+            self.write_head(writer, version, 200, response_headers, keep_alive)
+            if method == 'GET':
+                writer.write(body)
+            await writer.drain()
+            return keep_alive
+
+        _, lines, next_offset = resource
+        response_headers.append(('Content-Type', 'application/x-ndjson; charset=utf-8'))
+        if next_offset is not None:
+            query = parse_qs(url.query)
+            query['offset'] = [str(next_offset)]
+            response_headers.append(('Link', '<{}?{}>; rel="next"'.format(
+                quote(url.path), '&'.join('{}={}'.format(k, quote(v[0])) for (k, v) in sorted(query.items())))))
+        if use_gzip:
+            response_headers.append(('Content-Encoding', 'gzip'))
+
+        # HTTP/1.0 clients don't support chunked responses, so we close the connection after the body instead
+        chunked = version == 'HTTP/1.1'
+        if chunked:
+            response_headers.append(('Transfer-Encoding', 'chunked'))
+        else:
+            keep_alive = False
+        self.write_head(writer, version, 200, response_headers, keep_alive)
+        if method == 'HEAD':
+            await writer.drain()
+            return keep_alive
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+
+        def write(data):
+            if compressor is not None:
+                data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if not data:
+                return
+            if chunked:
+                writer.write('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+            else:
+                writer.write(data)
+
+        # stream a batch of lines at a time, waiting for the client to read them
+        batch = 64
+        for start in range(0, len(lines), batch):
+            write(b''.join(lines[start:start + batch]))
+            await writer.drain()
+
+        if compressor is not None:
+            data = compressor.flush()
+            if chunked:
+                writer.write('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+            else:
+                writer.write(data)
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return keep_alive
+
+    def write_head(self, writer, version, status, headers, keep_alive):
+        lines = ['{} {} {}'.format('HTTP/1.1' if version == 'HTTP/1.1' else 'HTTP/1.0', status, REASONS[status])]
+        lines += ['{}: {}'.format(name, value) for (name, value) in headers]
+        lines.append('Connection: {}'.format('keep-alive' if keep_alive else 'close'))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    async def send_error(self, writer, error, keep_alive, version):
+        body = json.dumps({'error': str(error)}).encode('utf-8')
+        self.write_head(writer, version, error.status, [
+            ('Content-Type', 'application/json; charset=utf-8'),
+            ('Content-Length', str(len(body))),
+        ], keep_alive)
+        writer.write(body)
+        await writer.drain()
+
+
+def serve(dirname, host='127.0.0.1', port=8080, cache_size=10000):
+    server = APIServer(Corpus(dirname, cache_size))
+    loop = asyncio.get_event_loop()
+    listener = loop.run_until_complete(asyncio.start_server(server.handle, host, port, backlog=1024))
+    print('serving {} on http://{}:{}'.format(dirname, host, port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        loop.run_until_complete(listener.wait_closed())
+        loop.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve output directory over HTTP.')
+    parser.add_argument('dirname', help='scraper output directory')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-size', type=int, default=10000, help='number of cached records and listings')
+    args = parser.parse_args()
+
+    serve(args.dirname, args.host, args.port, args.cache_size)
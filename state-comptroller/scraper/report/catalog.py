@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""Persistent catalog of all reports, in a SQLite database.
+
+The getAll report list is an html table of every published report.
+We keep every listed report in the catalog, along with its preface metadata
+and chapter/topic counts once it was scraped:
+
+    reports(id, source_url, listing_title, listing_cells, listing_date,
+            report_name, report_type, publish_date, catalog_number,
+            chapters, topics, scraped_at, done_at)
+
+done_at is only set once all of a report's items were scraped and none were invalid,
+so a report whose chapters or topics were lost (e.g. a crash or quarantined items)
+isn't mistaken for a complete one.
+
+Covering indexes on (report_type, publish_date) and (publish_date)
+answer metadata queries e.g. "all reports of type X in 2016"
+from the index alone, without reading prefaces.json or even the table itself.
+Incremental crawls (see CATALOG_SKIP_KNOWN setting) check whether a listed report
+was already scraped completely with a primary key lookup.
+
+The catalog is updated by CatalogPipeline while crawling,
+but can also be built manually from an existing output directory,
+and queried:
+
+    python -m report.catalog build output [--listing getAll.json]
+    python -m report.catalog query output --type "דוח שנתי" --year 2016
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+from collections import Counter
+from datetime import datetime
+from html.parser import HTMLParser
+from os import makedirs
+from os.path import basename, dirname, exists, join, splitext
+from urllib.parse import urljoin, urlsplit
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id TEXT PRIMARY KEY,
+    source_url TEXT,
+    listing_title TEXT,
+    listing_cells TEXT,
+    listing_date TEXT,
+    report_name TEXT,
+    report_type TEXT,
+    publish_date TEXT,
+    catalog_number TEXT,
+    chapters INTEGER NOT NULL DEFAULT 0,
+    topics INTEGER NOT NULL DEFAULT 0,
+    scraped_at TEXT,
+    done_at TEXT
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS reports_by_type
+    ON reports (report_type, publish_date, catalog_number, chapters, topics);
+CREATE INDEX IF NOT EXISTS reports_by_date
+    ON reports (publish_date, report_type, catalog_number, chapters, topics);
+CREATE INDEX IF NOT EXISTS reports_by_catalog_number
+    ON reports (catalog_number);
+"""
+
+# columns returned by queries, all covered by the indexes above
+# (the id primary key is implicitly part of every index of a WITHOUT ROWID table)
+SUMMARY_COLUMNS = ['id', 'report_type', 'publish_date', 'catalog_number', 'chapters', 'topics']
+
+
+def report_id(url):
+    """Return report id of report url, see ReportSpider.init_report."""
+    id, _ = splitext(basename(urlsplit(url).path))
+    return id
+
+
+LISTING_DATE_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})$')
+
+
+class ListingParser(HTMLParser):
+    """Incremental parser of the getAll html table.
+
+    Collects a listing row for every report link in a table row,
+    as soon as the row is closed. Feed it the table in chunks,
+    and pop rows parsed so far after each one.
+    """
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+        self.rows = []
+
+        self.links = None  # [url, title] of links in current row
+        self.cells = None  # text of current row cells
+        self.cell = None  # text of current cell
+        self.link = None  # text of current link
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self.end_row()
+            self.links, self.cells = [], []
+        elif tag == 'td' and self.cells is not None:
+            self.end_cell()
+            self.cell = []
+        elif tag == 'a' and self.cell is not None:
+            href = dict(attrs).get('href')
+            if href:
+                self.link = []
+                self.links.append([urljoin(self.base_url, href), self.link])
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            self.link = None
+        elif tag == 'td':
+            self.end_cell()
+        elif tag in ('tr', 'table'):
+            self.end_row()
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+        if self.link is not None:
+            self.link.append(data)
+
+    def end_cell(self):
+        if self.cell is not None:
+            self.cells.append(' '.join(''.join(self.cell).split()))
+            self.cell = self.link = None
+
+    def end_row(self):
+        self.end_cell()
+        if self.links:
+            publish_date = None
+            for cell in self.cells:
+                match = LISTING_DATE_RE.search(cell)
+                if match is not None:
+                    day, month, year = match.groups()
+                    publish_date = '{}-{:0>2}-{:0>2}'.format(year, month, day)
+                    break
+
+            for url, title in self.links:
+                self.rows.append({
+                    'id': report_id(url),
+                    'source_url': url,
+                    'title': ' '.join(''.join(title).split()),
+                    'cells': self.cells,
+                    'publish_date': publish_date,
+                })
+        self.links = self.cells = None
+
+    def pop_rows(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+
+def iter_listing(body, base_url, chunk_size=1 << 16):
+    """Parse getAll response body incrementally, and generate listing rows as they are found.
+
+    Every row is a dict of report id, source_url, link title, cells
+    and publish date (YYYY-MM-DD, or None if the row has no date cell).
+    """
+    # response body is a json array,
+    # whose first element is a string representation of an
+    # html table containing all published reports
+    table = json.loads(body)[0]
+
+    parser = ListingParser(base_url)
+    for start in range(0, len(table), chunk_size):
+        parser.feed(table[start:start + chunk_size])
+        for row in parser.pop_rows():
+            yield row
+
+    parser.close()
+    parser.end_row()
+    for row in parser.pop_rows():
+        yield row
+
+
+def listing_priority(row):
+    """Return request priority of listed report: newer reports first, undated ones last."""
+    if row['publish_date'] is None:
+        return 0
+    return datetime.strptime(row['publish_date'], '%Y-%m-%d').toordinal()
+
+
+class Catalog(object):
+    """Report catalog database."""
+
+    def __init__(self, path):
+        if dirname(path) and not exists(dirname(path)):
+            makedirs(dirname(path))
+
+        self.db = sqlite3.connect(path)
+        # readers (e.g. the spider checking for known reports)
+        # are never blocked by the pipeline writing
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def add_listing(self, row):
+        """Add row of the getAll report list (see iter_listing), keeping scraped metadata."""
+        self.db.execute('INSERT OR IGNORE INTO reports (id) VALUES (?)', (row['id'],))
+        self.db.execute(
+            'UPDATE reports SET source_url = ?, listing_title = ?, listing_cells = ?, listing_date = ? WHERE id = ?',
+            (row['source_url'], row['title'], json.dumps(row['cells'], ensure_ascii=False), row['publish_date'],
+             row['id']))
+
+    def add_preface(self, preface):
+        """Set metadata of scraped report from cleaned preface, and reset its counts until it's done."""
+        self.db.execute('INSERT OR IGNORE INTO reports (id) VALUES (?)', (preface['id'],))
+        self.db.execute(
+            'UPDATE reports SET source_url = ?, report_name = ?, report_type = ?, publish_date = ?,'
+            ' catalog_number = ?, chapters = 0, topics = 0, scraped_at = ?, done_at = NULL WHERE id = ?',
+            (preface['source_url'], preface['report_name'], preface['report_type'], preface['publish_date'],
+             preface['catalog_number'], datetime.utcnow().isoformat(), preface['id']))
+
+    def add_counts(self, id, chapters=0, topics=0):
+        self.db.execute('UPDATE reports SET chapters = chapters + ?, topics = topics + ? WHERE id = ?',
+                        (chapters, topics, id))
+
+    def report_done(self, id):
+        """Mark scraped report complete i.e. all of its items were added."""
+        self.db.execute('UPDATE reports SET done_at = ? WHERE id = ? AND scraped_at IS NOT NULL',
+                        (datetime.utcnow().isoformat(), id))
+
+    def commit(self):
+        self.db.commit()
+
+    def known(self, id, before=None):
+        """Return whether report was already scraped completely.
+
+        before: only reports done before this ISO format UTC time
+        """
+        if before is None:
+            return self.db.execute('SELECT done_at IS NOT NULL FROM reports WHERE id = ?', (id,)).fetchone() == (1,)
+        return self.db.execute('SELECT done_at < ? FROM reports WHERE id = ?', (before, id)).fetchone() == (1,)
+
+    def done_reports(self):
+        """Return ids of reports scraped completely."""
+        return {id for (id,) in self.db.execute('SELECT id FROM reports WHERE done_at IS NOT NULL')}
+
+    def get(self, id):
+        """Return all catalog columns of report, or None if it isn't in the catalog."""
+        cursor = self.db.execute('SELECT * FROM reports WHERE id = ?', (id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        report = dict(zip([c[0] for c in cursor.description], row))
+        report['listing_cells'] = json.loads(report['listing_cells']) if report['listing_cells'] else None
+        return report
+
+    def query(self, report_type=None, since=None, until=None, catalog_number=None):
+        """Return summaries of scraped reports matching all given filters, ordered by publish date.
+
+        since, until: inclusive YYYY-MM-DD publish date range
+        """
+        conditions = ['publish_date IS NOT NULL']
+        params = []
+        for column, op, value in [('report_type', '=', report_type),
+                                  ('publish_date', '>=', since),
+                                  ('publish_date', '<=', until),
+                                  ('catalog_number', '=', catalog_number)]:
+            if value is not None:
+                conditions.append('{} {} ?'.format(column, op))
+                params.append(value)
+
+        cursor = self.db.execute('SELECT {} FROM reports WHERE {} ORDER BY publish_date, id'.format(
+            ', '.join(SUMMARY_COLUMNS), ' AND '.join(conditions)), params)
+        return [dict(zip(SUMMARY_COLUMNS, row)) for row in cursor]
+
+
+def build(catalog, dirname):
+    """Add all reports from output directory to catalog.
+
+    Reports in the output directory are taken to be complete.
+    """
+    counts = {'chapters': Counter(), 'topics': Counter()}
+    for name, counter in counts.items():
+        with open(join(dirname, '{}.json'.format(name)), 'r') as f:
+            for line in f:
+                counter[json.loads(line)['id']] += 1
+
+    with open(join(dirname, 'prefaces.json'), 'r') as f:
+        for line in f:
+            preface = json.loads(line)
+            catalog.add_preface(preface)
+            catalog.add_counts(preface['id'], counts['chapters'][preface['id']], counts['topics'][preface['id']])
+            catalog.report_done(preface['id'])
+    catalog.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query the report catalog.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    build_parser = subparsers.add_parser('build', help='add output directory reports to catalog')
+    build_parser.add_argument('dirname', help='scraper output directory')
+    build_parser.add_argument('--listing', help='saved getAll response to add to catalog')
+
+    query_parser = subparsers.add_parser('query', help='print matching reports in JSON Lines format')
+    query_parser.add_argument('dirname', help='scraper output directory')
+    query_parser.add_argument('--type', dest='report_type')
+    query_parser.add_argument('--year', type=int)
+    query_parser.add_argument('--since', help='YYYY-MM-DD')
+    query_parser.add_argument('--until', help='YYYY-MM-DD')
+    query_parser.add_argument('--catalog-number')
+
+    args = parser.parse_args()
+    catalog = Catalog(join(args.dirname, 'catalog.db'))
+
+    if args.command == 'build':
+        if args.listing:
+            with open(args.listing, 'rb') as f:
+                for row in iter_listing(f.read(), 'http://www.mevaker.gov.il/'):
+                    catalog.add_listing(row)
+        build(catalog, args.dirname)
+    else:
+        since, until = args.since, args.until
+        if args.year is not None:
+            since = max(since or '', '{}-01-01'.format(args.year))
+            until = min(until or '9999', '{}-12-31'.format(args.year))
+        for report in catalog.query(args.report_type, since, until, args.catalog_number):
+            print(json.dumps(report, ensure_ascii=False))
+
+    catalog.close()
@@ -0,0 +1,179 @@
+"""Checkpointed output segments for resumable crawls.
+
+A crawl with JOBDIR set (e.g. scrapy crawl report_spider -s JOBDIR=crawls/full)
+keeps its request queue and seen requests on disk, and can be resumed after being stopped.
+ReportPipeline then doesn't write output files directly, since a crashed crawl
+would leave them with partially written reports, and a new crawl would truncate them.
+Instead every run writes a new segment under JOBDIR:
+
+    segments/0001/prefaces.json, chapters.json, topics.json
+    segments/0002/...
+    segments/checkpoint.json
+
+A report's lines are buffered until the spider marks it done (ReportDone item),
+and are then written to the current segment as a whole.
+Every CHECKPOINT_INTERVAL seconds, segments are fsync'd and checkpoint.json is replaced
+with their current sizes and the ids of all reports written so far.
+
+When resuming, segments are truncated to their checkpointed sizes,
+and reports written before the checkpoint are skipped, so a crash costs at most
+the reports done in the last checkpoint interval.
+The checkpoint also records when the crawl started, so with CATALOG_SKIP_KNOWN set
+the catalog only skips reports done before it (see Catalog.known):
+reports done since are only skipped if the checkpoint has them.
+Once the crawl finishes, all segments are concatenated into the output directory,
+and the columnar and entity tables are converted from it (see ColumnarExportPipeline).
+Requests taken off the persisted queue by a stopped run, whose reports weren't
+exported before it stopped, are requested again once the queue is drained (see ReportSpider.spider_idle).
+"""
+
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from os import makedirs, listdir, replace
+from os.path import exists, getsize, isdir, join
+
+
+NAMES = ['prefaces', 'chapters', 'topics']
+
+
+def fsync_replace(path, data):
+    """Atomically and durably replace file contents."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    replace(tmp_path, path)
+
+
+def output_sizes(dirname):
+    """Return current sizes of output files, by name."""
+    return {name: getsize(join(dirname, '{}.json'.format(name))) if exists(join(dirname, '{}.json'.format(name))) else 0
+            for name in NAMES}
+
+
+def drop_previous_copies(dirname, sizes, ids):
+    """Remove lines of reports ids written before given output file sizes.
+
+    Crawls appending to the previous output (see CATALOG_SKIP_KNOWN) scrape
+    reports which weren't done again, so once their new lines were appended
+    the lines of their previous, incomplete copies are removed.
+    """
+    if not ids:
+        return
+
+    for name in NAMES:
+        path = join(dirname, '{}.json'.format(name))
+        tmp_path = path + '.tmp'
+        with open(path, 'rb') as f, open(tmp_path, 'wb') as output:
+            while f.tell() < sizes[name]:
+                line = f.readline()
+                if json.loads(line.decode('utf-8'))['id'] not in ids:
+                    output.write(line)
+            shutil.copyfileobj(f, output)
+            output.flush()
+            os.fsync(output.fileno())
+        replace(tmp_path, path)
+
+
+def segments_dirname(settings):
+    """Return segments directory of a resumable crawl, or None if JOBDIR isn't set."""
+    jobdir = settings.get('JOBDIR')
+    if not jobdir:
+        return None
+    return join(jobdir, 'segments')
+
+
+def load_checkpoint(dirname):
+    """Return checkpoint of segments directory.
+
+    {'segments': {segment: {name: size}}, 'done': [report ids], 'started_at': ISO format UTC time or None}
+    """
+    path = join(dirname, 'checkpoint.json')
+    if not exists(path):
+        return {'segments': {}, 'done': [], 'started_at': None}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class SegmentWriter(object):
+    """Write whole reports into a new segment, checkpointing periodically."""
+
+    def __init__(self, dirname, interval=60):
+        self.dirname = dirname
+        self.interval = interval
+        if not exists(dirname):
+            makedirs(dirname)
+
+        checkpoint = load_checkpoint(dirname)
+        self.sizes = checkpoint['segments']
+        self.done = set(checkpoint['done'])
+        self.started_at = checkpoint['started_at'] or datetime.utcnow().isoformat()
+
+        # drop anything written after the last checkpoint
+        for segment in listdir(dirname):
+            if not isdir(join(dirname, segment)):
+                continue
+            if segment not in self.sizes:
+                shutil.rmtree(join(dirname, segment))
+                continue
+            for name, size in self.sizes[segment].items():
+                with open(join(dirname, segment, '{}.json'.format(name)), 'r+b') as f:
+                    f.truncate(size)
+
+        self.segment = '{:04d}'.format(max([int(s) for s in self.sizes] or [0]) + 1)
+        makedirs(join(dirname, self.segment))
+        self.files = {name: open(join(dirname, self.segment, '{}.json'.format(name)), 'wb') for name in NAMES}
+        self.sizes[self.segment] = {name: 0 for name in NAMES}
+
+        self.buffers = {}  # report id --> [(name, line)]
+        # record the start time of a new crawl right away
+        self.checkpoint()
+
+    def write(self, name, id, line):
+        """Buffer output line of report, until it's done."""
+        self.buffers.setdefault(id, []).append((name, line))
+
+    def report_done(self, id):
+        for name, line in self.buffers.pop(id, []):
+            self.files[name].write(line)
+        self.done.add(id)
+
+        if time.time() - self.last_checkpoint >= self.interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        for name, f in self.files.items():
+            f.flush()
+            os.fsync(f.fileno())
+            self.sizes[self.segment][name] = f.tell()
+
+        fsync_replace(join(self.dirname, 'checkpoint.json'),
+                      json.dumps({'segments': self.sizes, 'done': sorted(self.done), 'started_at': self.started_at}))
+        self.last_checkpoint = time.time()
+
+    def close(self):
+        """Checkpoint and close current segment.
+
+        Lines of reports which weren't marked done are discarded.
+        """
+        self.checkpoint()
+        for f in self.files.values():
+            f.close()
+
+    def finish(self, output_dirname, append=False):
+        """Concatenate all segments into output directory files, and remove them."""
+        for name in NAMES:
+            with open(join(output_dirname, '{}.json'.format(name)), 'ab' if append else 'wb') as output:
+                for segment in sorted(self.sizes):
+                    path = join(self.dirname, segment, '{}.json'.format(name))
+                    if exists(path) and getsize(path):
+                        with open(path, 'rb') as f:
+                            shutil.copyfileobj(f, output)
+                output.flush()
+                os.fsync(output.fileno())
+
+        shutil.rmtree(self.dirname)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""Columnar (Parquet) export of report prefaces, chapters and topics.
+
+The JSON Lines output is great for dumping and grepping,
+but analytics over it (e.g. defects per office per year) means loading
+every object into python first.
+
+Here we flatten the same data into five Parquet tables:
+
+    prefaces                    one row per report
+    chapters                    one row per chapter
+    topics                      one row per topic
+    preface_office_defects      one row per (report, office, defect)
+    preface_keyword_defects     one row per (report, keyword, defect)
+
+Office, keyword and report type columns are dictionary encoded,
+since the same few hundred hebrew strings repeat across the whole corpus.
+Aggregate queries only need to read the columns they use, for example:
+
+    pq.read_table('output/columnar/preface_office_defects.parquet',
+                  columns=['office', 'publish_date'])
+
+This module is used by ColumnarExportPipeline while crawling
+(or once the crawl is closed, if it only added reports to the output directory),
+but can also be executed manually to convert an existing output directory:
+
+    python -m report.columnar output
+"""
+
+import json
+import sys
+from datetime import datetime
+from os import makedirs
+from os.path import exists, join
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+DICTIONARY_STRING = pa.dictionary(pa.int32(), pa.string())
+
+SCHEMAS = {
+    'prefaces': pa.schema([
+        ('id', pa.string()),
+        ('source_url', pa.string()),
+        ('report_name', pa.string()),
+        ('report_type', DICTIONARY_STRING),
+        ('catalog_number', pa.string()),
+        ('publish_date', pa.date32()),
+        ('issn_number', pa.string()),
+        ('toc_pdf_hebrew_url', pa.string()),
+        ('toc_docx_hebrew_url', pa.string()),
+        ('intro_pdf_hebrew_url', pa.string()),
+        ('intro_docx_hebrew_url', pa.string()),
+        ('intro_pdf_arabic_url', pa.string()),
+        ('intro_docx_arabic_url', pa.string()),
+        ('body', pa.list_(pa.string())),
+    ]),
+    'chapters': pa.schema([
+        ('id', pa.string()),
+        ('source_url', pa.string()),
+        ('chapter_num', pa.int32()),
+        ('title', pa.string()),
+        ('offices', pa.list_(DICTIONARY_STRING)),
+        ('keywords', pa.list_(DICTIONARY_STRING)),
+    ]),
+    'topics': pa.schema([
+        ('id', pa.string()),
+        ('source_url', pa.string()),
+        ('chapter_num', pa.int32()),
+        ('pdf_url', pa.string()),
+        ('docx_url', pa.string()),
+        ('title', pa.string()),
+        ('office', DICTIONARY_STRING),
+        ('body', pa.string()),
+    ]),
+    # report type and publish date are repeated in the mapping tables
+    # so per-year / per-type aggregations don't need a join
+    'preface_office_defects': pa.schema([
+        ('id', pa.string()),
+        ('report_type', DICTIONARY_STRING),
+        ('publish_date', pa.date32()),
+        ('office', DICTIONARY_STRING),
+        ('defect', pa.string()),
+    ]),
+    'preface_keyword_defects': pa.schema([
+        ('id', pa.string()),
+        ('report_type', DICTIONARY_STRING),
+        ('publish_date', pa.date32()),
+        ('keyword', DICTIONARY_STRING),
+        ('defect', pa.string()),
+    ]),
+}
+
+
+def parse_date(date):
+    """Convert 'YYYY-MM-DD' output date strings to date objects."""
+    return datetime.strptime(date, '%Y-%m-%d').date() if date is not None else None
+
+
+def flatten(name, data):
+    """Generate (table name, row) pairs for a cleaned output object.
+
+    name is the output file the object belongs to
+    i.e. 'prefaces', 'chapters' or 'topics'.
+    """
+    if name != 'prefaces':
+        yield name, {field: data[field] for field in SCHEMAS[name].names}
+        return
+
+    publish_date = parse_date(data['publish_date'])
+
+    row = {field: data[field] for field in SCHEMAS['prefaces'].names}
+    row['publish_date'] = publish_date
+    yield 'prefaces', row
+
+    for (table, key, mapping) in [('preface_office_defects', 'office', data['offices_to_defects']),
+                                  ('preface_keyword_defects', 'keyword', data['keywords_to_defects'])]:
+        for value, defects in mapping.items():
+            for defect in defects:
+                yield table, {
+                    'id': data['id'],
+                    'report_type': data['report_type'],
+                    'publish_date': publish_date,
+                    key: value,
+                    'defect': defect,
+                }
+
+
+class ColumnarWriter(object):
+    """Buffer flattened rows and write them as Parquet row groups.
+
+    Rows are buffered column-wise per table,
+    and flushed every row_group_size rows to bound memory usage.
+    """
+
+    def __init__(self, dirname, row_group_size=10000):
+        if not exists(dirname):
+            makedirs(dirname)
+
+        self.dirname = dirname
+        self.row_group_size = row_group_size
+        self.writers = {}
+        self.buffers = {name: {field: [] for field in schema.names}
+                        for (name, schema) in SCHEMAS.items()}
+
+    def write(self, name, data):
+        """Flatten cleaned output object and buffer its rows."""
+        for table, row in flatten(name, data):
+            columns = self.buffers[table]
+            for field, values in columns.items():
+                values.append(row[field])
+
+            if len(columns['id']) >= self.row_group_size:
+                self.flush(table)
+
+    def flush(self, table):
+        columns = self.buffers[table]
+        if not columns['id']:
+            return
+
+        if table not in self.writers:
+            self.writers[table] = pq.ParquetWriter(join(self.dirname, '{}.parquet'.format(table)),
+                                                   SCHEMAS[table])
+
+        self.writers[table].write_table(pa.Table.from_pydict(columns, schema=SCHEMAS[table]))
+        for values in columns.values():
+            del values[:]
+
+    def close(self):
+        for table in SCHEMAS:
+            self.flush(table)
+
+            # write an empty file for tables without any rows,
+            # so readers can always expect all tables to exist
+            if table not in self.writers:
+                self.writers[table] = pq.ParquetWriter(join(self.dirname, '{}.parquet'.format(table)),
+                                                       SCHEMAS[table])
+
+        for writer in self.writers.values():
+            writer.close()
+
+
+def convert(dirname):
+    """Convert JSON Lines output directory into Parquet tables.
+
+    Tables are written into a 'columnar' directory inside the given directory.
+    """
+    writer = ColumnarWriter(join(dirname, 'columnar'))
+    for name in ['prefaces', 'chapters', 'topics']:
+        with open(join(dirname, '{}.json'.format(name)), 'r') as f:
+            for line in f:
+                writer.write(name, json.loads(line))
+    writer.close()
+
+
+if __name__ == '__main__':
+    convert(sys.argv[1])
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+"""Materialized aggregate cube of reports, topics and defects, in a SQLite database.
+
+Dimensions are the publish year, report type, office and keyword.
+Every cell holds counts of the reports, topics and defects matching all of its dimension values,
+where '*' (ALL) matches any value:
+
+    cells(year, report_type, office, keyword, reports, topics, defects)
+
+Dimension values are interned into integer member ids (0 being ALL), which keeps
+the cells and their indexes compact: the office x keyword cuboids alone
+hold about a million cells.
+
+All 16 combinations of ALL and non-ALL dimensions (cuboids) are materialized,
+so a roll-up (e.g. reports per year, for all offices) and a drill-down
+(e.g. offices of a single year and report type) each read precomputed cells,
+using the primary key or one of the covering indexes.
+
+Every report, topic and defect is counted in the cells of its offices and keywords:
+
+    report      preface offices and keywords, and offices and keywords of its chapters and topics
+    topic       topic office, or its chapter offices if it has none, and its chapter keywords
+    defect      offices and keywords the preface maps the (normalized) defect title to
+
+so a report counts once in a cell, no matter how many of its offices or keywords the cell matches.
+
+The cube is updated incrementally, a report at a time. The facts every report was counted by
+are kept, so a report which is updated is first subtracted from the cube.
+CubePipeline updates the cube once all items of a report were scraped,
+and it can be built or updated from an existing output directory (e.g. after new reports were appended):
+
+    python -m report.cube update output
+    python -m report.cube query output --year 2016
+    python -m report.cube query output --year 2016 --by office
+"""
+
+import argparse
+import itertools
+import json
+import sqlite3
+from os import makedirs
+from os.path import dirname, exists, join
+
+from report.defects import KINDS, defect_key
+
+
+ALL = '*'
+
+DIMENSIONS = ['year', 'report_type', 'office', 'keyword']
+MEASURES = ['reports', 'topics', 'defects']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    id INTEGER PRIMARY KEY,
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    UNIQUE (dimension, value)
+);
+
+CREATE TABLE IF NOT EXISTS cells (
+    year INTEGER NOT NULL,
+    report_type INTEGER NOT NULL,
+    office INTEGER NOT NULL,
+    keyword INTEGER NOT NULL,
+    reports INTEGER NOT NULL DEFAULT 0,
+    topics INTEGER NOT NULL DEFAULT 0,
+    defects INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (year, report_type, office, keyword)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS cells_by_year
+    ON cells (report_type, office, keyword, year, reports, topics, defects);
+CREATE INDEX IF NOT EXISTS cells_by_report_type
+    ON cells (year, office, keyword, report_type, reports, topics, defects);
+CREATE INDEX IF NOT EXISTS cells_by_office
+    ON cells (year, report_type, keyword, office, reports, topics, defects);
+
+CREATE TABLE IF NOT EXISTS reports (
+    id TEXT PRIMARY KEY,
+    facts TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+INDEXES = ['cells_by_year', 'cells_by_report_type', 'cells_by_office']
+
+# member id of ALL, in every dimension
+ALL_ID = 0
+
+
+def report_facts(preface, chapters, topics):
+    """Return dimension values a report and its topics and defects are counted by.
+
+    chapters, topics: cleaned chapters and topics of the report
+    """
+    chapter_offices = {c['chapter_num']: c['offices'] for c in chapters}
+    chapter_keywords = {c['chapter_num']: c['keywords'] for c in chapters}
+
+    offices = list(preface['offices_to_defects'])
+    keywords = list(preface['keywords_to_defects'])
+    for chapter in chapters:
+        offices += [o for o in chapter['offices'] if o not in offices]
+        keywords += [k for k in chapter['keywords'] if k not in keywords]
+
+    topic_facts = []
+    for topic in topics:
+        topic_offices = [topic['office']] if topic['office'] else chapter_offices.get(topic['chapter_num'], [])
+        topic_facts.append([topic_offices, chapter_keywords.get(topic['chapter_num'], [])])
+        offices += [o for o in topic_offices if o not in offices]
+
+    defects = {}
+    for (kind, field) in KINDS:
+        for name, titles in preface[field].items():
+            for title in titles:
+                key = defect_key(title)
+                if key:
+                    defect = defects.setdefault(key, [[], []])
+                    names = defect[0 if kind == 'office' else 1]
+                    if name not in names:
+                        names.append(name)
+
+    return {
+        'year': preface['publish_date'][:4] if preface['publish_date'] else '',
+        'report_type': preface['report_type'] or '',
+        'report': [offices, keywords],
+        'topics': topic_facts,
+        'defects': sorted(defects.values()),
+    }
+
+
+def cell_counts(facts, member, counts=None, sign=1):
+    """Return counts of every cell report facts are counted in: (member ids) --> [reports, topics, defects].
+
+    member: function returning member id of (dimension, value)
+    Counts are added (or subtracted, if sign is -1) to given counts, if any.
+    """
+    counts = {} if counts is None else counts
+    year, report_type = member('year', facts['year']), member('report_type', facts['report_type'])
+
+    def add(measure, offices, keywords):
+        for cell in itertools.product([year, ALL_ID], [report_type, ALL_ID],
+                                      {member('office', o) for o in offices} | {ALL_ID},
+                                      {member('keyword', k) for k in keywords} | {ALL_ID}):
+            counts.setdefault(cell, [0, 0, 0])[measure] += sign
+
+    add(0, *facts['report'])
+    for offices, keywords in facts['topics']:
+        add(1, offices, keywords)
+    for offices, keywords in facts['defects']:
+        add(2, offices, keywords)
+    return counts
+
+
+class Cube(object):
+    """Aggregate cube database."""
+
+    def __init__(self, path):
+        if dirname(path) and not exists(dirname(path)):
+            makedirs(dirname(path))
+
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+        self.members = {(dimension, value): id for (id, dimension, value)
+                        in self.db.execute('SELECT id, dimension, value FROM members')}
+        self.pending = {}
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def member(self, dimension, value, create=True):
+        """Return member id of dimension value, or None if it isn't in the cube and create is False."""
+        if value == ALL:
+            return ALL_ID
+        try:
+            return self.members[(dimension, value)]
+        except KeyError:
+            if not create:
+                return None
+            id = self.db.execute('INSERT INTO members (dimension, value) VALUES (?, ?)', (dimension, value)).lastrowid
+            self.members[(dimension, value)] = id
+            return id
+
+    def add_report(self, id, facts):
+        """Count report in cube, replacing its previous counts.
+
+        Cells are only updated on commit, so adding many reports at once
+        updates every cell once.
+        Returns whether the cube changed i.e. the report is new or its facts changed.
+        """
+        row = self.db.execute('SELECT facts FROM reports WHERE id = ?', (id,)).fetchone()
+        if row is not None:
+            if json.loads(row[0]) == facts:
+                return False
+            cell_counts(json.loads(row[0]), self.member, self.pending, -1)
+
+        cell_counts(facts, self.member, self.pending)
+        self.db.execute('INSERT OR REPLACE INTO reports (id, facts) VALUES (?, ?)',
+                        (id, json.dumps(facts, ensure_ascii=False)))
+        return True
+
+    def commit(self):
+        updates = sorted((cell, counts) for (cell, counts) in self.pending.items() if any(counts))
+        updates = [tuple(counts) + cell for (cell, counts) in updates]
+        self.pending = {}
+        if not updates:
+            self.db.commit()
+            return
+
+        if self.db.execute('SELECT NOT EXISTS (SELECT 1 FROM cells)').fetchone()[0]:
+            # building a new cube, so inserting sorted cells and indexing them afterwards
+            # is a lot faster than updating all indexes on every insert
+            for index in INDEXES:
+                self.db.execute('DROP INDEX {}'.format(index))
+            self.db.executemany(
+                'INSERT INTO cells (reports, topics, defects, year, report_type, office, keyword)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)', updates)
+            self.db.executescript(SCHEMA)
+            return
+
+        self.db.executemany('INSERT OR IGNORE INTO cells (year, report_type, office, keyword) VALUES (?, ?, ?, ?)',
+                            [update[3:] for update in updates])
+        self.db.executemany(
+            'UPDATE cells SET reports = reports + ?, topics = topics + ?, defects = defects + ?'
+            ' WHERE year = ? AND report_type = ? AND office = ? AND keyword = ?', updates)
+        # only cells whose counts all decreased can reach zero
+        self.db.executemany(
+            'DELETE FROM cells WHERE year = ? AND report_type = ? AND office = ? AND keyword = ?'
+            ' AND reports = 0 AND topics = 0 AND defects = 0',
+            [update[3:] for update in updates if max(update[:3]) <= 0])
+        self.db.commit()
+
+    def query(self, by=None, **values):
+        """Return cells matching dimension values, ALL for missing dimensions.
+
+        by: dimension to drill down into i.e. return a cell for each of its values,
+        instead of a single cell rolled up over all of them
+        """
+        conditions = []
+        params = []
+        for dimension in DIMENSIONS:
+            if dimension == by:
+                conditions.append('cells.{} != ?'.format(dimension))
+                params.append(ALL_ID)
+            else:
+                value = values.get(dimension)
+                member = self.member(dimension, str(value) if value is not None else ALL, create=False)
+                if member is None:
+                    return []
+                conditions.append('cells.{} = ?'.format(dimension))
+                params.append(member)
+
+        cursor = self.db.execute('SELECT {}, {} FROM cells WHERE {}'.format(
+            ', '.join('cells.{}'.format(d) for d in DIMENSIONS), ', '.join(MEASURES), ' AND '.join(conditions)),
+            params)
+
+        names = {id: value for ((_, value), id) in self.members.items()}
+        names[ALL_ID] = ALL
+        results = [dict(zip(DIMENSIONS, [names[id] for id in row[:4]]), **dict(zip(MEASURES, row[4:])))
+                   for row in cursor]
+        return sorted(results, key=lambda cell: (-cell['reports'], cell[by or 'year']))
+
+
+def update(cube, dirname):
+    """Count new and changed reports of output directory in cube. Returns number of updated reports."""
+    items = {'chapters': {}, 'topics': {}}
+    for name, by_id in items.items():
+        with open(join(dirname, '{}.json'.format(name)), 'r') as f:
+            for line in f:
+                item = json.loads(line)
+                by_id.setdefault(item['id'], []).append(item)
+
+    count = 0
+    with open(join(dirname, 'prefaces.json'), 'r') as f:
+        for line in f:
+            preface = json.loads(line)
+            facts = report_facts(preface,
+                                 items['chapters'].get(preface['id'], []),
+                                 items['topics'].get(preface['id'], []))
+            count += cube.add_report(preface['id'], facts)
+    cube.commit()
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update or query the aggregate cube.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    update_parser = subparsers.add_parser('update', help='count new and changed reports of output directory')
+    update_parser.add_argument('dirname', help='scraper output directory')
+
+    query_parser = subparsers.add_parser('query', help='print matching cells in JSON Lines format')
+    query_parser.add_argument('dirname', help='scraper output directory')
+    for dimension in DIMENSIONS:
+        query_parser.add_argument('--{}'.format(dimension.replace('_', '-')), dest=dimension)
+    query_parser.add_argument('--by', choices=DIMENSIONS, help='dimension to drill down into')
+
+    args = parser.parse_args()
+    cube = Cube(join(args.dirname, 'cube.db'))
+
+    if args.command == 'update':
+        print('updated {} reports'.format(update(cube, args.dirname)))
+    else:
+        for cell in cube.query(args.by, **{d: getattr(args, d) for d in DIMENSIONS}):
+            print(json.dumps(cell, ensure_ascii=False))
+
+    cube.close()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""Inverted defect index, in a SQLite database.
+
+Prefaces map offices and keywords to defect titles. Here the mapping is inverted,
+so the offices, keywords and reports of a defect are looked up by its title
+without scanning and inverting every preface:
+
+    defects(key, title)                     key is the normalized defect title
+    links(key, kind, name, report_id)       kind is 'office' or 'keyword'
+    reports(id, digest)                     indexed reports, and a hash of their mappings
+
+links is keyed by defect key, so a defect lookup reads a single primary key range.
+Secondary indexes on (kind, name) and (report_id) answer the opposite direction
+i.e. the defects of an office or keyword, and re-indexing a report.
+
+Defect titles are normalized (see report.text), so spelling variations of niqqud,
+acronym quotes and punctuation share a key.
+
+The index is updated incrementally: prefaces are only (re)indexed if they are new,
+or their mappings changed since they were last indexed.
+DefectIndexPipeline updates it while crawling, but it can also be built from an existing output directory,
+and queried:
+
+    python -m report.defects build output
+    python -m report.defects defect output "ליקויים בהתקשרויות"
+    python -m report.defects office output "משרד הבריאות"
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+from os import makedirs
+from os.path import dirname, exists, join
+
+from report.text import words
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS defects (
+    key TEXT PRIMARY KEY,
+    title TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS links (
+    key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    report_id TEXT NOT NULL,
+    PRIMARY KEY (key, kind, name, report_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS links_by_name ON links (kind, name, key);
+CREATE INDEX IF NOT EXISTS links_by_report ON links (report_id);
+
+CREATE TABLE IF NOT EXISTS reports (
+    id TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+KINDS = [('office', 'offices_to_defects'), ('keyword', 'keywords_to_defects')]
+
+
+def defect_key(title):
+    return ' '.join(words(title))
+
+
+def mapping_digest(preface):
+    mappings = [preface[field] for (_, field) in KINDS]
+    return hashlib.sha1(json.dumps(mappings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class DefectIndex(object):
+    """Defect index database."""
+
+    def __init__(self, path):
+        if dirname(path) and not exists(dirname(path)):
+            makedirs(dirname(path))
+
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def commit(self):
+        self.db.commit()
+
+    def add_preface(self, preface):
+        """Index defects of cleaned preface, replacing its previous links.
+
+        Returns whether the preface was (re)indexed i.e. it's new or its mappings changed.
+        """
+        digest = mapping_digest(preface)
+        if self.db.execute('SELECT digest FROM reports WHERE id = ?', (preface['id'],)).fetchone() == (digest,):
+            return False
+
+        previous_keys = [key for (key,) in self.db.execute(
+            'SELECT DISTINCT key FROM links WHERE report_id = ?', (preface['id'],))]
+        self.db.execute('DELETE FROM links WHERE report_id = ?', (preface['id'],))
+        for kind, field in KINDS:
+            for name, titles in preface[field].items():
+                for title in titles:
+                    key = defect_key(title)
+                    if not key:
+                        continue
+                    self.db.execute('INSERT OR IGNORE INTO defects (key, title) VALUES (?, ?)', (key, title))
+                    self.db.execute('INSERT OR IGNORE INTO links (key, kind, name, report_id) VALUES (?, ?, ?, ?)',
+                                    (key, kind, name, preface['id']))
+
+        # defects no report maps any more
+        self.db.executemany('DELETE FROM defects WHERE key = ? AND NOT EXISTS (SELECT 1 FROM links WHERE key = ?)',
+                            [(key, key) for key in previous_keys])
+
+        self.db.execute('INSERT OR REPLACE INTO reports (id, digest) VALUES (?, ?)', (preface['id'], digest))
+        return True
+
+    def defect(self, title):
+        """Return defect's title, offices, keywords and report ids, or None if it isn't indexed."""
+        key = defect_key(title)
+        row = self.db.execute('SELECT title FROM defects WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        result = {'defect': row[0], 'offices': [], 'keywords': [], 'reports': []}
+        for kind, name, report_id in self.db.execute(
+                'SELECT kind, name, report_id FROM links WHERE key = ? ORDER BY kind, name, report_id', (key,)):
+            if name not in result[kind + 's']:
+                result[kind + 's'].append(name)
+            if report_id not in result['reports']:
+                result['reports'].append(report_id)
+        result['reports'].sort()
+        return result
+
+    def defects_of(self, kind, name):
+        """Return titles of defects mapped to office or keyword name, and the reports they're mapped in."""
+        cursor = self.db.execute(
+            'SELECT defects.title, links.report_id FROM links JOIN defects ON defects.key = links.key'
+            ' WHERE links.kind = ? AND links.name = ? ORDER BY links.key, links.report_id', (kind, name))
+
+        results = {}
+        for title, report_id in cursor:
+            results.setdefault(title, []).append(report_id)
+        return [{'defect': title, 'reports': reports} for (title, reports) in results.items()]
+
+
+def build(index, dirname):
+    """Index new and changed prefaces of output directory. Returns number of indexed prefaces."""
+    count = 0
+    with open(join(dirname, 'prefaces.json'), 'r') as f:
+        for line in f:
+            count += index.add_preface(json.loads(line))
+    index.commit()
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query the defect index.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    build_parser = subparsers.add_parser('build', help='index new and changed prefaces of output directory')
+    build_parser.add_argument('dirname', help='scraper output directory')
+
+    for kind in ['defect', 'office', 'keyword']:
+        query_parser = subparsers.add_parser(kind, help='print {} defect index entries'.format(kind))
+        query_parser.add_argument('dirname', help='scraper output directory')
+        query_parser.add_argument('name', help='defect title' if kind == 'defect' else '{} name'.format(kind))
+
+    args = parser.parse_args()
+    index = DefectIndex(join(args.dirname, 'defects.db'))
+
+    if args.command == 'build':
+        print('indexed {} prefaces'.format(build(index, args.dirname)))
+    elif args.command == 'defect':
+        print(json.dumps(index.defect(args.name), ensure_ascii=False))
+    else:
+        for entry in index.defects_of(args.command, args.name):
+            print(json.dumps(entry, ensure_ascii=False))
+
+    index.close()
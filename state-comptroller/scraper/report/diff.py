@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""Diff two output directories, e.g. of the previous and the latest crawl.
+
+Records are matched by key:
+
+    prefaces    (id)
+    chapters    (id, chapter_num)
+    topics      (id, chapter_num, title)
+
+Topics sharing a title inside the same chapter are matched by content first,
+and the rest of them are paired up as changed records.
+
+Neither snapshot is loaded as a whole. Each file is scanned once,
+keeping only the key, a content hash and the byte offset of every record.
+Both sorted key lists are then merge-joined, and only added and changed records
+are read again from the new snapshot (removed ones from the old snapshot).
+
+The result is a change feed in JSON Lines format, one line per changed record:
+
+    {"op": "added" | "removed" | "changed", "type": "topics", "key": [...], "record": {...}}
+
+where record is the new record, or the old record for removed ones.
+
+    python -m report.diff old-output output > changes.json
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import sys
+from collections import Counter
+from os.path import join
+
+
+FILES = ['prefaces', 'chapters', 'topics']
+
+
+def record_key(name, record):
+    if name == 'prefaces':
+        return [record['id']]
+    if name == 'chapters':
+        return [record['id'], record['chapter_num']]
+    return [record['id'], record['chapter_num'], record['title']]
+
+
+def snapshot(path, name):
+    """Return sorted (key, hash, offset) of every record in file.
+
+    Keys are compared as their JSON representation,
+    since they can mix strings, numbers and nulls.
+    """
+    entries = []
+    with open(path, 'rb') as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                record = json.loads(line.decode('utf-8'))
+                key = json.dumps(record_key(name, record), ensure_ascii=False)
+                digest = hashlib.sha1(json.dumps(record, sort_keys=True).encode('utf-8')).digest()
+                entries.append((key, digest, offset))
+            offset += len(line)
+
+    entries.sort()
+    return entries
+
+
+def merge(old, new):
+    """Merge-join sorted snapshots, and generate (op, key, offset) of differing records.
+
+    offset is of the new record, or of the old one for removed records.
+    """
+    def groups(entries):
+        for key, group in itertools.groupby(entries, key=lambda e: e[0]):
+            yield key, list(group)
+
+    old_groups, new_groups = groups(old), groups(new)
+    old_group, new_group = next(old_groups, None), next(new_groups, None)
+    while old_group is not None or new_group is not None:
+        if new_group is None or (old_group is not None and old_group[0] < new_group[0]):
+            for key, _, offset in old_group[1]:
+                yield 'removed', key, offset
+            old_group = next(old_groups, None)
+        elif old_group is None or new_group[0] < old_group[0]:
+            for key, _, offset in new_group[1]:
+                yield 'added', key, offset
+            new_group = next(new_groups, None)
+        else:
+            # records sharing a key are matched by content first
+            unmatched = Counter(digest for (_, digest, _) in old_group[1])
+            removed = list(old_group[1])
+            changed = []
+            for entry in new_group[1]:
+                if unmatched[entry[1]] > 0:
+                    unmatched[entry[1]] -= 1
+                    removed.remove(next(e for e in removed if e[1] == entry[1]))
+                else:
+                    changed.append(entry)
+
+            for entry in changed[:len(removed)]:
+                yield 'changed', entry[0], entry[2]
+            for entry in changed[len(removed):]:
+                yield 'added', entry[0], entry[2]
+            for entry in removed[len(changed):]:
+                yield 'removed', entry[0], entry[2]
+
+            old_group, new_group = next(old_groups, None), next(new_groups, None)
+
+
+def read_record(f, offset):
+    f.seek(offset)
+    return json.loads(f.readline().decode('utf-8'))
+
+
+def diff(old_dirname, new_dirname, names=FILES):
+    """Generate change feed entries of all output files."""
+    for name in names:
+        old_path = join(old_dirname, '{}.json'.format(name))
+        new_path = join(new_dirname, '{}.json'.format(name))
+
+        with open(old_path, 'rb') as old_file, open(new_path, 'rb') as new_file:
+            for op, key, offset in merge(snapshot(old_path, name), snapshot(new_path, name)):
+                yield {
+                    'op': op,
+                    'type': name,
+                    'key': json.loads(key),
+                    'record': read_record(old_file if op == 'removed' else new_file, offset),
+                }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print changes between two output directories.')
+    parser.add_argument('old_dirname', help='previous output directory')
+    parser.add_argument('new_dirname', help='latest output directory')
+    parser.add_argument('--type', choices=FILES, action='append', help='only diff this output file (can be repeated)')
+    args = parser.parse_args()
+
+    counts = Counter()
+    for change in diff(args.old_dirname, args.new_dirname, args.type or FILES):
+        counts[(change['type'], change['op'])] += 1
+        print(json.dumps(change, ensure_ascii=False))
+
+    for (name, op), count in sorted(counts.items()):
+        print('{} {}: {}'.format(name, op, count), file=sys.stderr)
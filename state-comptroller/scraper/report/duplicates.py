@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""Near-duplicate detection for topics and defects using MinHash and LSH.
+
+Many topics recur across the yearly reports and the followup reports,
+with light edits. Comparing every pair of topics is quadratic,
+so instead we:
+
+    1. shingle each text: word 3-grams for topics (title + body),
+       character 4-grams for defect titles, which are too short for word shingles
+    2. compute a MinHash signature of each shingle set,
+       whose matching positions estimate the jaccard similarity of two sets
+    3. split signatures into bands, and hash each band into buckets (LSH).
+       only texts sharing a bucket in any band become candidate pairs
+    4. keep candidate pairs whose estimated similarity passes the threshold,
+       and group them into clusters
+
+Clusters are dumped in JSON Lines format, one cluster per line:
+
+    python -m report.duplicates output topics > topic-clusters.json
+    python -m report.duplicates output defects > defect-clusters.json
+"""
+
+import argparse
+import json
+import zlib
+from collections import Counter
+from os.path import join
+
+import numpy as np
+
+from report.text import normalize, words
+
+
+# mersenne prime used for the (a * hash + b) % PRIME permutations.
+# hashes are reduced modulo this prime as well,
+# so a * hash + b always fits in 64 bits without overflowing
+PRIME = (1 << 31) - 1
+
+
+def word_shingles(text, k=3):
+    tokens = words(text)
+    if len(tokens) <= k:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i+k]) for i in range(len(tokens) - k + 1)}
+
+
+def char_shingles(text, k=4):
+    text = ' '.join(words(text))
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i+k] for i in range(len(text) - k + 1)}
+
+
+class MinHasher(object):
+    """Compute MinHash signatures using num_perm random universal hash functions."""
+
+    def __init__(self, num_perm=128, seed=1):
+        random = np.random.RandomState(seed)
+        self.a = random.randint(1, PRIME, size=num_perm, dtype=np.uint64)
+        self.b = random.randint(0, PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingles):
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) % PRIME for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        # every row is a single permutation of all shingle hashes
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % np.uint64(PRIME)
+        return permuted.min(axis=1)
+
+
+def candidate_pairs(signatures, bands):
+    """Return pairs of signature numbers sharing a bucket in at least one band."""
+    if not signatures:
+        return set()
+
+    rows = len(signatures[0]) // bands
+    pairs = set()
+    for band in range(bands):
+        buckets = {}
+        for num, signature in enumerate(signatures):
+            key = signature[band * rows:(band + 1) * rows].tobytes()
+            buckets.setdefault(key, []).append(num)
+
+        for bucket in buckets.values():
+            for i, first in enumerate(bucket):
+                for second in bucket[i+1:]:
+                    pairs.add((first, second))
+    return pairs
+
+
+def clusters(signatures, bands=16, threshold=0.7):
+    """Return lists of signature numbers of near-duplicate texts.
+
+    With 128 permutations and 16 bands of 8 rows, pairs with a similarity
+    above roughly (1/16)**(1/8) = 0.7 are likely to become candidates.
+    """
+    if not signatures:
+        return []
+
+    parents = list(range(len(signatures)))
+
+    def find(num):
+        while parents[num] != num:
+            parents[num] = parents[parents[num]]
+            num = parents[num]
+        return num
+
+    for first, second in candidate_pairs(signatures, bands):
+        similarity = np.mean(signatures[first] == signatures[second])
+        if similarity >= threshold:
+            parents[find(first)] = find(second)
+
+    groups = {}
+    for num in range(len(signatures)):
+        groups.setdefault(find(num), []).append(num)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def load_topics(dirname):
+    """Return topic records and their shingles."""
+    with open(join(dirname, 'prefaces.json'), 'r') as f:
+        dates = {p['id']: p['publish_date'] for p in (json.loads(line) for line in f)}
+
+    records = []
+    shingles = []
+    ordinals = Counter()
+    with open(join(dirname, 'topics.json'), 'r') as f:
+        for line in f:
+            topic = json.loads(line)
+            ordinals[(topic['id'], topic['chapter_num'])] += 1
+
+            topic_shingles = word_shingles(' '.join(t for t in [topic['title'], topic['body']] if t))
+            if not topic_shingles:
+                continue
+
+            records.append({
+                'id': topic['id'],
+                'chapter_num': topic['chapter_num'],
+                'ordinal': ordinals[(topic['id'], topic['chapter_num'])],
+                'publish_date': dates.get(topic['id']),
+                'title': topic['title'],
+            })
+            shingles.append(topic_shingles)
+
+    return records, shingles
+
+
+def load_defects(dirname):
+    """Return unique defect title records, with the reports they appear in, and their shingles."""
+    reports = {}
+    with open(join(dirname, 'prefaces.json'), 'r') as f:
+        for line in f:
+            preface = json.loads(line)
+            for mapping in [preface['offices_to_defects'], preface['keywords_to_defects']]:
+                for defects in mapping.values():
+                    for defect in defects:
+                        report_ids = reports.setdefault(normalize(defect), {'defect': defect, 'ids': []})['ids']
+                        if preface['id'] not in report_ids:
+                            report_ids.append(preface['id'])
+
+    records = [r for r in reports.values() if char_shingles(r['defect'])]
+    return records, [char_shingles(r['defect']) for r in records]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find near-duplicate topics or defects.')
+    parser.add_argument('dirname', help='scraper output directory')
+    parser.add_argument('kind', choices=['topics', 'defects'])
+    parser.add_argument('--num-perm', type=int, default=128)
+    parser.add_argument('--bands', type=int, default=16)
+    parser.add_argument('--threshold', type=float, default=0.7)
+    args = parser.parse_args()
+
+    if args.num_perm % args.bands != 0:
+        parser.error('--num-perm must be divisible by --bands')
+
+    records, shingles = (load_topics if args.kind == 'topics' else load_defects)(args.dirname)
+
+    hasher = MinHasher(args.num_perm)
+    signatures = [hasher.signature(s) for s in shingles]
+
+    for group in clusters(signatures, args.bands, args.threshold):
+        print(json.dumps([records[num] for num in group], ensure_ascii=False))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""Normalized entity tables with interned ids for offices, keywords and defects.
+
+Office, keyword and defect names are repeated as full hebrew strings
+across every preface, chapter and topic.
+Here we assign each distinct name a stable integer id,
+and dump compact id-based relations instead:
+
+    dictionary.json         {"offices": [...], "keywords": [...], "defects": [...]}
+                            a name's id is its index in the list
+    preface_offices.json    {"id": "503", "office_id": 3, "defect_ids": [7, 12]}
+    preface_keywords.json   {"id": "503", "keyword_id": 5, "defect_ids": [7]}
+    chapter_entities.json   {"id": "503", "chapter_num": 1, "office_ids": [...], "keyword_ids": [...]}
+    topic_entities.json     {"id": "503", "chapter_num": 1, "ordinal": 1, "office_id": 3}
+
+Ids are stable across runs: an existing dictionary file is loaded first,
+and new names are appended to it.
+Topics have no id of their own, so we use their (1-based) ordinal
+inside their chapter, in output order.
+
+This module is used by EntitiesPipeline while crawling
+(or once the crawl is closed, if it only added reports to the output directory),
+but can also be executed manually on an existing output directory:
+
+    python -m report.entities output
+"""
+
+import json
+import sys
+from os import makedirs, replace
+from os.path import exists, join
+
+
+def normalize_name(name):
+    """Collapse whitespace so trivial spacing differences share an id."""
+    return ' '.join(name.split())
+
+
+class InternTable(object):
+    """Assign stable, incrementing integer ids to names."""
+
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        """Return id for given name, assigning a new one if it wasn't seen before."""
+        if name is None:
+            return None
+
+        name = normalize_name(name)
+        try:
+            return self.ids[name]
+        except KeyError:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            return self.ids[name]
+
+    def __len__(self):
+        return len(self.names)
+
+
+class EntityWriter(object):
+    """Intern entity names and dump id-based relations into a directory."""
+
+    tables = ['offices', 'keywords', 'defects']
+
+    def __init__(self, dirname):
+        if not exists(dirname):
+            makedirs(dirname)
+
+        self.dirname = dirname
+        self.dictionary_path = join(dirname, 'dictionary.json')
+
+        dictionary = {}
+        if exists(self.dictionary_path):
+            with open(self.dictionary_path, 'r') as f:
+                dictionary = json.load(f)
+        self.offices, self.keywords, self.defects = [InternTable(dictionary.get(table, []))
+                                                     for table in self.tables]
+
+        self.files = {name: open(join(dirname, '{}.json'.format(name)), 'w')
+                      for name in ['preface_offices', 'preface_keywords',
+                                   'chapter_entities', 'topic_entities']}
+
+        # topic ordinal inside its chapter, by (id, chapter_num)
+        self.topic_ordinals = {}
+
+    def dump(self, name, data):
+        self.files[name].write(json.dumps(data) + '\n')
+
+    def write(self, name, data):
+        """Intern names in cleaned output object and dump its relations.
+
+        name is the output file the object belongs to
+        i.e. 'prefaces', 'chapters' or 'topics'.
+        """
+        if name == 'prefaces':
+            for office, defects in data['offices_to_defects'].items():
+                self.dump('preface_offices', {
+                    'id': data['id'],
+                    'office_id': self.offices.intern(office),
+                    'defect_ids': [self.defects.intern(d) for d in defects],
+                })
+            for keyword, defects in data['keywords_to_defects'].items():
+                self.dump('preface_keywords', {
+                    'id': data['id'],
+                    'keyword_id': self.keywords.intern(keyword),
+                    'defect_ids': [self.defects.intern(d) for d in defects],
+                })
+
+        elif name == 'chapters':
+            self.dump('chapter_entities', {
+                'id': data['id'],
+                'chapter_num': data['chapter_num'],
+                'office_ids': [self.offices.intern(o) for o in data['offices']],
+                'keyword_ids': [self.keywords.intern(k) for k in data['keywords']],
+            })
+
+        elif name == 'topics':
+            key = (data['id'], data['chapter_num'])
+            self.topic_ordinals[key] = self.topic_ordinals.get(key, 0) + 1
+
+            self.dump('topic_entities', {
+                'id': data['id'],
+                'chapter_num': data['chapter_num'],
+                'ordinal': self.topic_ordinals[key],
+                'office_id': self.offices.intern(data['office']),
+            })
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+        # write dictionary to a temporary file first,
+        # so a crash never leaves us with a truncated dictionary
+        # and reshuffled ids on the next run
+        tmp_path = self.dictionary_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'offices': self.offices.names,
+                       'keywords': self.keywords.names,
+                       'defects': self.defects.names},
+                      f, ensure_ascii=False)
+        replace(tmp_path, self.dictionary_path)
+
+
+def build(dirname):
+    """Dump entity tables for given JSON Lines output directory.
+
+    Tables are written into an 'entities' directory inside the given directory.
+    """
+    writer = EntityWriter(join(dirname, 'entities'))
+    for name in ['prefaces', 'chapters', 'topics']:
+        with open(join(dirname, '{}.json'.format(name)), 'r') as f:
+            for line in f:
+                writer.write(name, json.loads(line))
+    writer.close()
+
+
+if __name__ == '__main__':
+    build(sys.argv[1])
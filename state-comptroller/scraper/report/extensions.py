@@ -0,0 +1,122 @@
+import json
+import time
+from os import makedirs
+from os.path import dirname, exists
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+
+class StageStatsExtension(object):
+    """Report where crawl time goes.
+
+    Summarizes the per-stage timings recorded by report.stats.timed,
+    items per second of every item type, javascript parse failures
+    and http cache hit rate.
+
+    The summary is written as JSON to STAGE_STATS_PATH when the spider closes,
+    and optionally in prometheus text format to STAGE_STATS_PROMETHEUS_PATH.
+    """
+
+    def __init__(self, stats, path, prometheus_path=None):
+        self.stats = stats
+        self.path = path
+        self.prometheus_path = prometheus_path
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('STAGE_STATS_ENABLED'):
+            raise NotConfigured
+
+        extension = cls(crawler.stats,
+                        crawler.settings.get('STAGE_STATS_PATH', 'output/stats.json'),
+                        crawler.settings.get('STAGE_STATS_PROMETHEUS_PATH'))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.start = time.time()
+
+    def item_scraped(self, item, spider):
+        self.stats.inc_value('items/{}'.format(type(item).__name__), spider=spider)
+
+    def spider_closed(self, spider, reason):
+        report = self.summary(spider, reason, time.time() - self.start)
+
+        for path, data in [(self.path, json.dumps(report, indent=2, sort_keys=True)),
+                           (self.prometheus_path, self.prometheus(report) if self.prometheus_path else None)]:
+            if path is None:
+                continue
+            if dirname(path) and not exists(dirname(path)):
+                makedirs(dirname(path))
+            with open(path, 'w') as f:
+                f.write(data)
+
+    def summary(self, spider, reason, elapsed):
+        stats = self.stats.get_stats(spider)
+
+        stages = {}
+        items = {}
+        for key, value in stats.items():
+            parts = key.split('/')
+            if parts[0] == 'stages' and len(parts) == 3:
+                stages.setdefault(parts[1], {})[parts[2]] = value
+            elif parts[0] == 'items' and len(parts) == 2:
+                items[parts[1]] = {'count': value, 'per_sec': value / elapsed if elapsed else 0.0}
+
+        for stage in stages.values():
+            stage['wall_per_call'] = stage['wall'] / stage['calls'] if stage.get('calls') else 0.0
+
+        hits = stats.get('httpcache/hit', 0)
+        misses = stats.get('httpcache/miss', 0)
+
+        return {
+            'reason': reason,
+            'elapsed': elapsed,
+            'stages': stages,
+            'items': items,
+            'js_parse_failures': stats.get('js_parse/failures', 0),
+            'httpcache': {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else None,
+            },
+        }
+
+    @staticmethod
+    def prometheus(report):
+        """Format summary in prometheus text exposition format."""
+        def label(value):
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lines = []
+
+        def metric(name, help_text, metric_type, samples):
+            lines.append('# HELP open_audit_{} {}'.format(name, help_text))
+            lines.append('# TYPE open_audit_{} {}'.format(name, metric_type))
+            for labels, value in samples:
+                labels = ','.join('{}="{}"'.format(k, label(v)) for (k, v) in labels)
+                lines.append('open_audit_{}{} {}'.format(name, '{' + labels + '}' if labels else '', value))
+
+        stages = sorted(report['stages'].items())
+        metric('stage_calls_total', 'Calls of crawl stage.', 'counter',
+               [([('stage', s)], v.get('calls', 0)) for (s, v) in stages])
+        metric('stage_wall_seconds_total', 'Wall time spent in crawl stage.', 'counter',
+               [([('stage', s)], v.get('wall', 0.0)) for (s, v) in stages])
+        metric('stage_cpu_seconds_total', 'CPU time spent in crawl stage.', 'counter',
+               [([('stage', s)], v.get('cpu', 0.0)) for (s, v) in stages])
+
+        items = sorted(report['items'].items())
+        metric('items_total', 'Scraped items by type.', 'counter',
+               [([('type', t)], v['count']) for (t, v) in items])
+        metric('items_per_second', 'Scraped items per second by type.', 'gauge',
+               [([('type', t)], v['per_sec']) for (t, v) in items])
+
+        metric('js_parse_failures_total', 'Reports whose defect mappings javascript failed parsing.', 'counter',
+               [([], report['js_parse_failures'])])
+        metric('httpcache_hits_total', 'HTTP cache hits.', 'counter', [([], report['httpcache']['hits'])])
+        metric('httpcache_misses_total', 'HTTP cache misses.', 'counter', [([], report['httpcache']['misses'])])
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+"""Shared request frontier for crawling with multiple worker processes.
+
+A full crawl can be split between several scrapy processes,
+on the same machine or on machines sharing a filesystem,
+using a scheduler and dupefilter backed by a single SQLite database (in WAL mode):
+
+    requests        every scheduled request, pickled, along with its priority,
+                    state (pending, claimed, done, failed), claiming worker and attempts
+    fingerprints    fingerprints of all requests seen by any worker
+
+Workers claim the highest priority pending request one at a time,
+so faster workers simply take more reports.
+A request is done once its callback output was fully processed (see FrontierMiddleware),
+and failed once its download failed for good (see FrontierDownloaderMiddleware).
+A request retried or redirected by the downloader is replaced by the new request.
+Requests claimed by a worker which died, or is stuck, for more than
+FRONTIER_CLAIM_TIMEOUT seconds are stolen by other workers,
+up to FRONTIER_MAX_ATTEMPTS times.
+Idle workers keep running as long as other workers still have unfinished requests,
+which may yield more requests.
+
+Only one worker requests the getAll report list (FRONTIER_SEED),
+the rest start with an empty queue and claim the report requests it finds.
+
+Every worker dumps output into its own OUTPUT_DIR,
+and the outputs are merged afterwards, keeping every report once.
+A report is taken from a worker whose catalog (CATALOG_PATH inside its OUTPUT_DIR)
+marks it done, so a partial copy of a worker which died is never preferred.
+The following launches N local worker processes, waits for them and merges their output:
+
+    python -m report.frontier crawl --workers 4
+
+Or run workers manually (e.g. on different machines) and merge:
+
+    scrapy crawl report_spider -s SCHEDULER=report.frontier.FrontierScheduler \\
+        -s DUPEFILTER_CLASS=report.frontier.FrontierDupeFilter \\
+        -s FRONTIER_PATH=/shared/frontier.db -s FRONTIER_SEED=0 -s OUTPUT_DIR=output/workers/1 \\
+        -s CATALOG_PATH=output/workers/1/catalog.db ...
+    python -m report.frontier merge output output/workers/0 output/workers/1 ...
+
+Note the merged output doesn't include columnar, entities, catalog, defect index and cube files.
+Regenerate them from the merged output using their modules (e.g. python -m report.columnar output).
+"""
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from os import makedirs, remove
+from os.path import exists, join
+
+from scrapy import signals
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.utils.misc import load_object
+from scrapy.utils.reqser import request_from_dict, request_to_dict
+from scrapy.utils.request import request_fingerprint
+
+from report.catalog import Catalog
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    priority INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS requests_by_state ON requests (state, priority DESC, id);
+
+CREATE TABLE IF NOT EXISTS fingerprints (
+    fingerprint TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+
+class Frontier(object):
+    """Shared request queue and seen request fingerprints."""
+
+    def __init__(self, path, claim_timeout=600, max_attempts=3):
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+
+        # autocommit, claims use explicit transactions
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def seen(self, fingerprint):
+        """Add fingerprint, and return whether it was seen before."""
+        return self.db.execute('INSERT OR IGNORE INTO fingerprints VALUES (?)', (fingerprint,)).rowcount == 0
+
+    def push(self, data, priority=0):
+        self.db.execute('INSERT INTO requests (priority, data) VALUES (?, ?)',
+                        (priority, pickle.dumps(data, protocol=2)))
+
+    def claim(self, worker):
+        """Claim highest priority pending request, or steal a timed out one.
+
+        Returns (id, data, stolen) or None if there's nothing to claim.
+        """
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            stolen = False
+            row = self.db.execute(
+                "SELECT id, data FROM requests WHERE state = 'pending' AND attempts < ?"
+                ' ORDER BY priority DESC, id LIMIT 1', (self.max_attempts,)).fetchone()
+            if row is None:
+                stolen = True
+                row = self.db.execute(
+                    "SELECT id, data FROM requests WHERE state = 'claimed' AND claimed_at < ? AND attempts < ?"
+                    ' ORDER BY claimed_at LIMIT 1', (time.time() - self.claim_timeout, self.max_attempts)).fetchone()
+
+            if row is not None:
+                self.db.execute("UPDATE requests SET state = 'claimed', worker = ?, claimed_at = ?,"
+                                ' attempts = attempts + 1 WHERE id = ?', (worker, time.time(), row[0]))
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+        if row is None:
+            return None
+        return row[0], pickle.loads(row[1]), stolen
+
+    def done(self, id):
+        self.db.execute("UPDATE requests SET state = 'done' WHERE id = ?", (id,))
+
+    def fail(self, id):
+        """Give up on request, e.g. after its download failed for good."""
+        self.db.execute("UPDATE requests SET state = 'failed' WHERE id = ?", (id,))
+
+    def pending(self):
+        """Return number of requests which can be claimed right now."""
+        return self.db.execute(
+            "SELECT COUNT(*) FROM requests WHERE attempts < ? AND"
+            " (state = 'pending' OR (state = 'claimed' AND claimed_at < ?))",
+            (self.max_attempts, time.time() - self.claim_timeout)).fetchone()[0]
+
+    def unfinished(self):
+        """Return number of requests which are either claimable, or still being processed by a worker."""
+        return self.db.execute(
+            "SELECT COUNT(*) FROM requests WHERE state IN ('pending', 'claimed') AND"
+            " (attempts < ? OR (state = 'claimed' AND claimed_at >= ?))",
+            (self.max_attempts, time.time() - self.claim_timeout)).fetchone()[0]
+
+    def release_claims(self):
+        """Return all claimed requests to the queue, e.g. when resuming after all workers died."""
+        self.db.execute("UPDATE requests SET state = 'pending' WHERE state = 'claimed'")
+
+
+def frontier_from_settings(settings):
+    if not settings.get('FRONTIER_PATH'):
+        raise NotConfigured('FRONTIER_PATH is not set')
+    return Frontier(settings.get('FRONTIER_PATH'),
+                    settings.getfloat('FRONTIER_CLAIM_TIMEOUT', 600),
+                    settings.getint('FRONTIER_MAX_ATTEMPTS', 3))
+
+
+class FrontierDupeFilter(BaseDupeFilter):
+    """Filter requests seen by any of the workers sharing the frontier."""
+
+    def __init__(self, frontier, debug=False):
+        self.frontier = frontier
+        self.debug = debug
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(frontier_from_settings(settings), settings.getbool('DUPEFILTER_DEBUG'))
+
+    def request_seen(self, request):
+        return self.frontier.seen(request_fingerprint(request))
+
+    def close(self, reason):
+        self.frontier.close()
+
+    def log(self, request, spider):
+        if self.debug:
+            logger.debug('Filtered duplicate request: %(request)s', {'request': request}, extra={'spider': spider})
+        spider.crawler.stats.inc_value('dupefilter/filtered', spider=spider)
+
+
+class FrontierScheduler(object):
+    """Scheduler claiming requests from the shared frontier."""
+
+    def __init__(self, crawler, frontier, dupefilter, worker):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.frontier = frontier
+        self.df = dupefilter
+        self.worker = worker
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        worker = settings.get('FRONTIER_WORKER') or '{}:{}'.format(socket.gethostname(), os.getpid())
+        scheduler = cls(crawler,
+                        frontier_from_settings(settings),
+                        load_object(settings['DUPEFILTER_CLASS']).from_settings(settings),
+                        worker)
+        crawler.signals.connect(scheduler.spider_idle, signal=signals.spider_idle)
+        return scheduler
+
+    def open(self, spider):
+        self.spider = spider
+        return self.df.open()
+
+    def close(self, reason):
+        self.frontier.close()
+        return self.df.close(reason)
+
+    def has_pending_requests(self):
+        return self.frontier.pending() > 0
+
+    def __len__(self):
+        return self.frontier.pending()
+
+    def enqueue_request(self, request):
+        # a claimed request which the downloader retries or redirects
+        # is replaced by the new request, which copied its meta
+        replaced = request.meta.pop('frontier_id', None)
+
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            enqueued = False
+        else:
+            self.frontier.push(request_to_dict(request, self.spider), request.priority)
+            self.stats.inc_value('frontier/enqueued', spider=self.spider)
+            enqueued = True
+
+        if replaced is not None:
+            self.frontier.done(replaced)
+        return enqueued
+
+    def next_request(self):
+        claimed = self.frontier.claim(self.worker)
+        if claimed is None:
+            return None
+
+        id, data, stolen = claimed
+        self.stats.inc_value('frontier/claimed', spider=self.spider)
+        if stolen:
+            self.stats.inc_value('frontier/stolen', spider=self.spider)
+
+        request = request_from_dict(data, self.spider)
+        request.meta['frontier_id'] = id
+        return request
+
+    def spider_idle(self, spider):
+        """Keep idle worker running while other workers may still yield requests."""
+        if self.frontier.unfinished() > 0:
+            raise DontCloseSpider
+
+
+class FrontierMiddleware(object):
+    """Mark frontier requests done once their callback output was fully processed.
+
+    Marking requests done only when their responses are received
+    would let idle workers exit while a response is still yielding requests.
+    """
+
+    def __init__(self, frontier):
+        self.frontier = frontier
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(frontier_from_settings(crawler.settings))
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_closed(self, spider):
+        self.frontier.close()
+
+    def process_spider_output(self, response, result, spider):
+        for x in result:
+            yield x
+        self.done(response)
+
+    def process_spider_exception(self, response, exception, spider):
+        # retrying a failing callback wouldn't help
+        self.done(response)
+
+    def done(self, response):
+        id = response.meta.get('frontier_id')
+        if id is not None:
+            self.frontier.done(id)
+
+
+class FrontierDownloaderMiddleware(object):
+    """Mark frontier requests failed once their download failed for good.
+
+    Download errors (e.g. DNS errors, timeouts, or retries running out)
+    never reach the spider middleware, so without this failed requests
+    would stay claimed until they time out.
+    """
+
+    def __init__(self, frontier, stats):
+        self.frontier = frontier
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(frontier_from_settings(crawler.settings), crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_closed(self, spider):
+        self.frontier.close()
+
+    def process_exception(self, request, exception, spider):
+        id = request.meta.get('frontier_id')
+        if id is not None:
+            self.frontier.fail(id)
+            self.stats.inc_value('frontier/failed', spider=spider)
+
+
+def merge(dirname, worker_dirnames):
+    """Merge worker output directories into dirname, keeping every report once.
+
+    Reports can be dumped by two workers, if a slow worker's request was stolen.
+    A report belongs to the first worker whose catalog marks it done,
+    or if none does, to the first worker which dumped its preface.
+    """
+    if not exists(dirname):
+        makedirs(dirname)
+
+    owners = {}
+    for worker, worker_dirname in enumerate(worker_dirnames):
+        if exists(join(worker_dirname, 'catalog.db')):
+            catalog = Catalog(join(worker_dirname, 'catalog.db'))
+            for id in catalog.done_reports():
+                owners.setdefault(id, worker)
+            catalog.close()
+
+    for worker, worker_dirname in enumerate(worker_dirnames):
+        with open(join(worker_dirname, 'prefaces.json'), 'rb') as f:
+            for line in f:
+                owners.setdefault(json.loads(line.decode('utf-8'))['id'], worker)
+
+    counts = {}
+    for name in ['prefaces', 'chapters', 'topics']:
+        counts[name] = 0
+        with open(join(dirname, '{}.json'.format(name)), 'wb') as output:
+            for worker, worker_dirname in enumerate(worker_dirnames):
+                with open(join(worker_dirname, '{}.json'.format(name)), 'rb') as f:
+                    for line in f:
+                        # reports without a preface (e.g. quarantined) belong to the first worker dumping them
+                        if owners.setdefault(json.loads(line.decode('utf-8'))['id'], worker) == worker:
+                            output.write(line)
+                            counts[name] += 1
+    return counts
+
+
+def crawl(workers, dirname, frontier_path, claim_timeout, resume):
+    """Run local worker processes sharing frontier, and return their output directories."""
+    if not resume:
+        for path in [frontier_path, frontier_path + '-wal', frontier_path + '-shm']:
+            if exists(path):
+                remove(path)
+
+    frontier = Frontier(frontier_path, claim_timeout)
+    if resume:
+        frontier.release_claims()
+
+    worker_dirnames = [join(dirname, 'workers', str(num)) for num in range(workers)]
+    processes = []
+    for num, worker_dirname in enumerate(worker_dirnames):
+        command = [
+            sys.executable, '-m', 'scrapy', 'crawl', 'report_spider',
+            '-s', 'SCHEDULER=report.frontier.FrontierScheduler',
+            '-s', 'DUPEFILTER_CLASS=report.frontier.FrontierDupeFilter',
+            '-s', 'FRONTIER_PATH={}'.format(frontier_path),
+            '-s', 'FRONTIER_WORKER=worker-{}'.format(num),
+            '-s', 'FRONTIER_CLAIM_TIMEOUT={}'.format(claim_timeout),
+            '-s', 'FRONTIER_SEED={}'.format(int(num == 0 and not resume)),
+            '-s', 'OUTPUT_DIR={}'.format(worker_dirname),
+            '-s', 'CATALOG_PATH={}'.format(join(worker_dirname, 'catalog.db')),
+            '-s', 'DEFECT_INDEX_PATH={}'.format(join(worker_dirname, 'defects.db')),
+            '-s', 'CUBE_PATH={}'.format(join(worker_dirname, 'cube.db')),
+            '-s', 'STAGE_STATS_PATH={}'.format(join(worker_dirname, 'stats.json')),
+        ]
+        processes.append(subprocess.Popen(command))
+
+        # make sure the seeding worker's first request is queued,
+        # so other workers don't find an empty frontier and exit immediately
+        while num == 0 and not resume and frontier.unfinished() == 0:
+            if processes[0].poll() is not None:
+                raise RuntimeError('seeding worker exited with code {}'.format(processes[0].returncode))
+            time.sleep(0.5)
+
+    codes = [process.wait() for process in processes]
+    frontier.close()
+    if any(codes):
+        raise RuntimeError('workers exited with codes {}'.format(codes))
+    return worker_dirnames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawl using multiple local workers, or merge worker output.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    crawl_parser = subparsers.add_parser('crawl', help='run local workers sharing a frontier, and merge their output')
+    crawl_parser.add_argument('--workers', type=int, default=4)
+    crawl_parser.add_argument('--output', default='output', help='merged output directory')
+    crawl_parser.add_argument('--frontier', help='frontier database (default: <output>/frontier.db)')
+    crawl_parser.add_argument('--claim-timeout', type=float, default=600)
+    crawl_parser.add_argument('--resume', action='store_true', help='continue with existing frontier')
+
+    merge_parser = subparsers.add_parser('merge', help='merge worker output directories')
+    merge_parser.add_argument('dirname', help='merged output directory')
+    merge_parser.add_argument('worker_dirnames', nargs='+')
+
+    args = parser.parse_args()
+
+    if args.command == 'crawl':
+        if not exists(args.output):
+            makedirs(args.output)
+        WORKER_DIRNAMES = crawl(args.workers, args.output, args.frontier or join(args.output, 'frontier.db'),
+                                args.claim_timeout, args.resume)
+        COUNTS = merge(args.output, WORKER_DIRNAMES)
+    else:
+        COUNTS = merge(args.dirname, args.worker_dirnames)
+
+    print(', '.join('{}: {}'.format(name, count) for (name, count) in sorted(COUNTS.items())))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""Sparse incidence matrices of offices, keywords, defects and reports.
+
+Prefaces map offices and keywords to defects, which is a bipartite graph
+dumped by report.entities as interned id-based relations.
+Here these relations are turned into sparse matrices, whose axes are
+the entity dictionary ids, and report numbers:
+
+    office_defect       offices x defects   reports an office is mapped to a defect in
+    keyword_defect      keywords x defects  reports a keyword is mapped to a defect in
+    defect_report       defects x reports   1 if defect appears in report
+    office_report       offices x reports   1 if office is audited in report
+    keyword_report      keywords x reports  1 if keyword appears in report
+
+so analytics are matrix products instead of loops over prefaces.json, e.g.
+
+    office x keyword co-occurrence      office_report * keyword_report.T
+    audited offices per year            office_report * report_year
+
+Matrices are dumped into the entities directory, along with the report axis:
+
+    entities/incidence/{name}.npz   scipy.sparse.save_npz format
+    entities/incidence/reports.json {"ids": [...], "publish_dates": [...]}
+
+The entities directory must be built first (by EntitiesPipeline, or report.entities):
+
+    python -m report.incidence build output
+    python -m report.incidence top-offices output --year 2016
+    python -m report.incidence cooccurrence output "משרד הבריאות"
+"""
+
+import argparse
+import json
+from os import makedirs
+from os.path import exists, join
+
+import numpy as np
+import scipy.sparse as sp
+
+from report.entities import InternTable, normalize_name
+
+
+MATRICES = ['office_defect', 'keyword_defect', 'defect_report', 'office_report', 'keyword_report']
+
+
+def incidence_matrix(rows, columns, shape):
+    """Return csr matrix counting every (row, column) pair."""
+    data = np.ones(len(rows), dtype=np.int32)
+    return sp.coo_matrix((data, (rows, columns)), shape=shape).tocsr()
+
+
+def build(dirname):
+    """Build incidence matrices of output directory, from its entity tables."""
+    entities_dirname = join(dirname, 'entities')
+    with open(join(entities_dirname, 'dictionary.json'), 'r') as f:
+        dictionary = json.load(f)
+
+    reports = InternTable()
+    publish_dates = []
+    with open(join(dirname, 'prefaces.json'), 'r') as f:
+        for line in f:
+            preface = json.loads(line)
+            if reports.intern(preface['id']) == len(publish_dates):
+                publish_dates.append(preface['publish_date'])
+
+    shapes = {
+        'office': len(dictionary['offices']),
+        'keyword': len(dictionary['keywords']),
+        'defect': len(dictionary['defects']),
+        'report': len(reports),
+    }
+
+    pairs = {name: ([], []) for name in MATRICES}
+    seen = set()
+
+    def add(name, row, column, report):
+        # names differing only by whitespace share an id,
+        # so a report can relate the same pair more than once
+        if (name, row, column, report) in seen:
+            return
+        seen.add((name, row, column, report))
+        pairs[name][0].append(row)
+        pairs[name][1].append(column)
+
+    for entity in ['office', 'keyword']:
+        with open(join(entities_dirname, 'preface_{}s.json'.format(entity)), 'r') as f:
+            for line in f:
+                relation = json.loads(line)
+                report = reports.ids.get(relation['id'])
+                if report is None:
+                    continue
+
+                add('{}_report'.format(entity), relation['{}_id'.format(entity)], report, report)
+                for defect in relation['defect_ids']:
+                    add('{}_defect'.format(entity), relation['{}_id'.format(entity)], defect, report)
+                    add('defect_report', defect, report, report)
+
+    incidence_dirname = join(entities_dirname, 'incidence')
+    if not exists(incidence_dirname):
+        makedirs(incidence_dirname)
+
+    for name in MATRICES:
+        rows, columns = name.split('_')
+        matrix = incidence_matrix(pairs[name][0], pairs[name][1], (shapes[rows], shapes[columns]))
+        sp.save_npz(join(incidence_dirname, '{}.npz'.format(name)), matrix)
+
+    with open(join(incidence_dirname, 'reports.json'), 'w') as f:
+        json.dump({'ids': reports.names, 'publish_dates': publish_dates}, f)
+
+
+class Incidence(object):
+    """Incidence matrices and their axes, with common analytics."""
+
+    def __init__(self, dirname):
+        entities_dirname = join(dirname, 'entities')
+        with open(join(entities_dirname, 'dictionary.json'), 'r') as f:
+            dictionary = json.load(f)
+        self.offices, self.keywords, self.defects = [InternTable(dictionary[table])
+                                                     for table in ['offices', 'keywords', 'defects']]
+
+        incidence_dirname = join(entities_dirname, 'incidence')
+        with open(join(incidence_dirname, 'reports.json'), 'r') as f:
+            reports = json.load(f)
+        self.reports = InternTable(reports['ids'])
+        self.publish_dates = reports['publish_dates']
+
+        for name in MATRICES:
+            matrix = sp.load_npz(join(incidence_dirname, '{}.npz'.format(name))).tocsr()
+            # ids interned after the matrices were built aren't in any report
+            rows, columns = name.split('_')
+            shape = (len(getattr(self, rows + 's')), len(getattr(self, columns + 's')))
+            matrix.resize(shape)
+            setattr(self, name, matrix)
+
+    def report_year(self):
+        """Return (years, reports x years indicator matrix)."""
+        report_years = np.array([int(date[:4]) if date else 0 for date in self.publish_dates])
+        years, columns = np.unique(report_years, return_inverse=True)
+        return years, incidence_matrix(np.arange(len(report_years)), columns, (len(report_years), len(years)))
+
+    def offices_per_year(self):
+        """Return (years, offices x years matrix of number of reports auditing an office)."""
+        years, report_year = self.report_year()
+        return years, self.office_report.dot(report_year).tocsc()
+
+    def top_offices(self, year, count=20):
+        """Return (office, reports) of the most audited offices in year."""
+        years, matrix = self.offices_per_year()
+        column = np.searchsorted(years, year)
+        if column == len(years) or years[column] != year:
+            return []
+        counts = matrix[:, column].toarray().ravel()
+        top = np.argsort(-counts, kind='stable')[:count]
+        return [(self.offices.names[office], int(counts[office])) for office in top if counts[office] > 0]
+
+    def office_keyword(self):
+        """Return offices x keywords matrix of number of reports both appear in."""
+        return self.office_report.dot(self.keyword_report.T).tocsr()
+
+    def cooccurring_keywords(self, office, count=20):
+        """Return (keyword, reports) of keywords most often appearing along with office."""
+        office_id = self.offices.ids.get(normalize_name(office))
+        if office_id is None:
+            return []
+        row = self.office_keyword().getrow(office_id)
+        top = np.argsort(-row.data, kind='stable')[:count]
+        return [(self.keywords.names[row.indices[i]], int(row.data[i])) for i in top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query office, keyword, defect and report incidence matrices.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    build_parser = subparsers.add_parser('build', help='build incidence matrices of output directory')
+    build_parser.add_argument('dirname', help='scraper output directory')
+
+    top_parser = subparsers.add_parser('top-offices', help='print most audited offices in a year')
+    top_parser.add_argument('dirname', help='scraper output directory')
+    top_parser.add_argument('--year', type=int, required=True)
+    top_parser.add_argument('--count', type=int, default=20)
+
+    cooccurrence_parser = subparsers.add_parser('cooccurrence', help='print keywords most often appearing with office')
+    cooccurrence_parser.add_argument('dirname', help='scraper output directory')
+    cooccurrence_parser.add_argument('office')
+    cooccurrence_parser.add_argument('--count', type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.dirname)
+    elif args.command == 'top-offices':
+        for office, reports in Incidence(args.dirname).top_offices(args.year, args.count):
+            print(json.dumps({'office': office, 'reports': reports}, ensure_ascii=False))
+    else:
+        for keyword, reports in Incidence(args.dirname).cooccurring_keywords(args.office, args.count):
+            print(json.dumps({'keyword': keyword, 'reports': reports}, ensure_ascii=False))
@@ -70,3 +70,30 @@ class ReportTopic(scrapy.Item):
     doc_urls = scrapy.Field()
     office = scrapy.Field()
     body = scrapy.Field()
+
+
+class ReportListing(scrapy.Item):
+    """Row of the getAll report list.
+
+    Listed before the report itself is scraped,
+    and used to keep the report catalog (see report.catalog).
+    """
+
+    id = scrapy.Field()
+    source_url = scrapy.Field()
+
+    title = scrapy.Field()
+    cells = scrapy.Field()  # text of every table cell in row
+    publish_date = scrapy.Field()  # YYYY-MM-DD, if any of the cells is a date
+
+
+class ReportDone(scrapy.Item):
+    """Marks the end of a report's items.
+
+    Resumable crawls only write a report to their output segment
+    once all of its items were processed (see report.checkpoint).
+    ValidationPipeline sets the number of the report's items it dropped.
+    """
+
+    id = scrapy.Field()
+    invalid_items = scrapy.Field()
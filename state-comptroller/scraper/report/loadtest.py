@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Load test for the read API (see report.api).
+
+Opens concurrent keep-alive connections, each requesting random records
+of the output directory (prefaces, chapters, topics of a chapter, report listing pages)
+for a given duration, and prints throughput and latency percentiles.
+
+    python -m report.api output --port 8080 &
+    python -m report.loadtest output --url http://127.0.0.1:8080 --connections 64 --duration 10
+
+With --conditional, requests send the ETag of the previous response of the same path,
+so most of them are answered with 304 Not Modified.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from urllib.parse import quote, urlsplit
+
+from report.reader import OutputReader
+
+
+def request_paths(dirname):
+    """Return request paths of all records in output directory."""
+    paths = ['/reports', '/reports?offset=100', '/offices', '/keywords']
+    with OutputReader(dirname) as reader:
+        for id in reader.reports():
+            paths += ['/reports/{}'.format(quote(id)), '/reports/{}/chapters'.format(quote(id))]
+            for chapter in reader.chapters(id):
+                paths += ['/reports/{}/chapters/{}'.format(quote(id), chapter['chapter_num']),
+                          '/reports/{}/chapters/{}/topics'.format(quote(id), chapter['chapter_num'])]
+    return paths
+
+
+async def read_response(reader):
+    """Read response and return (status, headers). The body is read and discarded."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    return status, headers
+
+
+async def client(host, port, paths, deadline, results, use_gzip, conditional):
+    reader, writer = await asyncio.open_connection(host, port)
+    etags = {}
+    try:
+        while time.time() < deadline:
+            path = random.choice(paths)
+            request = 'GET {} HTTP/1.1\r\nHost: {}\r\n'.format(path, host)
+            if use_gzip:
+                request += 'Accept-Encoding: gzip\r\n'
+            if conditional and path in etags:
+                request += 'If-None-Match: {}\r\n'.format(etags[path])
+            request += '\r\n'
+
+            start = time.time()
+            writer.write(request.encode('latin-1'))
+            status, headers = await read_response(reader)
+            results['latencies'].append(time.time() - start)
+            results['statuses'][status] += 1
+            if 'etag' in headers:
+                etags[path] = headers['etag']
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(url, paths, connections=64, duration=10, use_gzip=False, conditional=False):
+    """Run load test, and return (requests per second, sorted latencies, status counts)."""
+    url = urlsplit(url)
+    results = {'latencies': [], 'statuses': Counter()}
+    deadline = time.time() + duration
+
+    loop = asyncio.get_event_loop()
+    start = time.time()
+    loop.run_until_complete(asyncio.gather(*[
+        client(url.hostname, url.port or 80, paths, deadline, results, use_gzip, conditional)
+        for _ in range(connections)
+    ]))
+    elapsed = time.time() - start
+    return len(results['latencies']) / elapsed, sorted(results['latencies']), results['statuses']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the read API.')
+    parser.add_argument('dirname', help='scraper output directory served by the API')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--gzip', action='store_true', help='accept gzip responses')
+    parser.add_argument('--conditional', action='store_true', help='send If-None-Match of previous responses')
+    args = parser.parse_args()
+
+    rps, latencies, statuses = run(args.url, request_paths(args.dirname), args.connections, args.duration,
+                                   args.gzip, args.conditional)
+
+    print('{} requests, {:.0f} requests/sec'.format(len(latencies), rps))
+    print('latency p50 {:.1f}ms, p90 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms'.format(
+        *[1000 * percentile(latencies, f) for f in [0.5, 0.9, 0.99, 1]]))
+    print('statuses: {}'.format(', '.join('{} x {}'.format(s, c) for (s, c) in sorted(statuses.items()))))
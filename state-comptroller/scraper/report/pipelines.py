@@ -1,20 +1,45 @@
+from collections import Counter
 from datetime import datetime
 from html.parser import HTMLParser
+import json
 from os import makedirs
-from os.path import basename, splitext, exists
+from os.path import basename, splitext, exists, join
 from urllib.parse import urlparse, urlsplit
 
+from scrapy import signals
 from scrapy.exporters import JsonLinesItemExporter
-from scrapy.exceptions import NotSupported
-
+from scrapy.exceptions import DropItem, NotSupported
+from scrapy.utils.serialize import ScrapyJSONEncoder
+
+from report import columnar, entities
+from report.catalog import Catalog
+from report.checkpoint import SegmentWriter, drop_previous_copies, output_sizes, segments_dirname
+from report.columnar import ColumnarWriter
+from report.cube import Cube, report_facts
+from report.defects import DefectIndex
+from report.entities import EntityWriter
 from report.items import (
     ReportPreface,
     ReportChapter,
     ReportTopic,
+    ReportListing,
+    ReportDone,
 )
+from report.stats import timed
+from report.validation import ITEM_SCHEMAS, compile_schema
 
 
 class ReportPipeline(object):
+    # set when crawling with JOBDIR, see report.checkpoint
+    segments = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls()
+        pipeline.crawler = crawler
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
     def open_spider(self, spider):
         """Dumps scraped output.
 
@@ -32,14 +57,29 @@ class ReportPipeline(object):
         self.html_parser = HTMLParser()
 
         # dump into a designate dir
-        dirname = 'output'
+        dirname = self.crawler.settings.get('OUTPUT_DIR', 'output')
         if not exists(dirname):
             makedirs(dirname)
 
+        # resumable crawls write checkpointed segments,
+        # which are only concatenated into the output files once the crawl finishes
+        segments = segments_dirname(self.crawler.settings)
+        if segments is not None:
+            self.segments = SegmentWriter(segments, self.crawler.settings.getfloat('CHECKPOINT_INTERVAL', 60))
+            self.encoder = ScrapyJSONEncoder(ensure_ascii=False)
+            self.files = {}
+            self.exporters = {}
+            return
+
+        mode = 'ab' if self.appends_output() else 'wb'
+        # previous copies of reports scraped again are removed once the crawl closes
+        self.previous_sizes = output_sizes(dirname)
+        self.exported = set()
+
         self.files = {
-            'prefaces': open('{}/prefaces.json'.format(dirname), 'wb'),
-            'chapters': open('{}/chapters.json'.format(dirname), 'wb'),
-            'topics': open('{}/topics.json'.format(dirname), 'wb'),
+            'prefaces': open('{}/prefaces.json'.format(dirname), mode),
+            'chapters': open('{}/chapters.json'.format(dirname), mode),
+            'topics': open('{}/topics.json'.format(dirname), mode),
         }
 
         # use JSON Lines format i.e. each line is a json object,
@@ -49,22 +89,84 @@ class ReportPipeline(object):
         for exporter in self.exporters.values():
             exporter.start_exporting()
 
+    def appends_output(self):
+        """Return whether the crawl adds reports to the previous output, instead of replacing it.
+
+        Incremental crawls only scrape reports missing from the catalog (see CATALOG_SKIP_KNOWN).
+        """
+        return self.crawler.settings.getbool('CATALOG_SKIP_KNOWN')
+
+    def converts_output(self):
+        """Return whether pipelines dumping other formats should convert the whole output once the crawl closed,
+        instead of dumping scraped items.
+
+        That's the case if the crawl adds reports to the previous output,
+        or writes output segments which are only concatenated once it finished.
+        """
+        return self.appends_output() or segments_dirname(self.crawler.settings) is not None
+
+    def output_finished(self, reason):
+        """Return whether output files are complete, once the spider closed for reason."""
+        return segments_dirname(self.crawler.settings) is None or reason == 'finished'
+
     def close_spider(self, spider):
+        if self.segments is not None:
+            self.segments.close()
+
         for e in self.exporters.values():
             e.finish_exporting()
 
         for f in self.files.values():
             f.close()
 
+        if self.segments is None and self.appends_output():
+            drop_previous_copies(self.crawler.settings.get('OUTPUT_DIR', 'output'), self.previous_sizes, self.exported)
+
+    def spider_closed(self, spider, reason):
+        """Concatenate segments into output files, once a resumable crawl finished.
+
+        Segments are kept if the crawl was stopped, so it can be resumed.
+        """
+        if self.segments is not None and reason == 'finished':
+            dirname = self.crawler.settings.get('OUTPUT_DIR', 'output')
+            sizes = output_sizes(dirname)
+            self.segments.finish(dirname, append=self.appends_output())
+            if self.appends_output():
+                drop_previous_copies(dirname, sizes, self.segments.done)
+
+    def export(self, name, data):
+        """Write cleaned item data to the matching output file.
+
+        name is one of 'prefaces', 'chapters', 'topics'.
+        Subclasses override this to dump the same cleaned data in other formats.
+        """
+        if self.segments is not None:
+            line = self.encoder.encode(data) + '\n'
+            self.segments.write(name, data['id'], line.encode('utf-8'))
+        else:
+            self.exporters[name].export_item(data)
+            self.exported.add(data['id'])
+
     def process_item(self, item, spider):
         """Dump item to file according to its type."""
+        if isinstance(item, ReportDone):
+            if self.segments is not None:
+                self.segments.report_done(item['id'])
+            return item
+
+        if (self.segments is not None and isinstance(item, (ReportPreface, ReportChapter, ReportTopic))
+                and item['id'] in self.segments.done):
+            raise DropItem('report {} was already exported'.format(item['id']))
+
         if isinstance(item, ReportPreface):
             return self.process_preface(item)
         elif isinstance(item, ReportChapter):
             return self.process_chapter(item)
         elif isinstance(item, ReportTopic):
             return self.process_topic(item)
+        return item
 
+    @timed
     def process_preface(self, item):
         """Dump preface to file."""
         # set specific fields value as None
@@ -129,9 +231,10 @@ class ReportPipeline(object):
                      or None),
         }
 
-        self.exporters['prefaces'].export_item(data)
+        self.export('prefaces', data)
         return item
 
+    @timed
     def process_chapter(self, item):
         """Dump chapter to file."""
         data = {
@@ -144,9 +247,10 @@ class ReportPipeline(object):
             'keywords': [self.html_parser.unescape(keyword.strip()) for keyword in item['keywords']],
         }
 
-        self.exporters['chapters'].export_item(data)
+        self.export('chapters', data)
         return item
 
+    @timed
     def process_topic(self, item):
         """Dump topic to file."""
         def prepend_domain(endpoint):
@@ -193,5 +297,228 @@ class ReportPipeline(object):
             ),
         }
 
-        self.exporters['topics'].export_item(data)
+        self.export('topics', data)
         return item
+
+
+class ColumnarExportPipeline(ReportPipeline):
+    """Dump scraped output into columnar Parquet tables.
+
+    Runs alongside ReportPipeline and cleans items the same way,
+    but flattens the prefaces' offices/keywords-to-defects mappings
+    into separate tables. See report.columnar for the table layout.
+
+    Parquet files can't be appended to, so if the crawl adds reports
+    to the previous output, or is resumable (see report.checkpoint),
+    the tables are converted from the whole output once the crawl finished instead.
+    """
+
+    def open_spider(self, spider):
+        self.html_parser = HTMLParser()
+        self.writer = None
+        if not self.converts_output():
+            self.writer = ColumnarWriter(join(self.crawler.settings.get('OUTPUT_DIR', 'output'), 'columnar'))
+
+    def close_spider(self, spider):
+        if self.writer is not None:
+            self.writer.close()
+
+    def spider_closed(self, spider, reason):
+        # ReportPipeline's output files are closed (and segments concatenated) by now
+        if self.writer is None and self.output_finished(reason):
+            columnar.convert(self.crawler.settings.get('OUTPUT_DIR', 'output'))
+
+    def process_item(self, item, spider):
+        if self.writer is None:
+            return item
+        return super().process_item(item, spider)
+
+    def export(self, name, data):
+        self.writer.write(name, data)
+
+
+class EntitiesPipeline(ReportPipeline):
+    """Dump scraped output as interned entity ids and id-based relations.
+
+    See report.entities for the table layout.
+    If the crawl adds reports to the previous output, or is resumable (see report.checkpoint),
+    the relations are dumped from the whole output once the crawl finished instead.
+    """
+
+    def open_spider(self, spider):
+        self.html_parser = HTMLParser()
+        self.writer = None
+        if not self.converts_output():
+            self.writer = EntityWriter(join(self.crawler.settings.get('OUTPUT_DIR', 'output'), 'entities'))
+
+    def close_spider(self, spider):
+        if self.writer is not None:
+            self.writer.close()
+
+    def spider_closed(self, spider, reason):
+        # ReportPipeline's output files are closed (and segments concatenated) by now
+        if self.writer is None and self.output_finished(reason):
+            entities.build(self.crawler.settings.get('OUTPUT_DIR', 'output'))
+
+    def process_item(self, item, spider):
+        if self.writer is None:
+            return item
+        return super().process_item(item, spider)
+
+    def export(self, name, data):
+        self.writer.write(name, data)
+
+
+class CatalogPipeline(ReportPipeline):
+    """Update report catalog with scraped preface metadata and chapter/topic counts.
+
+    Rows of the report list (ReportListing items) are added to the catalog as well.
+    See report.catalog for the catalog layout.
+    """
+
+    def open_spider(self, spider):
+        self.html_parser = HTMLParser()
+        self.catalog = Catalog(self.crawler.settings.get('CATALOG_PATH', 'output/catalog.db'))
+
+    def close_spider(self, spider):
+        self.catalog.close()
+
+    def process_item(self, item, spider):
+        if isinstance(item, ReportListing):
+            self.catalog.add_listing(item)
+            return item
+        if isinstance(item, ReportDone):
+            # a report with invalid items is scraped again by the next incremental crawl
+            if not item.get('invalid_items'):
+                self.catalog.report_done(item['id'])
+                self.catalog.commit()
+            return item
+        return super().process_item(item, spider)
+
+    def export(self, name, data):
+        if name == 'prefaces':
+            # a report's preface is scraped before its chapters and topics,
+            # so this commits the previous report's counts as well
+            self.catalog.add_preface(data)
+            self.catalog.commit()
+        elif name == 'chapters':
+            self.catalog.add_counts(data['id'], chapters=1)
+        elif name == 'topics':
+            self.catalog.add_counts(data['id'], topics=1)
+
+
+class DefectIndexPipeline(ReportPipeline):
+    """Index defects of scraped prefaces, see report.defects."""
+
+    def open_spider(self, spider):
+        self.html_parser = HTMLParser()
+        self.index = DefectIndex(self.crawler.settings.get('DEFECT_INDEX_PATH', 'output/defects.db'))
+
+    def close_spider(self, spider):
+        self.index.close()
+
+    def export(self, name, data):
+        if name == 'prefaces':
+            self.index.add_preface(data)
+            self.index.commit()
+
+
+class CubePipeline(ReportPipeline):
+    """Count every scraped report in the aggregate cube, see report.cube.
+
+    A report is only counted once all of its items were scraped (see ReportDone),
+    and cells are updated in batches of reports.
+    """
+
+    commit_every = 50
+
+    def open_spider(self, spider):
+        self.html_parser = HTMLParser()
+        self.cube = Cube(self.crawler.settings.get('CUBE_PATH', 'output/cube.db'))
+        self.reports = {}  # report id --> cleaned prefaces, chapters, topics
+        self.counted = 0
+
+    def close_spider(self, spider):
+        # reports whose ReportDone never arrived are incomplete, so they aren't counted
+        self.reports = {}
+        self.cube.close()
+
+    def process_item(self, item, spider):
+        if isinstance(item, ReportDone):
+            self.count_report(item['id'])
+            return item
+        return super().process_item(item, spider)
+
+    def export(self, name, data):
+        self.reports.setdefault(data['id'], {'prefaces': [], 'chapters': [], 'topics': []})[name].append(data)
+
+    def count_report(self, id):
+        items = self.reports.pop(id, None)
+        if items is None or not items['prefaces']:
+            return
+
+        self.cube.add_report(id, report_facts(items['prefaces'][0], items['chapters'], items['topics']))
+        self.counted += 1
+        if self.counted % self.commit_every == 0:
+            self.cube.commit()
+
+
+class ValidationPipeline(object):
+    """Validate scraped items before they are cleaned and dumped.
+
+    Invalid items are dumped to a quarantine file along with their errors,
+    and dropped, so they never crash or get silently lost in later pipelines.
+    See report.validation for the schemas.
+    """
+
+    item_types = [
+        (ReportPreface, 'prefaces'),
+        (ReportChapter, 'chapters'),
+        (ReportTopic, 'topics'),
+    ]
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.validators = {name: compile_schema(schema) for (name, schema) in ITEM_SCHEMAS.items()}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def open_spider(self, spider):
+        dirname = self.crawler.settings.get('OUTPUT_DIR', 'output')
+        if not exists(dirname):
+            makedirs(dirname)
+        # incremental and resumable crawls keep the output of previous runs,
+        # so keep the invalid items of these runs as well
+        settings = self.crawler.settings
+        append = settings.getbool('CATALOG_SKIP_KNOWN') or segments_dirname(settings) is not None
+        self.quarantine = open('{}/quarantine.json'.format(dirname), 'a' if append else 'w')
+        self.invalid_items = Counter()  # report id --> dropped items
+
+    def close_spider(self, spider):
+        self.quarantine.close()
+
+    @timed
+    def process_item(self, item, spider):
+        if isinstance(item, ReportDone):
+            item['invalid_items'] = self.invalid_items.pop(item['id'], 0)
+            return item
+
+        for item_type, name in self.item_types:
+            if isinstance(item, item_type):
+                break
+        else:
+            return item
+
+        errors = self.validators[name](item)
+        if not errors:
+            self.stats.inc_value('validation/valid/{}'.format(name), spider=spider)
+            return item
+
+        self.stats.inc_value('validation/invalid/{}'.format(name), spider=spider)
+        self.invalid_items[item.get('id')] += 1
+        self.quarantine.write(json.dumps({'type': name, 'errors': errors, 'record': dict(item)},
+                                         ensure_ascii=False, default=str) + '\n')
+        raise DropItem('invalid {} item from {}: {}'.format(name, item.get('source_url'), errors))
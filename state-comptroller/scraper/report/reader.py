@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""Random access to output JSON Lines files, using byte offset indexes.
+
+Reading a single report's chapters and topics shouldn't mean
+decoding every line of chapters.json and topics.json.
+
+Each output file gets a sidecar offset index (e.g. topics.json.idx),
+mapping keys to the (start, end) byte offsets of their lines:
+
+    prefaces.json   "503"
+    chapters.json   "503", "503:1"
+    topics.json     "503", "503:1"
+
+i.e. report id, and report id + chapter num for chapters and topics.
+The output file itself is mmap'ed, and only requested lines are decoded.
+
+Indexes are built on first use, and rebuilt whenever the output file
+changed since (by size and modification time).
+A file can be read while it's being appended to (e.g. during a crawl):
+a trailing line without a newline is still being written, so it isn't indexed.
+
+    reader = OutputReader('output')
+    reader.preface('503')
+    reader.chapters('503')
+    reader.topics('503', chapter_num=1)
+
+The module can also be executed manually to print records:
+
+    python -m report.reader output 503 [chapter num]
+"""
+
+import argparse
+import json
+import mmap
+from os import fstat, replace
+from os.path import exists, join
+
+
+def keys(name, record):
+    """Return index keys of output record."""
+    if name == 'prefaces':
+        return [record['id']]
+    return [record['id'], '{}:{}'.format(record['id'], record['chapter_num'])]
+
+
+class JsonLinesIndex(object):
+    """mmap'ed JSON Lines file with a sidecar byte offset index."""
+
+    def __init__(self, path, keys):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.keys = keys
+
+        with open(path, 'rb') as f:
+            st = fstat(f.fileno())
+            # mmap fails on empty files
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b''
+        # the file may have grown since fstat, so the mapped size is what was actually read
+        self.mtime = st.st_mtime_ns
+
+        self.offsets = self.load_index()
+        if self.offsets is None:
+            self.offsets = self.build_index()
+
+    def version(self):
+        return [len(self.data), self.mtime]
+
+    def load_index(self):
+        """Return offsets from index file, or None if it's missing or stale."""
+        if not exists(self.index_path):
+            return None
+
+        with open(self.index_path, 'r') as f:
+            index = json.load(f)
+        if index['version'] != self.version():
+            return None
+        return index['offsets']
+
+    def build_index(self):
+        """Scan file and dump offsets of every complete line by key."""
+        offsets = {}
+        start = 0
+        size = self.data.rfind(b'\n') + 1
+        while start < size:
+            end = self.data.find(b'\n', start)
+
+            line = self.data[start:end]
+            if line.strip():
+                for key in self.keys(json.loads(line.decode('utf-8'))):
+                    offsets.setdefault(key, []).append([start, end])
+            start = end + 1
+
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.version(), 'offsets': offsets}, f)
+        replace(tmp_path, self.index_path)
+
+        return offsets
+
+    def get(self, key):
+        """Return decoded records of key, in file order."""
+        return [json.loads(self.data[start:end].decode('utf-8')) for (start, end) in self.offsets.get(key, [])]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+class OutputReader(object):
+    """Read prefaces, chapters and topics of single reports from output directory."""
+
+    def __init__(self, dirname):
+        self.indexes = {name: JsonLinesIndex(join(dirname, '{}.json'.format(name)),
+                                             lambda record, name=name: keys(name, record))
+                        for name in ['prefaces', 'chapters', 'topics']}
+
+    def close(self):
+        for index in self.indexes.values():
+            index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def reports(self):
+        return list(self.indexes['prefaces'].offsets)
+
+    def preface(self, id):
+        """Return preface of report, or None if it doesn't exist."""
+        prefaces = self.indexes['prefaces'].get(id)
+        return prefaces[0] if prefaces else None
+
+    def chapters(self, id):
+        return self.indexes['chapters'].get(id)
+
+    def chapter(self, id, chapter_num):
+        """Return chapter of report, or None if it doesn't exist."""
+        chapters = self.indexes['chapters'].get('{}:{}'.format(id, chapter_num))
+        return chapters[0] if chapters else None
+
+    def topics(self, id, chapter_num=None):
+        """Return topics of report, or only of one of its chapters."""
+        if chapter_num is None:
+            return self.indexes['topics'].get(id)
+        return self.indexes['topics'].get('{}:{}'.format(id, chapter_num))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print a report, or a single chapter, from output directory.')
+    parser.add_argument('dirname', help='scraper output directory')
+    parser.add_argument('id', help='report id')
+    parser.add_argument('chapter_num', nargs='?', type=int)
+    args = parser.parse_args()
+
+    with OutputReader(args.dirname) as reader:
+        if args.chapter_num is None:
+            records = [reader.preface(args.id)] + reader.chapters(args.id) + reader.topics(args.id)
+        else:
+            records = [reader.chapter(args.id, args.chapter_num)] + reader.topics(args.id, args.chapter_num)
+
+    for record in records:
+        if record is not None:
+            print(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""Precomputed related topics, using TF-IDF cosine similarity.
+
+Every topic (title + body) is a row of a sparse TF-IDF matrix:
+
+    - terms are normalized words (see report.text), along with their
+      variants without hebrew prefixes, same as the search index
+    - term frequencies are sublinear (1 + log tf), weighted by idf = log(N / df)
+    - terms appearing in a single topic can't relate topics, and terms appearing
+      in more than max_df of all topics are too common to, so both are dropped
+    - rows are L2 normalized, so a row product is the cosine similarity
+
+The top k neighbors of every topic are found by multiplying blocks of rows
+by the transposed matrix. Only a block_size x topics dense similarity block
+is held in memory at a time, and its top k are selected with argpartition.
+Topics of the same report are not neighbors, since they're already
+browsed together.
+
+Neighbors are dumped into a compact table, where topics are keyed by
+(id, chapter_num, ordinal), ordinal being the topic's 1-based position inside its chapter:
+
+    related.npz
+        ids, chapter_nums, ordinals     topic keys, indexed by topic number
+        neighbors                       topics x k topic numbers, -1 if missing
+        scores                          topics x k cosine similarities
+
+    python -m report.related build output
+    python -m report.related query output 104 1 2
+"""
+
+import argparse
+import json
+import math
+from collections import Counter
+from os.path import join
+
+import numpy as np
+import scipy.sparse as sp
+
+from report.text import prefix_variants, words
+
+
+def load_topics(dirname):
+    """Return topic keys and texts of output directory."""
+    keys = []
+    texts = []
+    ordinals = Counter()
+    with open(join(dirname, 'topics.json'), 'r') as f:
+        for line in f:
+            topic = json.loads(line)
+            ordinals[(topic['id'], topic['chapter_num'])] += 1
+            keys.append((topic['id'], topic['chapter_num'], ordinals[(topic['id'], topic['chapter_num'])]))
+            texts.append(' '.join(t for t in [topic['title'], topic['body']] if t))
+    return keys, texts
+
+
+def tfidf_matrix(texts, max_df=0.5):
+    """Return L2 normalized sparse TF-IDF matrix of texts, a row per text."""
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    counts = []
+    for text in texts:
+        frequencies = Counter()
+        for token in words(text):
+            frequencies.update(prefix_variants(token))
+        for term, frequency in frequencies.items():
+            indices.append(vocabulary.setdefault(term, len(vocabulary)))
+            counts.append(frequency)
+        indptr.append(len(indices))
+
+    matrix = sp.csr_matrix((np.array(counts, dtype=np.float32), np.array(indices, dtype=np.int32), indptr),
+                           shape=(len(texts), len(vocabulary)))
+
+    df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log(len(texts) / np.maximum(df, 1)).astype(np.float32)
+    idf[(df < 2) | (df > max_df * len(texts))] = 0
+
+    matrix.data = 1 + np.log(matrix.data)
+    matrix = matrix.multiply(idf).tocsr()
+    matrix.eliminate_zeros()
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sp.csr_matrix(sp.diags(1 / norms).dot(matrix), dtype=np.float32)
+
+
+def top_neighbors(matrix, groups, k=10, block_size=512, min_score=0.05):
+    """Return (neighbors, scores) arrays of the k most similar rows of every row.
+
+    groups: group number of every row. rows of the same group aren't neighbors
+    """
+    count = matrix.shape[0]
+    neighbors = np.full((count, k), -1, dtype=np.int32)
+    scores = np.zeros((count, k), dtype=np.float32)
+    transposed = matrix.T.tocsc()
+
+    for start in range(0, count, block_size):
+        end = min(start + block_size, count)
+        similarities = matrix[start:end].dot(transposed).toarray()
+        similarities[groups[start:end, None] == groups[None, :]] = 0
+
+        top = np.argpartition(-similarities, min(k, count - 1), axis=1)[:, :k]
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        missing = top_scores < min_score
+        top[missing] = -1
+        top_scores[missing] = 0
+        neighbors[start:end, :top.shape[1]] = top
+        scores[start:end, :top.shape[1]] = top_scores
+
+    return neighbors, scores
+
+
+def build(dirname, k=10, block_size=512, min_score=0.05, max_df=0.5):
+    """Build related topics table of output directory."""
+    keys, texts = load_topics(dirname)
+    matrix = tfidf_matrix(texts, max_df)
+
+    ids = np.array([key[0] for key in keys])
+    _, groups = np.unique(ids, return_inverse=True)
+    neighbors, scores = top_neighbors(matrix, groups, k, block_size, min_score)
+
+    np.savez_compressed(join(dirname, 'related.npz'),
+                        ids=ids,
+                        chapter_nums=np.array([key[1] for key in keys], dtype=np.int32),
+                        ordinals=np.array([key[2] for key in keys], dtype=np.int32),
+                        neighbors=neighbors,
+                        scores=scores)
+
+
+class RelatedTopics(object):
+    """Lookup of precomputed related topics."""
+
+    def __init__(self, dirname):
+        table = np.load(join(dirname, 'related.npz'))
+        self.ids = table['ids']
+        self.chapter_nums = table['chapter_nums']
+        self.ordinals = table['ordinals']
+        self.neighbors = table['neighbors']
+        self.scores = table['scores']
+        self.numbers = {self.key(num): num for num in range(len(self.ids))}
+
+    def key(self, num):
+        return (str(self.ids[num]), int(self.chapter_nums[num]), int(self.ordinals[num]))
+
+    def related(self, id, chapter_num, ordinal):
+        """Return (key, score) of topics related to topic, most similar first."""
+        num = self.numbers.get((id, chapter_num, ordinal))
+        if num is None:
+            return []
+        return [(self.key(neighbor), float(score))
+                for (neighbor, score) in zip(self.neighbors[num], self.scores[num])
+                if neighbor >= 0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query precomputed related topics.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    build_parser = subparsers.add_parser('build', help='build related topics table of output directory')
+    build_parser.add_argument('dirname', help='scraper output directory')
+    build_parser.add_argument('-k', type=int, default=10, help='neighbors per topic')
+    build_parser.add_argument('--block-size', type=int, default=512, help='topics per similarity block')
+    build_parser.add_argument('--min-score', type=float, default=0.05)
+    build_parser.add_argument('--max-df', type=float, default=0.5,
+                              help='drop terms appearing in more than this fraction of topics')
+
+    query_parser = subparsers.add_parser('query', help='print topics related to topic')
+    query_parser.add_argument('dirname', help='scraper output directory')
+    query_parser.add_argument('id')
+    query_parser.add_argument('chapter_num', type=int)
+    query_parser.add_argument('ordinal', type=int, help="1-based position of topic in its chapter")
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.dirname, args.k, args.block_size, args.min_score, args.max_df)
+    else:
+        for key, score in RelatedTopics(args.dirname).related(args.id, args.chapter_num, args.ordinal):
+            print(json.dumps({'id': key[0], 'chapter_num': key[1], 'ordinal': key[2], 'score': round(score, 4)},
+                             ensure_ascii=False))
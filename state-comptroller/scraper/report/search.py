@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""Embedded full-text search over the scraped corpus, with no external service.
+
+Exploring the data with Elasticsearch requires the whole docker stack.
+Instead, this builds a small file-based inverted index over topics
+(title, body and chapter title), joined with their report's metadata:
+
+    lexicon.json    term --> [postings offset, document frequency]
+    postings.bin    (document number, term frequency) uint32 pairs,
+                    grouped by term. memory mapped at query time
+    documents.json  per-document metadata used for filters and results
+
+Hebrew prefixes (ה/ו/ב/ל/מ/ש/כ) are handled by indexing every word
+along with its prefix-stripped variants (see report.text.prefix_variants),
+so searching "משרד" also matches "ובמשרד".
+
+Results are ranked with BM25.
+Office, keyword and report type filters are exact-match postings
+in the same lexicon, e.g. "office:משרד האוצר".
+
+    python -m report.search build output
+    python -m report.search query output "איכות מי השתייה" --office "משרד הבריאות" --since 2015-01-01
+"""
+
+import argparse
+import heapq
+import json
+import math
+import mmap
+import sys
+import time
+from array import array
+from collections import Counter
+from os import fstat, makedirs
+from os.path import exists, join
+
+from report.text import prefix_variants, words
+
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# document fields which can be used as exact-match filters
+FILTER_FIELDS = ['office', 'keyword', 'report_type']
+
+
+def load_documents(dirname):
+    """Generate search documents from output directory, joining topics with their report and chapter."""
+    with open(join(dirname, 'prefaces.json'), 'r') as f:
+        reports = {p['id']: p for p in (json.loads(line) for line in f)}
+    with open(join(dirname, 'chapters.json'), 'r') as f:
+        chapters = {(c['id'], c['chapter_num']): c for c in (json.loads(line) for line in f)}
+
+    ordinals = Counter()
+    with open(join(dirname, 'topics.json'), 'r') as f:
+        for line in f:
+            topic = json.loads(line)
+            key = (topic['id'], topic['chapter_num'])
+            ordinals[key] += 1
+
+            report = reports.get(topic['id'], {})
+            chapter = chapters.get(key, {})
+            offices = [topic['office']] if topic['office'] else []
+            offices += [o for o in chapter.get('offices', []) if o not in offices]
+
+            yield {
+                'id': topic['id'],
+                'chapter_num': topic['chapter_num'],
+                'ordinal': ordinals[key],
+                'title': topic['title'],
+                'chapter_title': chapter.get('title'),
+                'report_name': report.get('report_name'),
+                'report_type': report.get('report_type'),
+                'publish_date': report.get('publish_date'),
+                'office': offices,
+                'keyword': chapter.get('keywords', []),
+                'text': ' '.join(t for t in [topic['title'], topic['body'], chapter.get('title')] if t),
+            }
+
+
+def filter_term(field, value):
+    return '{}:{}'.format(field, value)
+
+
+def build(dirname, index_dirname):
+    """Build search index files for output directory."""
+    postings = {}
+    documents = []
+    lengths = []
+
+    for num, document in enumerate(load_documents(dirname)):
+        tokens = words(document.pop('text'))
+        lengths.append(len(tokens))
+
+        frequencies = Counter()
+        for token in tokens:
+            frequencies.update(prefix_variants(token))
+
+        for field in FILTER_FIELDS:
+            values = document[field]
+            for value in (values if isinstance(values, list) else [values]):
+                if value:
+                    frequencies[filter_term(field, value)] = 1
+
+        for term, frequency in frequencies.items():
+            postings.setdefault(term, array('I')).extend((num, frequency))
+
+        documents.append(document)
+
+    if not exists(index_dirname):
+        makedirs(index_dirname)
+
+    lexicon = {}
+    offset = 0
+    with open(join(index_dirname, 'postings.bin'), 'wb') as f:
+        for term in sorted(postings):
+            term_postings = postings[term]
+            lexicon[term] = [offset, len(term_postings) // 2]
+            term_postings.tofile(f)
+            offset += len(term_postings) // 2
+
+    with open(join(index_dirname, 'lexicon.json'), 'w') as f:
+        json.dump(lexicon, f, ensure_ascii=False)
+
+    with open(join(index_dirname, 'documents.json'), 'w') as f:
+        json.dump({'documents': documents, 'lengths': lengths}, f, ensure_ascii=False)
+
+
+class SearchIndex(object):
+    """Query a search index built by build()."""
+
+    def __init__(self, index_dirname):
+        with open(join(index_dirname, 'lexicon.json'), 'r') as f:
+            self.lexicon = json.load(f)
+        with open(join(index_dirname, 'documents.json'), 'r') as f:
+            data = json.load(f)
+        self.documents = data['documents']
+        self.lengths = data['lengths']
+        self.average_length = sum(self.lengths) / max(len(self.lengths), 1)
+
+        self.file = open(join(index_dirname, 'postings.bin'), 'rb')
+        # mmap fails on empty files i.e. an index of an empty corpus
+        self.postings_map = (mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                             if fstat(self.file.fileno()).st_size else b'')
+        self.postings_view = memoryview(self.postings_map).cast('I')
+
+    def close(self):
+        self.postings_view.release()
+        if isinstance(self.postings_map, mmap.mmap):
+            self.postings_map.close()
+        self.file.close()
+
+    def postings(self, term):
+        """Return (document number, term frequency) pairs for term, straight from the memory map."""
+        try:
+            offset, df = self.lexicon[term]
+        except KeyError:
+            return []
+        view = self.postings_view[offset * 2:(offset + df) * 2]
+        return zip(view[::2], view[1::2])
+
+    def filtered(self, filters):
+        """Return set of document numbers matching all (field, value) filters, or None if there are none."""
+        matches = None
+        for field, value in filters:
+            docs = {num for (num, _) in self.postings(filter_term(field, value))}
+            matches = docs if matches is None else matches & docs
+        return matches
+
+    def search(self, query, filters=(), since=None, until=None, limit=10):
+        """Return top (score, document) pairs for query.
+
+        filters is a list of (field, value) pairs, see FILTER_FIELDS.
+        since and until are inclusive 'YYYY-MM-DD' publish date bounds.
+        An empty query returns all filtered documents, with a score of 0.
+        """
+        allowed = self.filtered(filters)
+
+        def accept(num):
+            if allowed is not None and num not in allowed:
+                return False
+            date = self.documents[num]['publish_date']
+            if since is not None and (date is None or date < since):
+                return False
+            if until is not None and (date is None or date > until):
+                return False
+            return True
+
+        terms = words(query)
+        if not terms:
+            candidates = allowed if allowed is not None else range(len(self.documents))
+            return [(0.0, self.documents[num]) for num in sorted(candidates) if accept(num)][:limit]
+
+        total = len(self.documents)
+        scores = Counter()
+        for term in terms:
+            postings = list(self.postings(term))
+            if not postings:
+                continue
+
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for num, tf in postings:
+                norm = K1 * (1 - B + B * self.lengths[num] / self.average_length)
+                scores[num] += idf * tf * (K1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(limit, ((score, num) for (num, score) in scores.items() if accept(num)))
+        return [(score, self.documents[num]) for (score, num) in top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Embedded full-text search over scraped output.')
+    commands = parser.add_subparsers(dest='command')
+
+    build_parser = commands.add_parser('build', help='build index for output directory')
+    build_parser.add_argument('dirname')
+
+    query_parser = commands.add_parser('query', help='query index of output directory')
+    query_parser.add_argument('dirname')
+    query_parser.add_argument('query', nargs='?', default='')
+    query_parser.add_argument('--office', action='append', default=[])
+    query_parser.add_argument('--keyword', action='append', default=[])
+    query_parser.add_argument('--type', dest='report_type', action='append', default=[])
+    query_parser.add_argument('--since', help='YYYY-MM-DD')
+    query_parser.add_argument('--until', help='YYYY-MM-DD')
+    query_parser.add_argument('-n', '--limit', type=int, default=10)
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        sys.exit(1)
+
+    index_dirname = join(args.dirname, 'search')
+    if args.command == 'build':
+        build(args.dirname, index_dirname)
+        sys.exit(0)
+
+    index = SearchIndex(index_dirname)
+    filters = ([('office', v) for v in args.office] +
+               [('keyword', v) for v in args.keyword] +
+               [('report_type', v) for v in args.report_type])
+
+    start = time.perf_counter()
+    results = index.search(args.query, filters, args.since, args.until, args.limit)
+    elapsed = time.perf_counter() - start
+
+    for score, document in results:
+        print('{:.3f}\t{}\t{}:{}:{}\t{}'.format(score, document['publish_date'], document['id'],
+                                               document['chapter_num'], document['ordinal'],
+                                               document['title']))
+    print('{} results in {:.2f}ms'.format(len(results), elapsed * 1000), file=sys.stderr)
+    index.close()
@@ -7,10 +7,53 @@ USER_AGENT = 'open-audit (++http://hasadna.org.il)'
 
 ROBOTSTXT_OBEY = True
 
+# directory pipelines dump output into
+OUTPUT_DIR = 'output'
+
 ITEM_PIPELINES = {
+    'report.pipelines.ValidationPipeline': 200,
     'report.pipelines.ReportPipeline': 300,
+    'report.pipelines.ColumnarExportPipeline': 310,
+    'report.pipelines.EntitiesPipeline': 320,
+    'report.pipelines.CatalogPipeline': 330,
+    'report.pipelines.DefectIndexPipeline': 340,
+    'report.pipelines.CubePipeline': 350,
 }
 
+# report catalog, see report.catalog
+CATALOG_PATH = 'output/catalog.db'
+# only crawl reports the catalog doesn't have completely scraped yet,
+# appending them to the existing output
+CATALOG_SKIP_KNOWN = False
+
+# defect --> offices, keywords and reports index, see report.defects
+DEFECT_INDEX_PATH = 'output/defects.db'
+
+# aggregate cube of reports, topics and defects, see report.cube
+CUBE_PATH = 'output/cube.db'
+
+# crawls with JOBDIR set (-s JOBDIR=crawls/full) can be resumed after they're stopped or crash.
+# their output is checkpointed every CHECKPOINT_INTERVAL seconds, see report.checkpoint
+CHECKPOINT_INTERVAL = 60
+
+# only enabled when crawling with a shared frontier, see report.frontier
+SPIDER_MIDDLEWARES = {
+    'report.frontier.FrontierMiddleware': 950,
+}
+DOWNLOADER_MIDDLEWARES = {
+    # sees download errors only once RetryMiddleware (550) gave up on them
+    'report.frontier.FrontierDownloaderMiddleware': 50,
+}
+
+EXTENSIONS = {
+    'report.extensions.StageStatsExtension': 500,
+}
+
+# per-stage timings, items/sec and cache hit rate, see report.extensions
+STAGE_STATS_ENABLED = True
+STAGE_STATS_PATH = 'output/stats.json'
+# STAGE_STATS_PROMETHEUS_PATH = 'output/stats.prom'
+
 HTTPCACHE_ENABLED = True
 HTTPCACHE_ALWAYS_STORE = True  # state-comptroller website asks not cache it. well, fuck that
 
@@ -1,4 +1,3 @@
-import json
 import logging
 from os import makedirs
 from os.path import basename, splitext, exists
@@ -11,14 +10,19 @@ from slimit.parser import Parser
 parser = Parser()
 from slimit.visitors import nodevisitor
 
-from scrapy import Spider, Request
-from scrapy.selector import Selector
+from scrapy import Spider, Request, signals
+from scrapy.exceptions import DontCloseSpider
 
+from report.catalog import Catalog, iter_listing, listing_priority
+from report.checkpoint import load_checkpoint, segments_dirname
 from report.spiders.defects_mapping import defects_mapping_from_js_ast
+from report.stats import stage_timer, timed
 from report.items import (
     ReportPreface,
     ReportChapter,
     ReportTopic,
+    ReportListing,
+    ReportDone,
 )
 
 
@@ -42,6 +46,15 @@ class ReportSpider(Spider):
 
     reports = {}
 
+    # listed reports which weren't exported yet, when crawling with JOBDIR set
+    listed = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
     def init_report(self, response):
         """Initialize a new report entry.
 
@@ -62,6 +75,7 @@ class ReportSpider(Spider):
         }
         return id
 
+    @timed
     def set_meta_defects_mappings(self, response, report):
         """Set offices and tags-to-defects mapping from report "header".
 
@@ -118,8 +132,11 @@ class ReportSpider(Spider):
         # parse javascript syntax tree
 
         try:
-            js_ast = parser.parse(js)
+            with stage_timer(self.crawler.stats, 'ReportSpider.js_parse'):
+                js_ast = parser.parse(js)
         except SyntaxError as e:
+            self.crawler.stats.inc_value('js_parse/failures', spider=self)
+
             # if parsing failed,
             # dump web page to file for later manual examination
             # and return an empty offices/keywords-to-defects dicts
@@ -138,17 +155,90 @@ class ReportSpider(Spider):
 
         report['offices_to_defects'], report['keywords_to_defects'] = defects_mapping_from_js_ast(js_ast)
 
+    def start_requests(self):
+        """Request report list, unless another crawl worker does (see report.frontier)."""
+        if not self.settings.getbool('FRONTIER_SEED', True):
+            return []
+        return super().start_requests()
+
+    @timed
     def parse(self, response):
-        """Parse report list."""
+        """Parse report list, and request every listed report.
+
+        The list is parsed incrementally, and report requests are yielded
+        as soon as their table row is parsed, so the scheduler can start fetching
+        while the rest of the list is still being parsed.
+        Newer reports are requested with a higher priority,
+        so an interrupted crawl has the most recent reports.
+
+        Every list row is yielded as a ReportListing item as well,
+        which is added to the report catalog.
+        If CATALOG_SKIP_KNOWN is set, reports the catalog has completely scraped are skipped.
+
+        When resuming a crawl (see report.checkpoint), reports exported before
+        its last checkpoint are skipped. The rest are still in the persisted request queue,
+        and filtered as duplicates here, unless the previous run lost them (see spider_idle).
+        """
         # response body is a json array,
         # whose first element is a string representation of an
         # html table containing all published reports from 1987 till today. wtf.
-        reports_table = json.loads(response.body)[0]
-        reports_urls = Selector(text=reports_table).xpath('//body/table/tr/td/a/@href').extract()
+        catalog = None
+        if self.settings.getbool('CATALOG_SKIP_KNOWN'):
+            catalog = Catalog(self.settings.get('CATALOG_PATH', 'output/catalog.db'))
+
+        # a resumable crawl's output is only durable once checkpointed,
+        # so the catalog only skips reports done before the crawl started
+        started_at = None
+        segments = segments_dirname(self.settings)
+        if segments is not None:
+            checkpoint = load_checkpoint(segments)
+            self.exported = set(checkpoint['done'])
+            started_at = checkpoint['started_at']
+            self.listed = {}
+
+        try:
+            for row in iter_listing(response.body, response.url):
+                yield ReportListing(**row)
+
+                if catalog is not None and catalog.known(row['id'], before=started_at):
+                    self.crawler.stats.inc_value('catalog/skipped', spider=self)
+                    continue
+                if segments is not None:
+                    if row['id'] in self.exported:
+                        self.crawler.stats.inc_value('checkpoint/skipped', spider=self)
+                        continue
+                    self.listed[row['id']] = row
+
+                yield self.report_request(row)
+        finally:
+            if catalog is not None:
+                catalog.close()
+
+    def report_request(self, row, dont_filter=False):
+        return Request(row['source_url'], callback=self.parse_report, priority=listing_priority(row),
+                       dont_filter=dont_filter)
+
+    def spider_idle(self, spider):
+        """Request listed reports which still weren't exported once, when crawling with JOBDIR set.
+
+        Requests taken off the persisted queue by a previous run, but whose reports
+        weren't exported before it stopped, are lost: they're in neither the queue
+        nor the output, and the dupefilter has already seen them.
+        These are requested again only after the queue was drained,
+        so no report is requested twice at the same time.
+        """
+        if not self.listed:
+            return
 
-        for url in reports_urls:
-            yield Request(response.urljoin(url), callback=self.parse_report)
+        lost = [row for (id, row) in self.listed.items() if id not in self.exported]
+        self.listed = {}
+        for row in lost:
+            self.crawler.stats.inc_value('checkpoint/rerequested', spider=self)
+            self.crawler.engine.crawl(self.report_request(row, dont_filter=True), self)
+        if lost:
+            raise DontCloseSpider
 
+    @timed
     def parse_report(self, response):
         """Parse a single report by calling all other section-specific scrape functions."""
         id = self.init_report(response)
@@ -158,6 +248,9 @@ class ReportSpider(Spider):
         yield self.parse_preface(response, id)
         for item in self.parse_chapters(response, id):
             yield item
+        if self.listed is not None:
+            self.exported.add(id)
+        yield ReportDone(id=id)
 
     def parse_preface(self, response, id):
         """Scrape the report preface section.
@@ -195,6 +288,7 @@ class ReportSpider(Spider):
             body=response.xpath('//*[@id="content_summary"]//text()').extract(),
         )
 
+    @timed
     def parse_chapters(self, response, id):
         """Scrape all report chapters.
 
@@ -240,6 +334,7 @@ class ReportSpider(Spider):
             body=topic.xpath('./div[2]/div[3]/span/p/text()').extract_first(),
         )
 
+    @timed
     def parse_topic_office(self, topic):
         """Return office for current topic.
 
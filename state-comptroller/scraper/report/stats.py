@@ -0,0 +1,72 @@
+"""Per-stage wall and CPU timing of spider callbacks and pipeline methods.
+
+Timings are accumulated into the crawler stats under
+stages/<class name>.<stage>/{calls,wall,cpu},
+and summarized by report.extensions.StageStatsExtension when the spider closes.
+
+Generator callbacks (e.g. parse_report) are timed while they produce items,
+not while scrapy consumes them. Timings are inclusive:
+a callback's time includes the time of the callbacks it calls.
+"""
+
+import inspect
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+def record(stats, stage, wall, cpu, calls=1):
+    stats.inc_value('stages/{}/calls'.format(stage), calls)
+    stats.inc_value('stages/{}/wall'.format(stage), wall, start=0.0)
+    stats.inc_value('stages/{}/cpu'.format(stage), cpu, start=0.0)
+
+
+def crawler_stats(obj):
+    """Return stats collector of spider or pipeline, or None if it isn't bound to a crawler."""
+    crawler = getattr(obj, 'crawler', None)
+    return crawler.stats if crawler is not None else None
+
+
+@contextmanager
+def stage_timer(stats, stage):
+    """Time a block of code as a stage."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            record(stats, stage, time.perf_counter() - wall, time.process_time() - cpu)
+
+
+def timed(func):
+    """Time every call of a spider or pipeline method, including generator methods."""
+    if inspect.isgeneratorfunction(func):
+        @wraps(func)
+        def generator_wrapper(self, *args, **kwargs):
+            stats = crawler_stats(self)
+            stage = '{}.{}'.format(type(self).__name__, func.__name__)
+            generator = func(self, *args, **kwargs)
+            wall = cpu = 0.0
+            try:
+                while True:
+                    start_wall, start_cpu = time.perf_counter(), time.process_time()
+                    try:
+                        value = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        wall += time.perf_counter() - start_wall
+                        cpu += time.process_time() - start_cpu
+                    yield value
+            finally:
+                if stats is not None:
+                    record(stats, stage, wall, cpu)
+
+        return generator_wrapper
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with stage_timer(crawler_stats(self), '{}.{}'.format(type(self).__name__, func.__name__)):
+            return func(self, *args, **kwargs)
+
+    return wrapper
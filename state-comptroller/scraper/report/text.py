@@ -0,0 +1,44 @@
+"""Hebrew text normalization used by the offline tools over scraped output."""
+
+import re
+
+
+# hebrew cantillation marks and niqqud
+NIQQUD_RE = re.compile('[\u0591-\u05c7]')
+
+# quotes inside a word are gershayim/geresh used in acronyms,
+# e.g. מל"ל, צה"ל, ש"ח. we remove them so the acronym stays a single word
+INNER_QUOTES_RE = re.compile('(?<=\\w)["\'\u05f3\u05f4](?=\\w)')
+
+WORD_RE = re.compile(r'\w+')
+
+# single letter prefixes which are attached to hebrew words:
+# ה (the), ו (and), ב (in), ל (to), מ (from), ש (that), כ (as)
+PREFIX_LETTERS = 'הובלמשכ'
+
+
+def normalize(text):
+    """Lowercase and strip niqqud and acronym quotes from text."""
+    return INNER_QUOTES_RE.sub('', NIQQUD_RE.sub('', text.lower()))
+
+
+def words(text):
+    """Return normalized words in text."""
+    return WORD_RE.findall(normalize(text)) if text else []
+
+
+def prefix_variants(word, max_prefixes=3, min_length=3):
+    """Return word and its variants with leading hebrew prefixes stripped.
+
+    e.g. "ובמשרד" --> ["ובמשרד", "במשרד", "משרד"]
+
+    We can't tell a prefix from a word's first letter without a dictionary,
+    so every variant is returned. The remaining word must be at least min_length long.
+    """
+    variants = [word]
+    for _ in range(max_prefixes):
+        if word[0] not in PREFIX_LETTERS or len(word) - 1 < min_length:
+            break
+        word = word[1:]
+        variants.append(word)
+    return variants
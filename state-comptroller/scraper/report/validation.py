@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""Schema validation for scraped items and output files.
+
+The pipeline emits whatever the XPaths return,
+so a missing publish date or an unexpected document link
+either crashes the pipeline or silently drops the item.
+
+Schemas here are plain dicts of field name --> Field,
+compiled into a single python function per schema (see compile_schema),
+so validating a record costs about as much as a few attribute lookups per field.
+
+Validation runs in two places:
+
+    - ValidationPipeline checks raw items before ReportPipeline cleans them,
+      and quarantines invalid ones to output/quarantine.json instead of crashing
+    - this module can be executed manually to check existing output files,
+      quarantining invalid lines to a side file next to each one:
+
+        python -m report.validation output
+"""
+
+import json
+import re
+import sys
+import time
+from collections import namedtuple
+from os.path import basename, join, splitext
+from urllib.parse import urlsplit
+
+
+Field = namedtuple('Field', ['types', 'nullable', 'pattern', 'items', 'check'])
+
+
+def field(*types, nullable=False, pattern=None, items=None, check=None):
+    """Describe a record field.
+
+    types: allowed python types of the value
+    nullable: whether the value can be None
+    pattern: regex string values must match
+    items: type all list items must be
+    check: function returning an error message for the value, or None if it's valid
+    """
+    return Field(types, nullable, re.compile(pattern) if pattern is not None else None, items, check)
+
+
+def defects_mapping_error(value):
+    """Validate an offices/keywords-to-defects mapping."""
+    for key, defects in value.items():
+        if not isinstance(key, str) or not isinstance(defects, list):
+            return 'expected mapping of strings to lists'
+        if any(not isinstance(d, str) for d in defects):
+            return 'expected defect strings'
+    return None
+
+
+def doc_urls_error(value):
+    """Validate topic document urls: at most a single pdf and a single docx."""
+    extensions = [splitext(basename(urlsplit(url).path))[1].lower() for url in value]
+    unsupported = [ext for ext in extensions if ext not in ('.pdf', '.docx')]
+    if unsupported:
+        return 'unsupported document types {}'.format(unsupported)
+    if extensions.count('.pdf') > 1 or extensions.count('.docx') > 1:
+        return 'multiple documents of the same type'
+    return None
+
+
+URL = r'^https?://'
+DATE = r'^\d{4}-\d{2}-\d{2}$'
+
+# schemas of cleaned output records, by output file name
+OUTPUT_SCHEMAS = {
+    'prefaces': {
+        'id': field(str, pattern=r'^\S+$'),
+        'source_url': field(str, pattern=URL),
+        'report_name': field(str),
+        'report_type': field(str, nullable=True),
+        'catalog_number': field(str, nullable=True),
+        'publish_date': field(str, pattern=DATE),
+        'issn_number': field(str, nullable=True),
+        'toc_pdf_hebrew_url': field(str, nullable=True),
+        'toc_docx_hebrew_url': field(str, nullable=True),
+        'intro_pdf_hebrew_url': field(str, nullable=True),
+        'intro_docx_hebrew_url': field(str, nullable=True),
+        'intro_pdf_arabic_url': field(str, nullable=True),
+        'intro_docx_arabic_url': field(str, nullable=True),
+        'offices_to_defects': field(dict, check=defects_mapping_error),
+        'keywords_to_defects': field(dict, check=defects_mapping_error),
+        'body': field(list, nullable=True, items=str),
+    },
+    'chapters': {
+        'id': field(str, pattern=r'^\S+$'),
+        'source_url': field(str, pattern=URL),
+        'chapter_num': field(int),
+        'title': field(str),
+        'offices': field(list, items=str),
+        'keywords': field(list, items=str),
+    },
+    'topics': {
+        'id': field(str, pattern=r'^\S+$'),
+        'source_url': field(str, pattern=URL),
+        'chapter_num': field(int),
+        'pdf_url': field(str, nullable=True, pattern=URL),
+        'docx_url': field(str, nullable=True, pattern=URL),
+        'title': field(str, nullable=True),
+        'office': field(str, nullable=True),
+        'body': field(str, nullable=True),
+    },
+}
+
+# schemas of raw scraped items, checked before they are cleaned by ReportPipeline.
+# only fields the pipeline can't handle being missing or malformed are listed
+ITEM_SCHEMAS = {
+    'prefaces': {
+        'id': field(str),
+        'report_name': field(str),
+        'publish_date': field(str, pattern=r'^\s*\d{1,2}/\d{1,2}/\d{4}\s*$'),
+        'offices_to_defects': field(dict, check=defects_mapping_error),
+        'keywords_to_defects': field(dict, check=defects_mapping_error),
+        'body': field(list, items=str),
+    },
+    'chapters': {
+        'id': field(str),
+        'title': field(str),
+        'offices': field(list, items=str),
+        'keywords': field(list, items=str),
+    },
+    'topics': {
+        'id': field(str),
+        'domain': field(str),
+        'doc_urls': field(list, items=str, check=doc_urls_error),
+    },
+}
+
+
+def compile_schema(schema):
+    """Compile schema into a function returning a list of errors for a record.
+
+    We generate the source of a single function checking all fields in a row,
+    which is considerably faster than interpreting the schema for every record.
+    """
+    lines = ['def validate(record):',
+             '    errors = []',
+             '    get = record.get']
+    namespace = {'MISSING': object()}
+
+    for num, (name, spec) in enumerate(sorted(schema.items())):
+        namespace['TYPES_{}'.format(num)] = spec.types
+        lines += [
+            '    value = get({!r}, MISSING)'.format(name),
+            '    if value is MISSING:',
+            '        errors.append({!r})'.format('{}: missing'.format(name)),
+            '    elif value is None:',
+            '        {}'.format('pass' if spec.nullable else 'errors.append({!r})'.format('{}: null'.format(name))),
+            '    elif not isinstance(value, TYPES_{}):'.format(num),
+            '        errors.append({!r})'.format('{}: expected {}'.format(name, '/'.join(t.__name__ for t in spec.types))),
+        ]
+
+        if spec.pattern is not None:
+            namespace['PATTERN_{}'.format(num)] = spec.pattern
+            lines += [
+                '    elif PATTERN_{}.search(value) is None:'.format(num),
+                '        errors.append({!r})'.format('{}: does not match {}'.format(name, spec.pattern.pattern)),
+            ]
+
+        if spec.items is not None:
+            namespace['ITEMS_{}'.format(num)] = spec.items
+            lines += [
+                '    elif any(not isinstance(v, ITEMS_{}) for v in value):'.format(num),
+                '        errors.append({!r})'.format('{}: expected {} items'.format(name, spec.items.__name__)),
+            ]
+
+        if spec.check is not None:
+            namespace['CHECK_{}'.format(num)] = spec.check
+            lines += [
+                '    elif CHECK_{}(value) is not None:'.format(num),
+                '        errors.append({!r} + CHECK_{}(value))'.format('{}: '.format(name), num),
+            ]
+
+    lines.append('    return errors')
+
+    exec('\n'.join(lines), namespace)
+    return namespace['validate']
+
+
+def check_file(path, quarantine_path, validate):
+    """Validate every line in JSON Lines file, writing invalid ones to quarantine file.
+
+    Returns number of valid and invalid lines.
+    """
+    valid = invalid = 0
+    with open(path, 'r') as f, open(quarantine_path, 'w') as quarantine:
+        for num, line in enumerate(f, start=1):
+            try:
+                errors = validate(json.loads(line))
+            except ValueError as e:
+                errors = ['invalid json: {}'.format(e)]
+            except AttributeError:
+                errors = ['expected json object']
+
+            if not errors:
+                valid += 1
+                continue
+
+            invalid += 1
+            quarantine.write(json.dumps({'line': num, 'errors': errors, 'record': line.rstrip('\n')},
+                                        ensure_ascii=False) + '\n')
+
+    return valid, invalid
+
+
+if __name__ == '__main__':
+    """Check output files in given directory, and write invalid lines to <name>.quarantine.json"""
+    dirname = sys.argv[1]
+
+    failed = False
+    for name, schema in OUTPUT_SCHEMAS.items():
+        start = time.perf_counter()
+        valid, invalid = check_file(join(dirname, '{}.json'.format(name)),
+                                    join(dirname, '{}.quarantine.json'.format(name)),
+                                    compile_schema(schema))
+        elapsed = time.perf_counter() - start
+
+        print('{}: {} valid, {} invalid ({:.0f} lines/sec)'.format(
+            name, valid, invalid, (valid + invalid) / elapsed if elapsed else 0))
+        failed = failed or invalid > 0
+
+    sys.exit(1 if failed else 0)